@@ -0,0 +1,121 @@
+"""
+売上分析用の列指向データ
+注文(処理中とアーカイブの両方)を商品明細1行ずつの表にして、日別に分割したParquetとして
+ANALYTICS_DIR/day=YYYY-MM-DD/ に保存する。分析はこのファイルだけを読み、Firestoreには問い合わせない。
+pandas / pyarrow は分析を使うときだけ読み込む。
+"""
+
+import datetime
+import os
+
+from order_archive import JST, iter_all_orders
+from order_lines import expand_lines
+
+ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', 'analytics')
+BUCKET_MINUTES = (5, 15, 30, 60)
+
+COLUMNS = ['orderId', 'ticketNumber', 'createdAt', 'status', 'paymentStatus',
+           'itemId', 'name', 'category', 'isSet', 'quantity', 'subtotal', 'day']
+
+def order_rows(order_id, order_data, menu):
+    """1件の注文を商品明細ごとの行に展開する"""
+    created_at = order_data.get('createdAt')
+    if not isinstance(created_at, datetime.datetime):
+        return []
+    created_at = created_at.astimezone(JST)
+    rows = []
+    for item in expand_lines(order_data, menu):
+        if item.get('isSet'):
+            category = menu['items_by_id'].get(item.get('id'), {}).get('category', 'セット')
+            quantity, subtotal = 1, item['price']
+        else:
+            category = menu['items_by_name'].get(item['name'], {}).get('category', '未分類')
+            quantity, subtotal = item['quantity'], item['price'] * item['quantity']
+        rows.append({
+            'orderId': order_id, 'ticketNumber': order_data.get('ticketNumber', ''), 'createdAt': created_at,
+            'status': order_data.get('status', ''), 'paymentStatus': order_data.get('paymentStatus', ''),
+            'itemId': item.get('id', ''), 'name': item['name'], 'category': category, 'isSet': bool(item.get('isSet')),
+            'quantity': quantity, 'subtotal': subtotal, 'day': created_at.strftime('%Y-%m-%d'),
+        })
+    return rows
+
+def snapshot_orders(db, menu, directory=ANALYTICS_DIR, log=print):
+    """全注文をParquetに書き出す。注文のある日の分割ファイルだけを置き換える"""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = []
+    for order_doc in iter_all_orders(db):
+        rows.extend(order_rows(order_doc.id, order_doc.to_dict(), menu))
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    if df.empty:
+        log("分析データ: 注文がありません")
+        return {'rows': 0, 'days': []}
+    df['createdAt'] = pd.to_datetime(df['createdAt'], utc=True).dt.tz_convert('Asia/Tokyo')
+    pq.write_to_dataset(pa.Table.from_pandas(df, preserve_index=False), directory, partition_cols=['day'],
+                        existing_data_behavior='delete_matching')
+    days = sorted(df['day'].unique().tolist())
+    log(f"分析データを書き出しました: {len(df)}行 ({', '.join(days)})")
+    return {'rows': len(df), 'days': days}
+
+def load_lines(directory=ANALYTICS_DIR, start=None, end=None):
+    """保存済みの明細を読み込む。start / end ('YYYY-MM-DD', 両端を含む) で日を絞り込む"""
+    import pandas as pd
+
+    if not os.path.isdir(directory):
+        return pd.DataFrame(columns=COLUMNS)
+    filters = []
+    if start:
+        filters.append(('day', '>=', start))
+    if end:
+        filters.append(('day', '<=', end))
+    df = pd.read_parquet(directory, filters=filters or None)
+    df['day'] = df['day'].astype(str)
+    df['createdAt'] = pd.to_datetime(df['createdAt'], utc=True).dt.tz_convert('Asia/Tokyo')
+    return df
+
+def throughput(df, minutes):
+    """bucket分ごとの注文数・売上・販売数"""
+    if df.empty:
+        return []
+    grouped = df.groupby(df['createdAt'].dt.floor(f'{minutes}min'))
+    result = grouped.agg(orders=('orderId', 'nunique'), revenue=('subtotal', 'sum'), items=('quantity', 'sum')).reset_index()
+    return [{'start': bucket.isoformat(), 'orders': int(orders), 'revenue': int(revenue), 'items': int(items)}
+            for bucket, orders, revenue, items in result.itertuples(index=False)]
+
+def peak_hours(df, top=3):
+    """
+    時間帯(時)ごとの注文数・売上と、1時間あたりの注文が多い時間帯の上位。
+    ordersPerDay は期間中の営業日(注文のあった日)の数で割る (その時間帯に注文が無かった日も0件として平均に含める)
+    """
+    if df.empty:
+        return {'hours': [], 'peaks': []}
+    days = df['day'].nunique()
+    hours = df.groupby(df['createdAt'].dt.hour).agg(orders=('orderId', 'nunique'), revenue=('subtotal', 'sum'))
+    hours['ordersPerDay'] = hours['orders'] / days
+    rows = [{'hour': int(hour), 'orders': int(row.orders), 'revenue': int(row.revenue), 'ordersPerDay': round(float(row.ordersPerDay), 1)}
+            for hour, row in hours.iterrows()]
+    peaks = sorted(rows, key=lambda row: -row['ordersPerDay'])[:top]
+    return {'hours': rows, 'peaks': peaks}
+
+def item_mix(df):
+    """時間帯(時)ごとの商品別販売数と、その時間帯の中での構成比"""
+    if df.empty:
+        return []
+    counts = df.pivot_table(index=df['createdAt'].dt.hour, columns='name', values='quantity', aggfunc='sum', fill_value=0)
+    shares = counts.div(counts.sum(axis=1), axis=0).round(3)
+    return [{'hour': int(hour), 'quantities': {name: int(value) for name, value in counts.loc[hour].items() if value},
+             'shares': {name: float(value) for name, value in shares.loc[hour].items() if value}}
+            for hour in counts.index]
+
+def build_report(directory=ANALYTICS_DIR, start=None, end=None, bucket_minutes=15):
+    df = load_lines(directory, start, end)
+    return {
+        'rows': len(df),
+        'days': sorted(df['day'].unique().tolist()) if not df.empty else [],
+        'bucketMinutes': bucket_minutes,
+        'throughput': throughput(df, bucket_minutes),
+        'peakHours': peak_hours(df),
+        'itemMix': item_mix(df),
+    }
@@ -4,35 +4,226 @@
 """
 
 # --- ライブラリのインポート ---
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, flash
+from firebase_admin import firestore
+from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, flash, make_response, g, session, send_from_directory
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from werkzeug.local import LocalProxy
 from werkzeug.security import check_password_hash, generate_password_hash
-import random
+from jinja2.utils import htmlsafe_json_dumps
 import datetime
-import pandas as pd
 import io
 import os
+import copy
+import hashlib
+import json
+import csv
+import itertools
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
 from functools import wraps # 権限チェックデコレータのために追加
+from menu_import import parse_menu_csv, sync_menu_items
+import analytics
+from image_cache import ImageCache, IMAGE_FORMATS, snap_width
+import idempotency
+from order_feed import OrderStatusFeed, PrepBoard
+from order_lines import compact_lines, expand_lines, expand_order, migrate_orders
+from wait_time import WaitTimeEstimator
+from stock import stock_shards, read_stock_totals, stock_demand, reserve_stock
+from metrics import metrics, instrument_firestore, init_app as init_metrics
+from order_archive import (ARCHIVE_INDEX, archive_collection_names, archive_finished_orders, archive_in_transaction,
+                           archive_orders_in_transaction, find_archived_order, is_finished, iter_all_orders,
+                           merge_by_created_at)
+import storage
 
 # --- アプリケーションの初期設定 ---
 
-# 1. Firebaseの初期化
-try:
-    cred = credentials.Certificate('firebase-key.json')
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(cred)
-except FileNotFoundError:
-    print("FATAL ERROR: 'firebase-key.json' not found.")
-    print("Please download the service account key from Firebase console.")
-    exit()
+# 1. ストレージ(Firestore または ローカルSQLite)の初期化
+# STORAGE_BACKEND=local の場合はローカルに保存し、Firestoreへはバックグラウンドで同期する
+# Firestore呼び出しの回数・時間を計測できるよう、クライアントを作る前に計測を組み込んでおく
+# クライアントは最初に使われるときに作る (読み込み時には認証情報を読まず、ワーカーの起動を速くする)
+instrument_firestore()
+db = LocalProxy(storage.get_client)
+
+# --- 読み取りキャッシュ (store_settings / permissions / users) ---
+# 毎リクエスト読まれる小さく変更の少ないドキュメントを、プロセス内でTTL付きで保持する
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', 30))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1000))
+
+class DocumentCache:
+    """
+    Firestoreドキュメントの読み取りスルー型TTLキャッシュ。
+    保持する件数は max_entries までとし、超える場合は期限切れのものから (それでも多ければ古いものから) 捨てる。
+    読み込み中に invalidate() された場合は、読み込んだ (古いかもしれない) 内容をキャッシュしない
+    """
+    def __init__(self, ttl, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def _store(self, key, expires_at, data, generation):
+        """ロックを持った状態で呼ぶ"""
+        if generation != self._invalidations:
+            return
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            for expired in [k for k, entry in self._entries.items() if entry[0] <= now]:
+                del self._entries[expired]
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = (expires_at, data)
+
+    def get(self, collection, doc_id, cache_missing=True):
+        """
+        ドキュメントの中身(dict)を返す。存在しない場合はNone。
+        cache_missing=False なら、存在しないことはキャッシュしない (ログインで任意のIDが渡される場合など)
+        """
+        key = (collection, doc_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            generation = self._invalidations
+        doc = db.collection(collection).document(doc_id).get()
+        data = doc.to_dict() if doc.exists else None
+        if data is not None or cache_missing:
+            with self._lock:
+                self._store(key, now + self.ttl, data, generation)
+        return copy.deepcopy(data)
+
+    def prefetch(self, keys, extra_refs=()):
+        """
+        キャッシュに無い(期限切れの)キーと extra_refs を、1回の get_all でまとめて読み込む。
+        extra_refs はキャッシュせず、{パス: スナップショット} で返す
+        """
+        now = time.monotonic()
+        with self._lock:
+            missing = [key for key in dict.fromkeys(keys) if not (key in self._entries and self._entries[key][0] > now)]
+            self.misses += len(missing)
+            generation = self._invalidations
+        missing_refs = [db.collection(collection).document(doc_id) for collection, doc_id in missing]
+        if not missing_refs and not extra_refs:
+            return {}
+        docs = {doc.reference.path: doc for doc in db.get_all(missing_refs + list(extra_refs))}
+        with self._lock:
+            for key, ref in zip(missing, missing_refs):
+                doc = docs.get(ref.path)
+                self._store(key, now + self.ttl, doc.to_dict() if doc is not None and doc.exists else None, generation)
+        return {ref.path: docs.get(ref.path) for ref in extra_refs}
+
+    def invalidate(self, collection, doc_id=None):
+        """指定ドキュメント(doc_id省略時はコレクション全体)をキャッシュから破棄する"""
+        with self._lock:
+            self._invalidations += 1
+            if doc_id is not None:
+                self._entries.pop((collection, doc_id), None)
+            else:
+                for key in [k for k in self._entries if k[0] == collection]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'hitRate': round(self.hits / total, 3) if total else 0.0, 'ttlSeconds': self.ttl}
+
+doc_cache = DocumentCache(CACHE_TTL_SECONDS)
+
+# --- メニューのスナップショット ---
+# itemsコレクションから組み立てたメニュー一式を保持する。itemsをon_snapshotで監視し、
+# 変更があれば届いた内容からそのまま作り直す (注文やページ表示のたびにitemsを読まない)。
+# 監視が動いていない間は、他プロセスでの変更を拾うため最大保持時間を過ぎた場合も作り直す
+MENU_SNAPSHOT_MAX_AGE = float(os.environ.get('MENU_SNAPSHOT_MAX_AGE', 60))
+_menu_lock = threading.RLock()
+_menu_snapshot = None
+_menu_watch = None
+
+def build_menu_snapshot(docs=None):
+    """itemsのドキュメント(省略時はコレクションを読み込む)から、メニュー表示・注文検証用のデータ一式を作成する"""
+    items_list = []
+    items_map = {} # JavaScriptに渡すための商品情報マップ
+    for item in (docs if docs is not None else db.collection('items').stream()):
+        item_data = item.to_dict()
+        item_data['ItemID'] = item.id
+        items_list.append(item_data)
+        items_map[item.id] = {
+            'name': item_data.get('name'),
+            'price': item_data.get('price')
+        }
+    items_list.sort(key=lambda x: x['ItemID'])
+    items_by_id = {item['ItemID']: item for item in items_list}
+    items_by_name = {item.get('name'): item for item in items_list}
+    all_categories = sorted(set(item.get('category', '未分類') for item in items_list))
+    content = json.dumps(items_list, sort_keys=True, ensure_ascii=False, default=str)
+    return {
+        'version': hashlib.sha1(content.encode('utf-8')).hexdigest()[:16],
+        'items': items_list,
+        'categories': all_categories,
+        'items_map': items_map,
+        'items_map_json': htmlsafe_json_dumps(items_map),
+        'items_by_id': items_by_id,
+        'items_by_name': items_by_name,
+        'builtAt': time.monotonic(),
+        'rendered': None,
+    }
+
+def _on_items_snapshot(docs, changes, read_time):
+    global _menu_snapshot
+    snapshot = build_menu_snapshot(docs)
+    with _menu_lock:
+        _menu_snapshot = snapshot
+
+def _menu_watch_active():
+    return _menu_watch is not None and getattr(_menu_watch, 'is_active', True)
+
+def get_menu_snapshot():
+    """現在のメニュースナップショットを返す (無効化済み・期限切れなら作り直す)"""
+    global _menu_snapshot, _menu_watch
+    with _menu_lock:
+        if not _menu_watch_active():
+            try:
+                _menu_watch = db.collection('items').on_snapshot(_on_items_snapshot)
+            except Exception as e:
+                print(f"Error starting menu watch: {e}")
+        snapshot = _menu_snapshot
+        expired = snapshot is not None and not _menu_watch_active() and time.monotonic() - snapshot['builtAt'] > MENU_SNAPSHOT_MAX_AGE
+        if snapshot is None or expired:
+            snapshot = _menu_snapshot = build_menu_snapshot()
+        return snapshot
 
-db = firestore.client()
+def invalidate_menu_snapshot():
+    global _menu_snapshot
+    with _menu_lock:
+        _menu_snapshot = None
 
 # 2. Flaskアプリケーションの初期化
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
+init_metrics(app)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# 3. 画像の縮小版キャッシュ
+image_cache = ImageCache(static_folder=app.static_folder)
+MENU_IMAGE_WIDTHS = (320, 640, 960)
+SIGNAGE_IMAGE_WIDTHS = (1280, 1920)
+
+@app.template_global()
+def menu_image_url(item, width, fmt):
+    """メニュー画像の縮小版のURL。作成済みなら長期キャッシュできるURLを、未作成なら作成用のURLを返す"""
+    name = image_cache.cached_variant(item['imageUrl'], width, fmt)
+    if name:
+        return url_for('image_variant', name=name)
+    return url_for('item_image', item_id=item['ItemID'], w=width, fmt=fmt)
 
 # --- 認証機能 (Flask-Login) の設定 ---
 login_manager = LoginManager()
@@ -51,41 +242,80 @@ class User(UserMixin):
         return self.data.get('role')
 
 @login_manager.user_loader
+@metrics.timed('load_user')
 def load_user(user_id):
-    user_doc = db.collection('users').document(user_id).get()
-    if user_doc.exists:
-        return User(user_doc.to_dict())
+    user_data = doc_cache.get('users', user_id)
+    if user_data:
+        return User(user_data)
     return None
 
 @login_manager.unauthorized_handler
 def unauthorized():
     return redirect(url_for('login', next=request.path))
 
+# --- リクエスト開始時の一括読み込み ---
+# ログインユーザー・権限・店舗設定は1つのリクエストの中で別々の箇所 (load_user / role_required /
+# inject_store_settings) から読まれる。キャッシュに無いものを最初に1回の get_all でまとめて読み、
+# 順番に1件ずつ問い合わせる往復を無くす。エンドポイントごとに必要な追加のドキュメントも同じ往復で読む
+def _order_complete_refs():
+    order_id = request.args.get('order_id')
+    return [db.collection('orders').document(order_id)] if order_id else []
+
+PREFETCH_REFS = {'order_complete': _order_complete_refs}
+
+@app.before_request
+@metrics.timed('prefetch')
+def prefetch_request_documents():
+    if request.endpoint in (None, 'static', 'prometheus_metrics', 'healthz', 'readyz'):
+        return
+    keys = []
+    user_id = session.get('_user_id')
+    if user_id:
+        keys.append(('users', user_id))
+    if not request.path.startswith('/api/'):
+        keys += [('store_settings', 'main'), ('permissions', 'role_access')] if user_id else [('store_settings', 'main')]
+    try:
+        extra_refs = PREFETCH_REFS[request.endpoint]() if request.endpoint in PREFETCH_REFS else []
+        g.prefetched = doc_cache.prefetch(keys, extra_refs)
+    except Exception as e:
+        print(f"Error prefetching documents: {e}")
+
+def prefetched_document(ref):
+    """リクエスト開始時に読み込み済みならそのスナップショットを、無ければ読み込んで返す"""
+    doc = g.get('prefetched', {}).get(ref.path)
+    return doc if doc is not None else ref.get()
+
 @app.context_processor
+@metrics.timed('inject_store_settings')
 def inject_store_settings():
     try:
-        doc = db.collection('store_settings').document('main').get()
-        if doc.exists:
-            return doc.to_dict()
+        settings = doc_cache.get('store_settings', 'main')
+        if settings:
+            return settings
     except Exception as e:
         print(f"Error injecting store settings: {e}")
     return {}
 
+@metrics.timed('role_required')
+def has_page_access(page_name):
+    if current_user.get_role() == 'superadmin':
+        return True
+    try:
+        permissions = doc_cache.get('permissions', 'role_access')
+        if permissions:
+            user_role = current_user.get_role()
+            if permissions.get(user_role, {}).get(page_name, False):
+                return True
+    except Exception as e:
+        print(f"Error checking permissions: {e}")
+    return False
+
 def role_required(page_name):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if current_user.get_role() == 'superadmin':
+            if has_page_access(page_name):
                 return f(*args, **kwargs)
-            try:
-                permissions_doc = db.collection('permissions').document('role_access').get()
-                if permissions_doc.exists:
-                    permissions = permissions_doc.to_dict()
-                    user_role = current_user.get_role()
-                    if permissions.get(user_role, {}).get(page_name, False):
-                        return f(*args, **kwargs)
-            except Exception as e:
-                print(f"Error checking permissions: {e}")
             return redirect(url_for('unauthorized_page'))
         return decorated_function
     return decorator
@@ -103,9 +333,9 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        user_doc = db.collection('users').document(username).get()
-        if user_doc.exists and check_password_hash(user_doc.to_dict().get('passwordHash', ''), password):
-            user = User(user_doc.to_dict())
+        user_data = doc_cache.get('users', username, cache_missing=False) if username else None
+        if user_data and check_password_hash(user_data.get('passwordHash', ''), password):
+            user = User(user_data)
             login_user(user)
             return redirect(next_page_url or url_for('admin'))
     return render_template('login.html', next=next_page_url)
@@ -126,29 +356,41 @@ def unauthorized_page():
 # ====================================================================
 @app.route('/')
 def index():
-    doc = db.collection('store_settings').document('main').get()
-    is_open = doc.to_dict().get('isStoreOpen', True) if doc.exists else True
+    settings = doc_cache.get('store_settings', 'main') or {}
+    is_open = settings.get('isStoreOpen', True)
     if not is_open:
         return render_template('closed.html')
-    
-    items_ref = db.collection('items').stream()
-    items_list = []
-    items_map = {} # JavaScriptに渡すための商品情報マップ
-    for item in items_ref:
-        item_data = item.to_dict()
-        item_data['ItemID'] = item.id
-        items_list.append(item_data)
-        items_map[item.id] = {
-            'name': item_data.get('name'),
-            'price': item_data.get('price')
-        }
 
-    all_categories = sorted(list(set(item.get('category', '未分類') for item in items_list)))
-    
-    return render_template('index.html', 
-                           items=items_list, 
-                           categories=all_categories,
-                           items_map=items_map)
+    # 店舗設定もページ内容に影響するため、ETagにはメニューと設定の両方を含める
+    menu = get_menu_snapshot()
+    settings_hash = hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()[:8]
+    etag = f"{menu['version']}-{settings_hash}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        rendered = menu['rendered']
+        if not rendered or rendered[0] != etag:
+            html = render_template('index.html',
+                                   items=menu['items'],
+                                   categories=menu['categories'],
+                                   items_map_json=menu['items_map_json'])
+            rendered = menu['rendered'] = (etag, html)
+        response = make_response(rendered[1])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/menu_map')
+def menu_map():
+    """商品ID → 商品名・単価 の対応表。注文フィードの明細(商品IDのみ)を画面側で表示するときに使う"""
+    menu = get_menu_snapshot()
+    if request.if_none_match.contains(menu['version']):
+        response = Response(status=304)
+    else:
+        response = jsonify({'version': menu['version'], 'items': menu['items_map']})
+    response.set_etag(menu['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/cart')
 def cart():
@@ -160,9 +402,11 @@ def order_complete():
     order_data = None
     if order_id:
         try:
-            doc = db.collection('orders').document(order_id).get()
-            if doc.exists:
-                order_data = doc.to_dict()
+            doc = prefetched_document(db.collection('orders').document(order_id))
+            if not doc.exists:
+                doc = find_archived_order(db, order_id)
+            if doc:
+                order_data = expand_order(doc.to_dict(), get_menu_snapshot())
                 timestamp = order_data.get('createdAt')
                 if timestamp:
                     jst_time = timestamp + datetime.timedelta(hours=9)
@@ -171,11 +415,15 @@ def order_complete():
             print(f"Error getting order data: {e}")
     return render_template('order_complete.html', order=order_data)
 
+def prep_stations(menu):
+    """厨房の持ち場の一覧。セットは中身の商品の持ち場で作るため、セット以外のカテゴリを持ち場とする"""
+    return sorted(set(item.get('category', '未分類') for item in menu['items'] if not item.get('isSet')))
+
 @app.route('/kitchen')
 @login_required
 @role_required('kitchen')
 def kitchen():
-    return render_template('kitchen.html')
+    return render_template('kitchen.html', stations=prep_stations(get_menu_snapshot()), station=request.args.get('station', ''))
 
 @app.route('/display')
 @login_required
@@ -208,18 +456,379 @@ def signage():
 # ====================================================================
 # APIエンドポイント
 # ====================================================================
+# --- 整理券番号の採番 ---
+# counters/tickets に次の番号を持ち、tickets/<番号> に 番号→注文ID の索引を置く。
+# 受け渡しが完了した注文の番号は released=True となり、一周した後に再利用される。
+TICKET_MAX = 9999
+TICKET_SCAN_LIMIT = 20
+
+def normalize_ticket_number(value):
+    """入力された番号を4桁ゼロ埋めの整理券番号に揃える。不正な値ならNone
+
+    新しく発行する番号は 0001〜9999 だが、以前の発行方式では 0000 も出ていたので照会では受け付ける。
+    """
+    value = str(value if value is not None else '').strip()
+    if not value.isdigit() or not 0 <= int(value) <= TICKET_MAX:
+        return None
+    return f"{int(value):04d}"
+
+# --- 売上集計 ---
+# 注文には作成した時刻の区切り (salesBucket, SALES_BUCKET_SECONDS ごとの番号) を付け、注文ぶんの加算を
+# sales_summary/shard-<n> (n はランダム) の buckets.<区切り> に書き込む。
+# 加算は注文のトランザクションの外で行う (注文どうしが集計ドキュメントの取り合いで待たないように)。
+# 再構築では区切り cutoffBucket を決めて、それより前の区切りの注文を全て読み直した合計を sales_summary/main に書く。
+# 表示するときは main と、各シャードの cutoffBucket 以降の区切りの加算を合計する。
+# 注文ごとに「読み直しで数える」か「加算で数える」かが区切りで決まるため、再構築の途中に注文が来ても二重に数えたり落としたりしない。
+# 加算に失敗した場合は「売上集計の再構築」で直す (直近の区切りの注文は加算をそのまま使うため、直るのは少し前の注文まで)
+SALES_SUMMARY_SHARDS = int(os.environ.get('SALES_SUMMARY_SHARDS', 10))
+SALES_SUMMARY_FIELDS = ('totalRevenue', 'totalOrders', 'salesByItem', 'salesByCategory')
+SALES_BUCKET_SECONDS = 600
+# 再構築で読み直すのは、この秒数以上前に終わった区切りの注文まで (作成中の注文のトランザクションが終わっているように)
+SALES_REBUILD_MARGIN_SECONDS = 60
+
+def sales_summary_refs():
+    collection = db.collection('sales_summary')
+    return [collection.document('main')] + [collection.document(f'shard-{index}') for index in range(SALES_SUMMARY_SHARDS)]
+
+def sales_bucket(timestamp=None):
+    """時刻 (省略時は現在) が属する売上集計の区切りの番号"""
+    return int((time.time() if timestamp is None else timestamp) // SALES_BUCKET_SECONDS)
+
+def empty_sales_summary():
+    return {'totalRevenue': 0, 'totalOrders': 0, 'salesByItem': {}, 'salesByCategory': {}}
+
+def add_sales_summary(summary, data):
+    """data (集計または1区切りぶんの加算) を summary に足し込む"""
+    summary['totalRevenue'] += data.get('totalRevenue', 0)
+    summary['totalOrders'] += data.get('totalOrders', 0)
+    for field in ('salesByItem', 'salesByCategory'):
+        for key, value in data.get(field, {}).items():
+            summary[field][key] = summary[field].get(key, 0) + value
+def summarize_order_items(items, menu):
+    """注文の商品リストを (商品名別の数量, カテゴリ別の小計) に集計する"""
+    sales_by_item, sales_by_category = {}, {}
+    for item in items:
+        if item.get('isSet'):
+            category = menu['items_by_id'].get(item.get('id'), {}).get('category', 'セット')
+            quantity, subtotal = 1, item['price']
+        else:
+            category = menu['items_by_name'].get(item['name'], {}).get('category', '未分類')
+            quantity, subtotal = item['quantity'], item['price'] * item['quantity']
+        sales_by_item[item['name']] = sales_by_item.get(item['name'], 0) + quantity
+        sales_by_category[category] = sales_by_category.get(category, 0) + subtotal
+    return sales_by_item, sales_by_category
+
+def sales_summary_increment(order_data, menu):
+    """1件の注文ぶんを sales_summary に加算するための更新データを作成する"""
+    sales_by_item, sales_by_category = summarize_order_items(expand_lines(order_data, menu), menu)
+    return {
+        'totalRevenue': firestore.Increment(order_data.get('totalPrice', 0)),
+        'totalOrders': firestore.Increment(1),
+        'salesByItem': {name: firestore.Increment(qty) for name, qty in sales_by_item.items()},
+        'salesByCategory': {cat: firestore.Increment(subtotal) for cat, subtotal in sales_by_category.items()},
+    }
+
+def rebuild_sales_summary():
+    """
+    cutoffBucket より前の区切りの注文を全て読み直して sales_summary/main を作り直す (集計がずれた場合の復旧用)。
+    区切りの無い注文 (区切りを付ける前の注文) は常に読み直す。
+    main を書いた後、シャードから cutoffBucket より前の区切りの加算 (と区切りを付ける前の形式の加算) を消す
+    """
+    menu = get_menu_snapshot()
+    cutoff = sales_bucket(time.time() - SALES_REBUILD_MARGIN_SECONDS)
+    summary = empty_sales_summary()
+    for order_doc in iter_all_orders(db):
+        order_data = order_doc.to_dict()
+        if order_data.get('salesBucket', cutoff - 1) >= cutoff:
+            continue # 加算の方で数える
+        sales_by_item, sales_by_category = summarize_order_items(expand_lines(order_data, menu), menu)
+        add_sales_summary(summary, {'totalRevenue': order_data.get('totalPrice', 0), 'totalOrders': 1,
+                                    'salesByItem': sales_by_item, 'salesByCategory': sales_by_category})
+    main_ref, *shard_refs = sales_summary_refs()
+    main_ref.set(dict(summary, cutoffBucket=cutoff, updatedAt=firestore.SERVER_TIMESTAMP, rebuiltAt=firestore.SERVER_TIMESTAMP))
+    # main より前の区切りの加算は表示で使わなくなるので消す (消した後に遅れて届いた加算も表示では無視される)
+    for shard in db.get_all(shard_refs):
+        if not shard.exists:
+            continue
+        data = shard.to_dict()
+        stale = {f'buckets.{bucket}': firestore.DELETE_FIELD for bucket in data.get('buckets', {}) if int(bucket) < cutoff}
+        stale.update({field: firestore.DELETE_FIELD for field in SALES_SUMMARY_FIELDS if field in data})
+        if stale:
+            shard.reference.update(stale)
+    return dict(read_sales_summary(), cutoffBucket=cutoff)
+
+def record_sales(bucket, summary_update):
+    """注文1件ぶんの加算を、ランダムなシャードの注文の区切りに書き込む (注文の作成後に呼ぶ)"""
+    try:
+        shard_ref = db.collection('sales_summary').document(f'shard-{random.randrange(SALES_SUMMARY_SHARDS)}')
+        shard_ref.set({'buckets': {str(bucket): summary_update}, 'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+    except Exception as e:
+        print(f"Error recording sales (rebuild the sales summary to fix the totals): {e}")
+
+def read_sales_summary():
+    """
+    main と全シャードの cutoffBucket 以降の加算を合計した売上集計を返す (ここでは作り直さない)。
+    一度も作り直していない集計 (区切りを付ける前の形式の集計が残っている) は rebuildRequired=True を付け、
+    その時点で分かる合計を返す
+    """
+    docs = {doc.id: doc.to_dict() for doc in db.get_all(sales_summary_refs()) if doc.exists}
+    main = docs.pop('main', None)
+    cutoff = main.get('cutoffBucket') if main else None
+    summary = empty_sales_summary()
+    if main:
+        add_sales_summary(summary, main)
+    legacy = main is not None and cutoff is None
+    for shard in docs.values():
+        if cutoff is None and any(field in shard for field in SALES_SUMMARY_FIELDS):
+            legacy = True
+            add_sales_summary(summary, shard)
+        for bucket, data in shard.get('buckets', {}).items():
+            if cutoff is None or int(bucket) >= cutoff:
+                add_sales_summary(summary, data)
+    summary['rebuildRequired'] = legacy
+    return summary
+
+@app.cli.command('rebuild-sales-summary')
+def rebuild_sales_summary_command():
+    """売上集計ドキュメントを全注文から作り直す"""
+    summary = rebuild_sales_summary()
+    print(f"売上集計を再構築しました: {summary['totalOrders']}件 / {summary['totalRevenue']}円")
+
+@storage.transactional
+def _create_order_in_transaction(transaction, order_ref, order_data, demand, menu, idempotency_key=None):
+    """
+    空いている整理券番号と在庫を確保し、注文と索引を同じトランザクションで書き込む。(注文ID, 整理券番号, 作成したか) を返す。
+    idempotency_key ((参照, リクエストのハッシュ)) があれば、同じキーで登録済みの注文を返すか、キーを注文と一緒に記録する。
+    整理券番号の採番 (counters/tickets) は全ての注文が読み書きするため、ここが注文どうしの順番待ちになる
+    """
+    if idempotency_key:
+        existing = idempotency.read_in_transaction(transaction, *idempotency_key)
+        if existing:
+            return existing + (False,)
+    counter_ref = db.collection('counters').document('tickets')
+    counter_doc = counter_ref.get(transaction=transaction)
+    next_number = counter_doc.to_dict().get('next', 1) if counter_doc.exists else 1
+    for offset in range(TICKET_SCAN_LIMIT):
+        number = (next_number - 1 + offset) % TICKET_MAX + 1
+        ticket_number = f"{number:04d}"
+        ticket_ref = db.collection('tickets').document(ticket_number)
+        ticket_doc = ticket_ref.get(transaction=transaction)
+        if not ticket_doc.exists or ticket_doc.to_dict().get('released', False):
+            break
+    else:
+        raise RuntimeError('空いている整理券番号がありません。受け渡し済みの注文を完了にしてください。')
+    stock_writes = reserve_stock(transaction, db, demand, menu)
+
+    transaction.set(order_ref, dict(order_data, ticketNumber=ticket_number))
+    transaction.set(ticket_ref, {'orderId': order_ref.id, 'released': False, 'assignedAt': firestore.SERVER_TIMESTAMP})
+    transaction.set(counter_ref, {'next': number % TICKET_MAX + 1}, merge=True)
+    for ref, data in stock_writes:
+        transaction.set(ref, data, merge=True)
+    if idempotency_key:
+        idempotency.record_in_transaction(transaction, *idempotency_key, order_ref.id, ticket_number)
+    return order_ref.id, ticket_number, True
+
+@storage.transactional
+def _complete_order_in_transaction(transaction, order_ref):
+    """注文を完了にし、その注文が持つ整理券番号を再利用可能にする。会計済みならアーカイブへ移す"""
+    order_doc = order_ref.get(transaction=transaction)
+    if not order_doc.exists:
+        return False
+    order_data = dict(order_doc.to_dict(), status='完了')
+    ticket_number = order_data.get('ticketNumber')
+    ticket_ref = db.collection('tickets').document(ticket_number) if ticket_number else None
+    ticket_doc = ticket_ref.get(transaction=transaction) if ticket_ref else None
+    if order_data.get('paymentStatus') == '会計済':
+        archive_in_transaction(transaction, db, order_ref, order_data, ticket_doc)
+        return True
+    transaction.update(order_ref, {'status': '完了'})
+    # 同じ番号が既に別の注文へ再割り当てされている場合は触らない
+    if ticket_doc and ticket_doc.exists and ticket_doc.to_dict().get('orderId') == order_ref.id:
+        transaction.update(ticket_ref, {'released': True})
+    return True
+
+@storage.transactional
+def _pay_order_in_transaction(transaction, order_ref):
+    """注文を会計済にする。受け渡しも完了していればアーカイブへ移す"""
+    order_doc = order_ref.get(transaction=transaction)
+    if not order_doc.exists:
+        return False
+    order_data = dict(order_doc.to_dict(), paymentStatus='会計済')
+    if order_data.get('status') == '完了':
+        ticket_number = order_data.get('ticketNumber')
+        ticket_doc = db.collection('tickets').document(ticket_number).get(transaction=transaction) if ticket_number else None
+        archive_in_transaction(transaction, db, order_ref, order_data, ticket_doc)
+    else:
+        transaction.update(order_ref, {'paymentStatus': '会計済'})
+    return True
+
+def status_update(new_status):
+    """ステータスを変更するときの更新内容。提供可能になった時刻は待ち時間の見積もりに使う"""
+    if new_status == '提供可能':
+        return {'status': new_status, 'readyAt': firestore.SERVER_TIMESTAMP}
+    if new_status == '調理中':
+        return {'status': new_status, 'readyAt': firestore.DELETE_FIELD}
+    return {'status': new_status}
+
+# --- 複数注文のステータス変更 ---
+# 厨房・会計で選んだ複数の注文を、1回のリクエスト・1つのトランザクションでまとめて変更する
+# { 項目: { 現在の値: 変更できる値 } }
+ORDER_TRANSITIONS = {
+    'status': {'調理中': {'提供可能'}, '提供可能': {'完了', '調理中'}},
+    'paymentStatus': {'未会計': {'会計済'}},
+}
+# 1注文あたり最大3件 (アーカイブへの追加・削除・整理券の更新) を書くため、1トランザクション(500件)に収まる件数にする
+MAX_BULK_ORDERS = 100
+
+@storage.transactional
+def _bulk_update_in_transaction(transaction, order_refs, field, value):
+    """複数の注文の status / paymentStatus をまとめて変更する。1件でも変更できない注文があれば何も書き込まずValueError"""
+    order_docs = {doc.reference.path: doc for doc in transaction.get_all(order_refs)}
+    changes, unchanged, errors = [], 0, []
+    for order_ref in order_refs:
+        order_doc = order_docs.get(order_ref.path)
+        if order_doc is None or not order_doc.exists:
+            # 二重送信の1回目でアーカイブへ移った注文は、アーカイブ側の値を見る (アーカイブは書き換えないのでトランザクション外で読む)
+            order_doc = find_archived_order(db, order_ref.id)
+            if order_doc is None:
+                errors.append(f"{order_ref.id} (見つかりません)")
+                continue
+        current = order_doc.to_dict().get(field)
+        if current == value:
+            unchanged += 1 # 二重送信などで既に変更済みの注文はそのまま
+        elif value in ORDER_TRANSITIONS[field].get(current, ()):
+            changes.append((order_ref, dict(order_doc.to_dict(), **{field: value})))
+        else:
+            errors.append(f"{order_doc.to_dict().get('ticketNumber', order_ref.id)} ({current} → {value})")
+    if errors:
+        raise ValueError(f"変更できない注文があります: {', '.join(errors)}")
+
+    # 受け渡しが完了する注文は整理券を解放する(会計済ならアーカイブへ移す)ため、書き込みの前に整理券を読んでおく
+    ticket_refs = {order_ref.path: db.collection('tickets').document(order_data['ticketNumber'])
+                   for order_ref, order_data in changes if order_data.get('status') == '完了' and order_data.get('ticketNumber')}
+    tickets = {doc.reference.path: doc for doc in transaction.get_all(list(ticket_refs.values()))} if ticket_refs else {}
+    archives = []
+    for order_ref, order_data in changes:
+        ticket_ref = ticket_refs.get(order_ref.path)
+        ticket_doc = tickets.get(ticket_ref.path) if ticket_ref else None
+        if is_finished(order_data):
+            archives.append((order_ref, order_data, ticket_doc))
+            continue
+        transaction.update(order_ref, status_update(value) if field == 'status' else {field: value})
+        if value == '完了' and ticket_doc and ticket_doc.exists and ticket_doc.to_dict().get('orderId') == order_ref.id:
+            transaction.update(ticket_ref, {'released': True})
+    if archives:
+        archive_orders_in_transaction(transaction, db, archives)
+    return {'updated': len(changes), 'unchanged': unchanged, 'archived': len(archives)}
+
+def find_order(order_id):
+    """注文IDから注文ドキュメントを取得する (アーカイブ済みの注文も探す)。見つからなければNone"""
+    order_doc = db.collection('orders').document(order_id).get()
+    return order_doc if order_doc.exists else find_archived_order(db, order_id)
+
+def already_updated(order_id, field, value):
+    """注文の field が既に value になっているか (二重送信で、1回目に完了・アーカイブ済みになった注文など)"""
+    order_doc = find_order(order_id)
+    return order_doc is not None and order_doc.to_dict().get(field) == value
+
+def find_order_by_ticket(ticket_number):
+    """整理券番号から注文ドキュメントを取得する。見つからなければNone"""
+    ticket_doc = db.collection('tickets').document(ticket_number).get()
+    ticket_data = ticket_doc.to_dict() if ticket_doc.exists else {}
+    order_id = ticket_data.get('orderId')
+    if order_id:
+        if ticket_data.get('archive'):
+            return find_archived_order(db, order_id, ticket_data['archive'])
+        order_doc = db.collection('orders').document(order_id).get()
+        if order_doc.exists:
+            return order_doc
+    # 索引が作られる前の注文は従来通りクエリで探す
+    for doc in db.collection('orders').where('ticketNumber', '==', ticket_number).limit(1).stream():
+        return doc
+    return None
+
+# --- 注文内容の検証 ---
+# 価格・売り切れはクライアントのカート(localStorage)ではなく、メモリ上のメニュー索引で判定する
+MAX_LINE_QUANTITY = 99
+
+def _validate_set_selection(set_item, selected, menu):
+    """セットで選ばれた商品名を検証し、正しい商品名のリストを返す"""
+    set_count = set_item.get('setCount', 0)
+    if not isinstance(selected, list) or len(selected) != set_count:
+        raise ValueError(f"「{set_item['name']}」は商品を{set_count}個選んでください。")
+    allowed_ids = set(set_item.get('setItems') or [])
+    names = []
+    for name in selected:
+        component = menu['items_by_name'].get(name)
+        if component is None or component.get('isSet') or (allowed_ids and component['ItemID'] not in allowed_ids):
+            raise ValueError(f"「{set_item['name']}」では「{name}」を選べません。")
+        if component.get('isSoldOut'):
+            raise ValueError(f"「{component['name']}」は売り切れです。")
+        names.append(component['name'])
+    return names
+
+def price_order(cart_items, menu):
+    """カートの内容をメニューと照合し、(注文明細, 合計金額) を返す。不正な内容・売り切れはValueError"""
+    if not isinstance(cart_items, list) or not cart_items:
+        raise ValueError('カートが空です。')
+    lines, total_price = [], 0
+    for cart_item in cart_items:
+        if not isinstance(cart_item, dict):
+            raise ValueError('注文内容が不正です。')
+        item = menu['items_by_id'].get(cart_item.get('id'))
+        if item is None:
+            raise ValueError(f"「{cart_item.get('name', '')}」はメニューにありません。ページを再読み込みしてください。")
+        if item.get('isSoldOut'):
+            raise ValueError(f"「{item['name']}」は売り切れです。")
+        line = {'id': item['ItemID'], 'name': item['name'], 'price': int(item.get('price', 0))}
+        if item.get('isSet'):
+            # セットは1行につき1個 (カートでも数量を変更できない)
+            line.update(quantity=1, isSet=True, selectedItems=_validate_set_selection(item, cart_item.get('selectedItems'), menu))
+        else:
+            quantity = cart_item.get('quantity')
+            if type(quantity) is not int or not 0 < quantity <= MAX_LINE_QUANTITY:
+                raise ValueError(f"「{item['name']}」の数量が不正です。")
+            line['quantity'] = quantity
+        lines.append(line)
+        total_price += line['price'] * line['quantity']
+    return lines, total_price
+
 @app.route('/order', methods=['POST'])
 def create_order():
     try:
-        cart_items = request.get_json()
-        total_price = sum(item['price'] * item['quantity'] for item in cart_items if 'price' in item and 'quantity' in item)
-        new_ticket_number = f"{random.randint(0, 9999):04d}"
+        # 再送(同じ Idempotency-Key)なら、最初に登録した注文をそのまま返す
+        key = idempotency.validate_key(request.headers.get('Idempotency-Key'))
+        body_hash = idempotency.request_hash(request.get_data())
+        existing = idempotency.lookup(db, key, body_hash) if key else None
+        if existing:
+            return jsonify({'success': True, 'orderId': existing[0], 'ticketNumber': existing[1], 'replayed': True})
+        menu = get_menu_snapshot()
+        try:
+            order_items, total_price = price_order(request.get_json(silent=True), menu)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        # 明細は商品ID・数量・単価だけを保存する (商品名は表示するときにメニューから引く)
         order_data = {
-            'ticketNumber': new_ticket_number, 'items': cart_items, 'totalPrice': total_price,
-            'status': '調理中', 'paymentStatus': '未会計', 'createdAt': firestore.SERVER_TIMESTAMP
+            'lines': compact_lines(order_items, menu), 'totalPrice': total_price,
+            'status': '調理中', 'paymentStatus': '未会計', 'createdAt': firestore.SERVER_TIMESTAMP,
+            'salesBucket': sales_bucket()
         }
-        update_time, doc_ref = db.collection('orders').add(order_data)
-        return jsonify({'success': True, 'ticketNumber': new_ticket_number, 'orderId': doc_ref.id})
+        order_ref = db.collection('orders').document()
+        try:
+            order_id, new_ticket_number, created = _create_order_in_transaction(
+                db.transaction(), order_ref, order_data, stock_demand(order_items, menu), menu,
+                idempotency_key=(idempotency.key_ref(db, key), body_hash) if key else None)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if not created:
+            # 同じキーの再送が同時に届き、先に登録された注文をトランザクションの中で見つけた場合
+            return jsonify({'success': True, 'orderId': order_id, 'ticketNumber': new_ticket_number, 'replayed': True})
+        record_sales(order_data['salesBucket'], sales_summary_increment(order_data, menu))
+        return jsonify({'success': True, 'ticketNumber': new_ticket_number, 'orderId': order_id})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except idempotency.IdempotencyConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -227,10 +836,12 @@ def create_order():
 def get_order_by_ticket():
     ticket_number = request.args.get('ticket', None)
     if not ticket_number: return jsonify({'success': False, 'error': 'Ticket number is required'}), 400
+    ticket_number = normalize_ticket_number(ticket_number)
+    if not ticket_number: return jsonify({'success': False, 'error': 'Order not found'}), 404
     try:
-        docs = db.collection('orders').where('ticketNumber', '==', ticket_number).limit(1).stream()
-        for doc in docs:
-            return jsonify({'success': True, 'order': doc.to_dict(), 'docId': doc.id})
+        doc = find_order_by_ticket(ticket_number)
+        if doc:
+            return jsonify({'success': True, 'order': expand_order(doc.to_dict(), get_menu_snapshot()), 'docId': doc.id})
         return jsonify({'success': False, 'error': 'Order not found'}), 404
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -241,7 +852,10 @@ def update_payment_status():
     doc_id = data.get('docId')
     if not doc_id: return jsonify({'success': False, 'error': 'Document ID is required'}), 400
     try:
-        db.collection('orders').document(doc_id).update({'paymentStatus': '会計済'})
+        if not _pay_order_in_transaction(db.transaction(), db.collection('orders').document(doc_id)):
+            if already_updated(doc_id, 'paymentStatus', '会計済'):
+                return jsonify({'success': True, 'unchanged': True})
+            return jsonify({'success': False, 'error': 'Order not found'}), 404
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -256,17 +870,161 @@ def update_order_status():
         new_status = data.get('status')
         if not all([doc_id, new_status]):
             return jsonify({'success': False, 'error': 'Missing data'}), 400
-        db.collection('orders').document(doc_id).update({'status': new_status})
+        order_ref = db.collection('orders').document(doc_id)
+        if new_status == '完了':
+            if not _complete_order_in_transaction(db.transaction(), order_ref):
+                if already_updated(doc_id, 'status', '完了'):
+                    return jsonify({'success': True, 'unchanged': True})
+                return jsonify({'success': False, 'error': 'Order not found'}), 404
+        else:
+            order_ref.update(status_update(new_status))
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/bulk_update_order_status', methods=['POST'])
+@login_required
+def bulk_update_order_status():
+    data = request.get_json() or {}
+    doc_ids = data.get('docIds')
+    fields = [field for field in ORDER_TRANSITIONS if field in data]
+    if not isinstance(doc_ids, list) or not doc_ids or len(fields) != 1:
+        return jsonify({'success': False, 'error': 'Missing data'}), 400
+    field, value = fields[0], data[fields[0]]
+    if not any(value in targets for targets in ORDER_TRANSITIONS[field].values()):
+        return jsonify({'success': False, 'error': 'Invalid status'}), 400
+    doc_ids = list(dict.fromkeys(str(doc_id) for doc_id in doc_ids))
+    if len(doc_ids) > MAX_BULK_ORDERS:
+        return jsonify({'success': False, 'error': f'一度に変更できるのは{MAX_BULK_ORDERS}件までです。'}), 400
+    try:
+        order_refs = [db.collection('orders').document(doc_id) for doc_id in doc_ids]
+        result = _bulk_update_in_transaction(db.transaction(), order_refs, field, value)
+        return jsonify(dict(result, success=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# --- 注文ステータスの変更フィード (SSE) ---
+# 画面ごとにFirestoreを監視せず、サーバーがステータスごとに1つの監視を共有して配信する
+ORDER_FEED_STATUSES = ['調理中', '提供可能']
+order_feeds = {status: OrderStatusFeed(db, status) for status in ORDER_FEED_STATUSES}
+# 厨房の持ち場(メニューのカテゴリ)ごとの、調理中の商品の合計個数
+prep_board = PrepBoard(order_feeds['調理中'], get_menu_snapshot)
+# 配信中の接続はそれぞれスレッドを1つ使い続けるため、同時に配信する数をスレッド数より少なく抑え、
+# 他のリクエスト(注文・ステータス変更)を処理するスレッドを残す。上限を超えた接続には 503 を返し、画面は少し待って接続し直す。
+# gunicorn では gunicorn.conf.py がスレッド数に合わせて設定する (上限はワーカーごと)
+FEED_STREAM_LIMIT = int(os.environ.get('FEED_STREAM_LIMIT', 24))
+FEED_RETRY_SECONDS = 10
+_feed_streams = threading.BoundedSemaphore(FEED_STREAM_LIMIT)
+
+def feed_response(open_stream):
+    """open_stream() が返すSSEの本文を配信する。同時に配信している数が上限に達していれば 503"""
+    if not _feed_streams.acquire(blocking=False):
+        response = jsonify({'success': False, 'error': '接続が混み合っています。しばらくしてから接続し直してください。'})
+        response.headers['Retry-After'] = str(FEED_RETRY_SECONDS)
+        return response, 503
+    try:
+        response = Response(open_stream(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except BaseException:
+        _feed_streams.release()
+        raise
+    # 画面が切断して配信が終わったときに枠を返す (切断は keep-alive の書き込みで分かるため、最大でハートビート2回分かかる)
+    response.call_on_close(_feed_streams.release)
+    return response
+
+# --- 待ち時間の見積もり ---
+# 提供可能になった注文をフィードから学習し、調理中の注文の提供予定を見積もる。
+# 見積もりは数秒間使い回す (多くの画面が同時に問い合わせても計算は1回)。
+# 誰でも呼べるため、ここではフィードの監視を開始しない (warm_up か厨房・モニター画面の接続で開始される)
+WAIT_TIME_CACHE_SECONDS = 10
+wait_time_estimator = WaitTimeEstimator()
+order_feeds['提供可能'].add_listener(lambda changes: wait_time_estimator.observe_ready(
+    [(change['id'], change['order']) for change in changes if change['type'] != 'removed']))
+_wait_time_lock = threading.Lock()
+_wait_time_cache = None
+
+def get_wait_time_estimate(fresh=False):
+    """待ち時間の見積もりを返す (fresh なら使い回さずに計算し直す)。フィードの監視がまだ始まっていなければNone"""
+    global _wait_time_cache
+    with _wait_time_lock:
+        if not fresh and _wait_time_cache and time.monotonic() - _wait_time_cache[0] < WAIT_TIME_CACHE_SECONDS:
+            return _wait_time_cache[1]
+        if not all(feed.is_ready() for feed in order_feeds.values()):
+            return None
+        queue, _ = order_feeds['調理中'].snapshot()
+        estimate = wait_time_estimator.estimate([(entry['id'], entry['order']) for entry in queue])
+        _wait_time_cache = (time.monotonic(), estimate)
+        return estimate
+
+def order_wait_status(order_id, estimate):
+    """
+    注文1件の状態。調理中の見積もりにあれば cooking、提供可能のフィードにあれば ready。
+    どちらにも無い (作成直後でまだフィードに届いていない、または完了・アーカイブ済み) 場合は保存された状態を読み、
+    調理中なら pending、提供可能・完了なら ready、注文が無ければ unknown
+    """
+    if order_id in estimate['orders']:
+        return 'cooking'
+    if order_feeds['提供可能'].get(order_id) is not None:
+        return 'ready'
+    order_doc = find_order(order_id)
+    if order_doc is None:
+        return 'unknown'
+    return 'ready' if order_doc.to_dict().get('status') in ('提供可能', '完了') else 'pending'
+
+@app.route('/api/wait_time', methods=['GET'])
+def wait_time():
+    """
+    待ち時間の見積もり。order_id を付けるとその注文の提供予定と状態 (orderStatus) も返す。
+    注文IDは公開しないため、一覧は整理券番号で返す
+    """
+    try:
+        order_id = request.args.get('order_id')
+        # 注文直後の画面が古い見積もりで「できあがり」と判断しないよう、注文を指定した場合は使い回さない
+        estimate = get_wait_time_estimate(fresh=bool(order_id))
+        if estimate is None:
+            response = jsonify({'error': '待ち時間を計算する準備ができていません。'})
+            response.headers['Retry-After'] = str(WAIT_TIME_CACHE_SECONDS)
+            return response, 503
+        result = {key: value for key, value in estimate.items() if key != 'orders'}
+        result['tickets'] = sorted(estimate['orders'].values(), key=lambda entry: entry['position'])
+        if order_id:
+            result['order'] = estimate['orders'].get(order_id)
+            result['orderStatus'] = order_wait_status(order_id, estimate)
+        response = jsonify(result)
+        response.headers['Cache-Control'] = f'public, max-age={WAIT_TIME_CACHE_SECONDS}' if not order_id else 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/order_feed', methods=['GET'])
+@login_required
+def order_feed():
+    feed = order_feeds.get(request.args.get('status'))
+    if feed is None: return jsonify({'success': False, 'error': 'Invalid status'}), 400
+    return feed_response(lambda: feed.stream(request.headers.get('Last-Event-ID')))
+
+@app.route('/api/prep_feed', methods=['GET'])
+@login_required
+def prep_feed():
+    station = request.args.get('station')
+    if not station: return jsonify({'success': False, 'error': 'Missing station'}), 400
+    # 持ち場ごとに配信用のチャネルを作るため、メニューに無い持ち場は受け付けない
+    if station not in prep_stations(get_menu_snapshot()): return jsonify({'success': False, 'error': 'Invalid station'}), 400
+    return feed_response(lambda: prep_board.stream(station, request.headers.get('Last-Event-ID')))
+
 @app.route('/api/get_items', methods=['GET'])
 @login_required
 def get_items():
     if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
     try:
-        items_list = [dict(item.to_dict(), **{'id': item.id}) for item in db.collection('items').stream()]
+        stock_totals = read_stock_totals(db)
+        items_list = []
+        for item in db.collection('items').stream():
+            item_data = dict(item.to_dict(), id=item.id)
+            item_data['stock'] = stock_totals.get(item.id, 0) if item_data.get('trackStock') else None
+            items_list.append(item_data)
         return jsonify(items_list)
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -278,12 +1036,33 @@ def update_item():
         data = request.get_json()
         doc_id, field, value = data.get('id'), data.get('field'), data.get('value')
         if not all([doc_id, field, value is not None]): return jsonify({'success': False, 'error': 'Missing data'}), 400
+        if field == 'stock':
+            return update_item_stock(doc_id, value)
         if field == 'price' or field == 'setCount': value = int(value)
         elif field == 'isSoldOut' or field == 'isSet': value = bool(value)
         db.collection('items').document(doc_id).update({field: value})
+        invalidate_menu_snapshot()
+        if field == 'imageUrl':
+            image_cache.prewarm([value], MENU_IMAGE_WIDTHS, on_done=invalidate_menu_snapshot)
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
+def update_item_stock(doc_id, value):
+    """在庫数を設定し直す。空欄なら在庫管理をやめる。在庫を補充した商品は販売中に戻す"""
+    item_ref = db.collection('items').document(doc_id)
+    if value == '':
+        item_ref.update({'trackStock': False})
+    else:
+        count = int(value)
+        if count < 0: return jsonify({'success': False, 'error': '在庫数は0以上で入力してください。'}), 400
+        batch = db.batch()
+        for ref, data in stock_shards(db, doc_id, count):
+            batch.set(ref, data)
+        batch.update(item_ref, {'trackStock': True, 'isSoldOut': count == 0})
+        batch.commit()
+    invalidate_menu_snapshot()
+    return jsonify({'success': True})
+
 @app.route('/api/upload_csv', methods=['POST'])
 @login_required
 def upload_csv():
@@ -293,42 +1072,29 @@ def upload_csv():
     if file.filename == '' or not file.filename.endswith('.csv'): return jsonify({'success': False, 'error': 'Invalid file'}), 400
     try:
         csv_data = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        df = pd.read_csv(csv_data)
-        
+        header = [col.strip() for col in next(csv.reader(csv_data), [])]
+        csv_data.seek(0)
+
         required_columns = ['ItemID', 'Name', 'Price', 'Category', 'Status', 'Allergens', 'IsSet', 'SetCount', 'SetItems']
-        if not all(col in df.columns for col in required_columns):
+        if not all(col in header for col in required_columns):
             return jsonify({'success': False, 'error': 'CSVの列名が不正です。IsSet, SetCount, SetItems列などを確認してください。'}), 400
 
-        for doc in db.collection('items').stream(): doc.reference.delete()
-
-        for index, row in df.iterrows():
-            allergens_str = str(row['Allergens']) if pd.notna(row['Allergens']) else ''
-            allergens_list = [allergen.strip() for allergen in allergens_str.split(',') if allergen.strip()]
-            
-            is_set = bool(row['IsSet'])
-            set_count = int(row['SetCount']) if is_set else 0
-            set_items_str = str(row['SetItems']) if is_set and pd.notna(row['SetItems']) else ''
-            set_items_list = [item.strip() for item in set_items_str.split(',') if item.strip()]
-
-            item_data = {
-                'name': row['Name'], 'price': int(row['Price']), 'category': row['Category'],
-                'imageUrl': str(row['ImageURL']) if pd.notna(row['ImageURL']) else '',
-                'description': str(row['Description']) if pd.notna(row['Description']) else '',
-                'isSoldOut': bool(row['Status'] == '売り切れ'),
-                'allergens': allergens_list,
-                'isSet': is_set,
-                'setCount': set_count,
-                'setItems': set_items_list
-            }
-            db.collection('items').document(row['ItemID']).set(item_data)
-        return jsonify({'success': True})
+        try:
+            new_items = parse_menu_csv(csv_data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        summary = sync_menu_items(db, new_items)
+        invalidate_menu_snapshot()
+        # 画像を取得し直して縮小版を作っておき、できたらページを作り直す (長期キャッシュできるURLに切り替わる)
+        image_cache.prewarm([item['imageUrl'] for item in new_items.values()], MENU_IMAGE_WIDTHS, on_done=invalidate_menu_snapshot)
+        return jsonify({'success': True, 'summary': summary})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/download_template_csv')
 @login_required
 def download_template_csv():
     if current_user.get_role() not in ['admin', 'superadmin']: return "Access Denied", 403
-    csv_header = "ItemID,Name,Price,Category,ImageURL,Description,Status,Allergens,IsSet,SetCount,SetItems\n"
+    csv_header = "ItemID,Name,Price,Category,ImageURL,Description,Status,Allergens,IsSet,SetCount,SetItems,Stock\n"
     return Response(csv_header, mimetype="text/csv", headers={"Content-disposition": "attachment; filename=menu_template.csv"})
 
 @app.route('/api/get_sales_data')
@@ -336,60 +1102,155 @@ def download_template_csv():
 def get_sales_data():
     if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
     try:
-        all_items_ordered, total_revenue, total_orders = [], 0, 0
-        items_master = {doc.id: doc.to_dict() for doc in db.collection('items').stream()}
-        items_by_name = {data['name']: data for id, data in items_master.items()}
-        for order_doc in db.collection('orders').stream():
-            order_data = order_doc.to_dict()
-            total_revenue += order_data.get('totalPrice', 0)
-            total_orders += 1
-            for item in order_data.get('items', []):
-                if item.get('isSet'):
-                    category = items_master.get(item['id'], {}).get('category', 'セット')
-                    all_items_ordered.append({'name': item['name'], 'quantity': 1, 'subtotal': item['price'], 'category': category})
-                else:
-                    category = items_by_name.get(item['name'], {}).get('category', '未分類')
-                    all_items_ordered.append({'name': item['name'], 'quantity': item['quantity'], 'subtotal': item['price'] * item['quantity'], 'category': category})
-        
-        if not all_items_ordered: return jsonify({'total_revenue': 0, 'total_orders': 0, 'sales_by_item': {}, 'sales_by_category': {}})
-        df = pd.DataFrame(all_items_ordered)
-        sales_by_item = df.groupby('name')['quantity'].sum().sort_values(ascending=False)
-        sales_by_category = df.groupby('category')['subtotal'].sum().sort_values(ascending=False)
-        dashboard_data = {'total_revenue': total_revenue, 'total_orders': total_orders, 'sales_by_item': sales_by_item.to_dict(), 'sales_by_category': sales_by_category.to_dict()}
+        summary = read_sales_summary()
+        sales_by_item = dict(sorted(summary.get('salesByItem', {}).items(), key=lambda x: x[1], reverse=True))
+        sales_by_category = dict(sorted(summary.get('salesByCategory', {}).items(), key=lambda x: x[1], reverse=True))
+        dashboard_data = {'total_revenue': summary.get('totalRevenue', 0), 'total_orders': summary.get('totalOrders', 0), 'sales_by_item': sales_by_item, 'sales_by_category': sales_by_category,
+                          'rebuild_required': summary['rebuildRequired']}
         return jsonify(dashboard_data)
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+@app.route('/api/rebuild_sales_summary', methods=['POST'])
+@login_required
+def rebuild_sales_summary_api():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    try:
+        summary = rebuild_sales_summary()
+        return jsonify({'success': True, 'total_orders': summary['totalOrders'], 'total_revenue': summary['totalRevenue']})
+    except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
+
+# --- 売上CSVのストリーミング出力 ---
+SALES_EXPORT_PAGE_SIZE = int(os.environ.get('SALES_EXPORT_PAGE_SIZE', 500))
+SALES_EXPORT_FLUSH_BYTES = 64 * 1024
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+def iter_query_pages(query, page_size=SALES_EXPORT_PAGE_SIZE):
+    """order_by済みのクエリを start_after カーソルでページングしながら1件ずつ返す"""
+    last_doc = None
+    while True:
+        page_query = query.limit(page_size)
+        if last_doc is not None:
+            page_query = page_query.start_after(last_doc)
+        docs = list(page_query.stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+def parse_jst_date(value):
+    """'YYYY-MM-DD' を日本時間のその日0時を表すdatetimeに変換する"""
+    return datetime.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=JST)
+
+@app.cli.command('archive-orders')
+def archive_orders_command():
+    """orders に残っている完了・会計済の注文をアーカイブへ移す"""
+    archive_finished_orders(db)
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """期限切れの注文キー (idempotency_keys) を削除する"""
+    idempotency.purge_expired(db)
+
+@app.cli.command('migrate-orders')
+def migrate_orders_command():
+    """以前の形式(items)で保存された注文を lines 形式に書き換える (注文を受け付けていない時間に実行する)"""
+    migrate_orders(db, get_menu_snapshot())
+
+@app.route('/api/archive_orders', methods=['POST'])
+@login_required
+def archive_orders():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    try:
+        return jsonify({'success': True, 'archived': archive_finished_orders(db)})
+    except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/download_sales_csv')
 @login_required
 def download_sales_csv():
     if current_user.get_role() not in ['admin', 'superadmin']: return "Access Denied", 403
     try:
-        all_items_ordered = []
-        items_master = {doc.id: doc.to_dict() for doc in db.collection('items').stream()}
-        items_by_name = {data['name']: data for id, data in items_master.items()}
-        for order_doc in db.collection('orders').stream():
-            order_data = order_doc.to_dict()
-            for item in order_data.get('items', []):
-                if item.get('isSet'):
-                    all_items_ordered.append({'name': item['name'], 'quantity': 1, 'subtotal': item['price'], 'category': 'セット'})
-                else:
-                    category = items_by_name.get(item['name'], {}).get('category', '未分類')
-                    all_items_ordered.append({'name': item['name'], 'quantity': item['quantity'], 'subtotal': item['price'] * item['quantity'], 'category': category})
-        
-        if not all_items_ordered: return "No data", 404
-        df = pd.DataFrame(all_items_ordered)
-        csv_output = io.StringIO()
-        df.to_csv(csv_output, index=False, encoding='utf-8-sig')
-        return Response(csv_output.getvalue(), mimetype="text/csv", headers={"Content-disposition": "attachment; filename=sales_details.csv"})
+        try:
+            start = parse_jst_date(request.args['start']) if request.args.get('start') else None
+            end = parse_jst_date(request.args['end']) + datetime.timedelta(days=1) if request.args.get('end') else None
+        except ValueError:
+            return "Invalid date", 400
+        # 処理中の注文(orders)と、期間に掛かる日のアーカイブを createdAt 順に合わせて読む
+        names = ['orders'] + [name for name in archive_collection_names(db)
+                              if (not start or name[-8:] >= start.strftime('%Y%m%d')) and (not end or name[-8:] < end.strftime('%Y%m%d'))]
+        queries = []
+        for name in names:
+            query = db.collection(name)
+            if start: query = query.where('createdAt', '>=', start)
+            if end: query = query.where('createdAt', '<', end)
+            queries.append(iter_query_pages(query.order_by('createdAt')))
+        # ステータスの絞り込みは複合インデックスを要求しないようにPython側で行う
+        status_filter = request.args.get('status')
+        payment_filter = request.args.get('payment')
+        orders = merge_by_created_at(*queries)
+        first_order = next(orders, None)
+        if first_order is None: return "No data", 404
+        menu = get_menu_snapshot()
+
+        def generate_rows():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            buffer.write('\ufeff')
+            writer.writerow(['name', 'quantity', 'subtotal', 'category'])
+            for order_doc in itertools.chain([first_order], orders):
+                order_data = order_doc.to_dict()
+                if status_filter and order_data.get('status') != status_filter: continue
+                if payment_filter and order_data.get('paymentStatus') != payment_filter: continue
+                for item in expand_lines(order_data, menu):
+                    if item.get('isSet'):
+                        writer.writerow([item['name'], 1, item['price'], 'セット'])
+                    else:
+                        category = menu['items_by_name'].get(item['name'], {}).get('category', '未分類')
+                        writer.writerow([item['name'], item['quantity'], item['price'] * item['quantity'], category])
+                if buffer.tell() >= SALES_EXPORT_FLUSH_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+            yield buffer.getvalue()
+
+        return Response(generate_rows(), mimetype="text/csv", headers={"Content-disposition": "attachment; filename=sales_details.csv"})
     except Exception as e: return str(e), 500
 
+# --- 売上分析 ---
+# 注文を日別のParquetに書き出し、時間帯別の集計はそのファイルから計算する
+@app.cli.command('snapshot-analytics')
+def snapshot_analytics_command():
+    """全注文を分析用のParquetに書き出す"""
+    analytics.snapshot_orders(db, get_menu_snapshot())
+
+@app.route('/api/snapshot_analytics', methods=['POST'])
+@login_required
+def snapshot_analytics():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    try:
+        return jsonify(dict(analytics.snapshot_orders(db, get_menu_snapshot()), success=True))
+    except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/get_analytics', methods=['GET'])
+@login_required
+def get_analytics():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
+    bucket_minutes = request.args.get('bucket', 15, type=int)
+    if bucket_minutes not in analytics.BUCKET_MINUTES: return jsonify({'error': 'Invalid bucket'}), 400
+    try:
+        start, end = request.args.get('start'), request.args.get('end')
+        for value in (start, end):
+            if value: parse_jst_date(value)
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    try:
+        return jsonify(analytics.build_report(start=start, end=end, bucket_minutes=bucket_minutes))
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
 @app.route('/api/get_store_status', methods=['GET'])
 def get_store_status():
     try:
-        doc = db.collection('store_settings').document('main').get()
-        if doc.exists:
-            return jsonify({'isStoreOpen': doc.to_dict().get('isStoreOpen', True)})
-        return jsonify({'isStoreOpen': True})
+        settings = doc_cache.get('store_settings', 'main') or {}
+        return jsonify({'isStoreOpen': settings.get('isStoreOpen', True)})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/api/update_store_status', methods=['POST'])
@@ -401,6 +1262,7 @@ def update_store_status():
         new_status = data.get('isStoreOpen')
         if new_status is None: return jsonify({'success': False, 'error': 'Missing data'}), 400
         db.collection('store_settings').document('main').set({'isStoreOpen': bool(new_status)}, merge=True)
+        doc_cache.invalidate('store_settings', 'main')
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -419,6 +1281,102 @@ def get_signage_items():
         return jsonify({'items': items_list, 'settings': settings_data})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+# --- サイネージのマニフェスト ---
+# 表示する画像(縮小版のURLと内容ハッシュ)・表示秒数・順番・設定をまとめ、内容から決まるバージョンを付ける。
+# サイネージ端末は最初にマニフェストの画像をすべて取得して手元に保存し、その後はバージョンだけを確認する
+SIGNAGE_MANIFEST_MAX_AGE = float(os.environ.get('SIGNAGE_MANIFEST_MAX_AGE', 30))
+SIGNAGE_DISPLAY_WIDTH = SIGNAGE_IMAGE_WIDTHS[-1]
+_signage_lock = threading.Lock()
+_signage_manifest = None
+
+def build_signage_manifest():
+    items_list, settings_data = [], {'fadeDuration': 1.5}
+    for doc in db.collection('signage_items').stream():
+        if doc.id == '--config--':
+            settings_data = doc.to_dict()
+            continue
+        item_data = doc.to_dict()
+        url = item_data.get('url')
+        if not url:
+            continue
+        # 縮小版ができていればそれを、まだなら元のURLを使う (縮小版ができるとバージョンが変わる)
+        name = image_cache.cached_variant(url, SIGNAGE_DISPLAY_WIDTH, 'webp')
+        items_list.append({
+            'id': doc.id, 'url': url,
+            'src': url_for('image_variant', name=name) if name else url,
+            'hash': image_cache.cached_hash(url),
+            'duration': item_data.get('duration', 10), 'order': item_data.get('order', 0),
+        })
+    items_list.sort(key=lambda x: (x['order'], x['id']))
+    content = json.dumps({'items': items_list, 'settings': settings_data}, sort_keys=True, ensure_ascii=False, default=str)
+    return {
+        'version': hashlib.sha1(content.encode('utf-8')).hexdigest()[:16],
+        'items': items_list,
+        'settings': settings_data,
+        'builtAt': time.monotonic(),
+    }
+
+def get_signage_manifest():
+    """現在のマニフェストを返す (無効化済み・期限切れなら作り直す)"""
+    global _signage_manifest
+    with _signage_lock:
+        manifest = _signage_manifest
+        if manifest is None or time.monotonic() - manifest['builtAt'] > SIGNAGE_MANIFEST_MAX_AGE:
+            manifest = _signage_manifest = build_signage_manifest()
+        return manifest
+
+def invalidate_signage_manifest():
+    global _signage_manifest
+    with _signage_lock:
+        _signage_manifest = None
+
+@app.route('/api/signage_manifest')
+def signage_manifest():
+    try:
+        manifest = get_signage_manifest()
+        return jsonify({key: manifest[key] for key in ('version', 'items', 'settings')})
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
+@app.route('/api/signage_version')
+def signage_version():
+    try:
+        return jsonify({'version': get_signage_manifest()['version']})
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
+# --- 画像の縮小版 ---
+# /img/item/<ItemID>?w=幅&fmt=webp|jpeg で縮小版を作り、内容ハッシュ付きの /img/v/<名前> へ転送する
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+def _image_response(url, default_width):
+    width = snap_width(request.args.get('w', default_width, type=int))
+    fmt = request.args.get('fmt') or ('webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg')
+    if fmt not in IMAGE_FORMATS: return "Invalid format", 400
+    try:
+        name = image_cache.ensure_variant(url, width, fmt)
+    except Exception as e:
+        # 縮小版を作れない場合は元の画像をそのまま見せる
+        print(f"Error resizing image {url}: {e}")
+        return redirect(url)
+    return redirect(url_for('image_variant', name=name))
+
+@app.route('/img/item/<item_id>')
+def item_image(item_id):
+    item = get_menu_snapshot()['items_by_id'].get(item_id)
+    if not item or not item.get('imageUrl'): return "Not found", 404
+    return _image_response(item['imageUrl'], 640)
+
+@app.route('/img/signage/<doc_id>')
+def signage_image(doc_id):
+    doc = db.collection('signage_items').document(doc_id).get()
+    if not doc.exists or not doc.to_dict().get('url'): return "Not found", 404
+    return _image_response(doc.to_dict()['url'], 1920)
+
+@app.route('/img/v/<name>')
+def image_variant(name):
+    response = send_from_directory(image_cache.variant_dir, name, max_age=IMAGE_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_CACHE_MAX_AGE}, immutable'
+    return response
+
 @app.route('/api/get_signage_list', methods=['GET'])
 @login_required
 def get_signage_list():
@@ -439,6 +1397,9 @@ def update_signage_item():
         if not all([doc_id, field, value is not None]): return jsonify({'success': False, 'error': 'Missing data'}), 400
         if field in ['duration', 'order']: value = int(value)
         db.collection('signage_items').document(doc_id).update({field: value})
+        invalidate_signage_manifest()
+        if field == 'url':
+            image_cache.prewarm([value], SIGNAGE_IMAGE_WIDTHS, on_done=invalidate_signage_manifest)
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -450,14 +1411,15 @@ def upload_signage_csv():
     file = request.files['csv-file']
     if file.filename == '' or not file.filename.endswith('.csv'): return jsonify({'success': False, 'error': 'Invalid file'}), 400
     try:
+        reader = csv.DictReader(io.StringIO(file.stream.read().decode("utf-8-sig")))
+        rows = [{'url': row['url'], 'duration': int(row['duration']), 'order': int(row['order'])} for row in reader]
         for doc in db.collection('signage_items').stream():
             if doc.id != '--config--':
                 doc.reference.delete()
-        csv_data = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        df = pd.read_csv(csv_data)
-        for index, row in df.iterrows():
-            item_data = {'url': row['url'], 'duration': int(row['duration']), 'order': int(row['order'])}
+        for item_data in rows:
             db.collection('signage_items').add(item_data)
+        invalidate_signage_manifest()
+        image_cache.prewarm([row['url'] for row in rows], SIGNAGE_IMAGE_WIDTHS, on_done=invalidate_signage_manifest)
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -489,6 +1451,7 @@ def add_user():
         if db.collection('users').document(username).get().exists: return jsonify({'success': False, 'error': 'Username already exists'}), 400
         user_data = {'username': username, 'passwordHash': generate_password_hash(password), 'role': role}
         db.collection('users').document(username).set(user_data)
+        doc_cache.invalidate('users', username)
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -502,21 +1465,120 @@ def delete_user():
         if not username: return jsonify({'success': False, 'error': 'Username is required'}), 400
         if username == current_user.id: return jsonify({'success': False, 'error': 'Cannot delete yourself'}), 400
         db.collection('users').document(username).delete()
+        doc_cache.invalidate('users', username)
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
-def delete_collection(coll_ref):
-    for doc in coll_ref.stream():
-        doc.reference.delete()
+# --- 一括削除 (リセット処理) ---
+# ドキュメントIDだけを列挙し、500件ずつのバッチ削除をスレッドプールで並列に実行する。
+# リセットはバックグラウンドのジョブとして動かし、管理画面は /api/reset_status で進捗を確認する。
+# ジョブの状態は reset_jobs に保存する (進捗の確認がジョブを動かしていない別のワーカーに届いても分かるように)。
+DELETE_BATCH_SIZE = 500
+DELETE_WORKERS = int(os.environ.get('DELETE_WORKERS', 8))
+RESET_DATA_COLLECTIONS = ['orders', 'tickets', 'counters', 'sales_summary', 'items', 'stock', 'signage_items',
+                          idempotency.IDEMPOTENCY_COLLECTION]
+
+def reset_data_collections():
+    """データリセットで削除するコレクション (日別の注文アーカイブを含む)"""
+    return RESET_DATA_COLLECTIONS + archive_collection_names(db) + [ARCHIVE_INDEX]
+
+RESET_JOBS_COLLECTION = 'reset_jobs'
+# 実行中のジョブを指すドキュメント。一度に1つのリセットしか動かさないため、全ワーカーでこれを確認する
+RESET_ACTIVE_JOB_ID = 'active'
+# この秒数より長く進捗が更新されていない実行中のジョブは、ワーカーの停止などで止まったものとみなす
+RESET_JOB_STALE_SECONDS = 300
+
+def _reset_job_ref(job_id):
+    return db.collection(RESET_JOBS_COLLECTION).document(job_id)
+
+def _commit_delete_batch(refs):
+    batch = db.batch()
+    for ref in refs:
+        batch.delete(ref)
+    batch.commit()
+    return len(refs)
+
+def delete_collection(coll_ref, keep_ids=(), on_progress=None):
+    """コレクション内のドキュメントを並列のバッチ削除で消し、削除件数を返す"""
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        futures, chunk = [], []
+        for ref in coll_ref.list_documents(page_size=DELETE_BATCH_SIZE):
+            if ref.id in keep_ids:
+                continue
+            chunk.append(ref)
+            if len(chunk) == DELETE_BATCH_SIZE:
+                futures.append(executor.submit(_commit_delete_batch, chunk))
+                chunk = []
+        if chunk:
+            futures.append(executor.submit(_commit_delete_batch, chunk))
+        for future in as_completed(futures):
+            count = future.result()
+            deleted += count
+            if on_progress:
+                on_progress(count)
+    return deleted
+
+def _run_reset_job(job, targets):
+    job_ref = _reset_job_ref(job['id'])
+    def add_progress(count):
+        job_ref.update({'deleted': firestore.Increment(count), 'updatedAt': time.time()})
+    try:
+        for coll_name, keep_ids in targets:
+            job_ref.update({'current': coll_name, 'updatedAt': time.time()})
+            delete_collection(db.collection(coll_name), keep_ids, add_progress)
+            job_ref.update({'completed': firestore.ArrayUnion([coll_name]), 'updatedAt': time.time()})
+        state, error = 'done', None
+    except Exception as e:
+        print(f"Error in reset job {job['id']}: {e}")
+        state, error = 'error', str(e)
+    invalidate_menu_snapshot()
+    invalidate_signage_manifest()
+    doc_cache.invalidate('users')
+    finished_at = time.time()
+    job_ref.update({'state': state, 'error': error, 'current': None, 'finishedAt': finished_at, 'updatedAt': finished_at})
+    active_ref = _reset_job_ref(RESET_ACTIVE_JOB_ID)
+    active = active_ref.get()
+    if active.exists and active.get('jobId') == job['id']:
+        active_ref.delete()
+
+@storage.transactional
+def _claim_reset_job(transaction, job):
+    """実行中のジョブが無ければ job を登録して実行中にする。実行中のジョブがあればFalse"""
+    active_ref = _reset_job_ref(RESET_ACTIVE_JOB_ID)
+    active = active_ref.get(transaction=transaction)
+    if active.exists:
+        running = _reset_job_ref(active.get('jobId')).get(transaction=transaction)
+        if running.exists and running.get('state') == 'running' and time.time() - running.get('updatedAt') < RESET_JOB_STALE_SECONDS:
+            return False
+    transaction.set(active_ref, {'jobId': job['id']})
+    transaction.set(_reset_job_ref(job['id']), job)
+    return True
+
+def start_reset_job(targets):
+    """リセット用のジョブを開始してジョブ情報を返す。実行中のジョブがあればNone"""
+    now = time.time()
+    job = {
+        'id': uuid.uuid4().hex, 'state': 'running', 'collections': [name for name, _ in targets],
+        'completed': [], 'current': None, 'deleted': 0, 'error': None,
+        'startedAt': now, 'updatedAt': now, 'finishedAt': None
+    }
+    if not _claim_reset_job(db.transaction(), job):
+        return None
+    threading.Thread(target=_run_reset_job, args=(job, targets), daemon=True).start()
+    return job
+
+def _reset_response(targets):
+    job = start_reset_job(targets)
+    if job is None: return jsonify({'success': False, 'error': '別のリセット処理が実行中です。'}), 409
+    return jsonify({'success': True, 'jobId': job['id']})
 
 @app.route('/api/reset_data', methods=['POST'])
 @login_required
 def reset_data():
     if current_user.get_role() != 'superadmin': return jsonify({'success': False, 'error': 'Forbidden'}), 403
     try:
-        for coll_name in ['orders', 'items', 'signage_items']:
-            delete_collection(db.collection(coll_name))
-        return jsonify({'success': True})
+        return _reset_response([(name, ()) for name in reset_data_collections()])
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/reset_all', methods=['POST'])
@@ -524,12 +1586,7 @@ def reset_data():
 def reset_all():
     if current_user.get_role() != 'superadmin': return jsonify({'success': False, 'error': 'Forbidden'}), 403
     try:
-        for coll_name in ['orders', 'items', 'signage_items']:
-            delete_collection(db.collection(coll_name))
-        for doc in db.collection('users').stream():
-            if doc.id != current_user.id:
-                doc.reference.delete()
-        return jsonify({'success': True})
+        return _reset_response([(name, ()) for name in reset_data_collections()] + [('users', (current_user.id,))])
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/reset_super', methods=['POST'])
@@ -537,11 +1594,18 @@ def reset_all():
 def reset_super():
     if current_user.get_role() != 'superadmin': return jsonify({'success': False, 'error': 'Forbidden'}), 403
     try:
-        for coll_name in ['orders', 'items', 'signage_items', 'users']:
-            delete_collection(db.collection(coll_name))
-        return jsonify({'success': True})
+        return _reset_response([(name, ()) for name in reset_data_collections() + ['users']])
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
+# 実行者自身のアカウントも消える reset_super の完了を確認できるよう、
+# 推測不能なジョブIDを知っていればログインなしで進捗を取得できる
+@app.route('/api/reset_status/<job_id>', methods=['GET'])
+def reset_status(job_id):
+    if job_id == RESET_ACTIVE_JOB_ID: return jsonify({'error': 'Job not found'}), 404
+    doc = _reset_job_ref(job_id).get()
+    if not doc.exists: return jsonify({'error': 'Job not found'}), 404
+    return jsonify(doc.to_dict())
+
 @app.route('/api/get_store_settings', methods=['GET'])
 @login_required
 def get_store_settings():
@@ -556,6 +1620,7 @@ def update_store_settings():
     try:
         data = request.get_json()
         db.collection('store_settings').document('main').set(data, merge=True)
+        doc_cache.invalidate('store_settings', 'main')
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -581,8 +1646,108 @@ def update_permissions():
     try:
         new_permissions = request.get_json()
         db.collection('permissions').document('role_access').set(new_permissions)
+        doc_cache.invalidate('permissions', 'role_access')
         return jsonify({'success': True})
     except Exception as e: return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/get_sync_status', methods=['GET'])
+@login_required
+def get_sync_status():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(storage.sync_status())
+
+@app.route('/api/get_cache_stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(doc_cache.stats())
+
+# --- 性能計測 ---
+def metrics_gauges():
+    cache = doc_cache.stats()
+    gauges = [
+        ('document_cache_hits', 'Document cache hits since start.', cache['hits']),
+        ('document_cache_misses', 'Document cache misses since start.', cache['misses']),
+        ('document_cache_entries', 'Documents currently held in the cache.', cache['entries']),
+    ]
+    sync = storage.sync_status()
+    if sync.get('syncEnabled'):
+        gauges.append(('local_outbox_pending', 'Local writes waiting to be synced to Firestore.', sync.get('pending', 0)))
+    return gauges
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # METRICS_TOKEN を設定した場合は Authorization: Bearer <token> が必要
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response('Unauthorized', status=401)
+    return Response(metrics.render_prometheus(metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/get_metrics', methods=['GET'])
+@login_required
+def get_metrics():
+    if current_user.get_role() not in ['admin', 'superadmin']: return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(dict(metrics.summary(), cache=doc_cache.stats()))
+
+# --- ワーカーの起動準備とヘルスチェック ---
+# gunicorn のワーカーは、リクエストを受け付ける前に warm_up() でメニュー・店舗設定・権限を読み込み、
+# 注文フィードの監視を始めておく (最初のお客さんの注文で読み込みを待たせない)。
+# キャッシュやフィードはワーカーごとに持つため、ワーカーの数だけ読み込みと監視が行われる
+_warmup = {'ready': False, 'warmedAt': None, 'durationMs': None, 'error': None}
+
+def warm_up(feed_timeout=10):
+    """このプロセスのキャッシュを読み込み、準備の状態を返す。失敗しても例外は出さず、/readyz で分かるようにする"""
+    started = time.perf_counter()
+    try:
+        menu = get_menu_snapshot()
+        doc_cache.prefetch([('store_settings', 'main'), ('permissions', 'role_access')])
+        for feed in order_feeds.values():
+            feed.ensure_started(feed_timeout)
+        _warmup.update(ready=True, error=None, menuVersion=menu['version'])
+    except Exception as e:
+        _warmup.update(ready=False, error=str(e))
+        print(f"Error warming up worker {os.getpid()}: {e}")
+    _warmup.update(warmedAt=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                   durationMs=round((time.perf_counter() - started) * 1000, 1))
+    return dict(_warmup)
+
+@app.route('/healthz')
+def healthz():
+    """プロセスが応答できるか (ストレージには触れない)"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """キャッシュの読み込みが済み、注文を受け付けられるか。準備中・失敗時は503"""
+    if _warmup['warmedAt'] is None:
+        # gunicorn 以外 (開発サーバーなど) で起動した場合は、最初の確認で読み込む
+        warm_up()
+    result = dict(_warmup, pid=os.getpid(), menuWatch=_menu_watch_active())
+    sync = storage.sync_status()
+    if sync.get('syncEnabled'):
+        result['pendingSync'] = sync.get('pending', 0)
+    response = jsonify(result)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if _warmup['ready'] else 503
+
+# --- アプリの作成 ---
+def create_app(config=None, client=None):
+    """
+    設定済みのアプリを返す (gunicorn 'app:create_app()' / テスト用)。
+    config で app.config を上書きし、client を渡すとそのストレージクライアントを使う。
+    ストレージへの接続は最初のリクエストまで行わない
+    """
+    if config:
+        app.config.update(config)
+    if client is not None:
+        storage.set_client(client)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # 開発サーバーでは鍵ファイルが無いことを起動時に知らせる
+    try:
+        storage.get_client()
+    except (storage.StorageConfigError, storage.LocalStoreLocked) as e:
+        print(f"FATAL ERROR: {e}")
+        raise SystemExit(1)
+    # 本番では serve.py (gunicorn) で起動する
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,354 @@
+"""
+注文処理の負荷テスト・レイテンシ計測
+Firestoreの代わりに一時ディレクトリのローカルストレージ (STORAGE_BACKEND=local, 同期なし) を使い、
+昼のピークを想定した操作 (メニュー表示 / 注文 / 会計 / 調理ステータス変更) を複数スレッドで流して、
+エンドポイントごとの p50 / p95 / p99 レイテンシとスループットを計測する。
+あわせて、新しいプロセスで app を読み込んでから最初のリクエストに応答するまでの時間 (起動時間) を計測する。
+
+使い方:
+    python benchmark.py                                    # 計測して結果を表示
+    python benchmark.py --startup-only                     # 起動時間だけを計測する
+    python benchmark.py --save benchmark_baseline.json     # 結果を基準値として保存
+    python benchmark.py --compare benchmark_baseline.json  # 基準値と比較し、悪化していれば終了コード1
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MENU_CSV_PATH = os.path.join(APP_DIR, 'menu_template .csv')
+BENCH_USER = 'benchmark'
+BENCH_PASSWORD = 'benchmark'
+
+# 1人の客(スレッド)が次に行う操作の重み。前の工程の注文が溜まっていない操作は選ばれない
+ACTION_WEIGHTS = {
+    'menu_view': 5,
+    'create_order': 3,
+    'cashier': 3,
+    'kitchen_ready': 3,
+    'kitchen_done': 3,
+}
+
+# 起動時間の計測で、新しいプロセスの中で実行するスクリプト
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.create_app().test_client()
+created = time.perf_counter()
+first = client.get('/')
+first_done = time.perf_counter()
+client.get('/')
+second_done = time.perf_counter()
+print(json.dumps({'importMs': (imported - started) * 1000, 'createAppMs': (created - imported) * 1000,
+                  'firstRequestMs': (first_done - created) * 1000, 'secondRequestMs': (second_done - first_done) * 1000,
+                  'status': first.status_code}))
+"""
+STARTUP_METRICS = ('importMs', 'createAppMs', 'firstRequestMs', 'secondRequestMs', 'processMs')
+
+def local_storage_env(db_path):
+    """一時DBを使うための環境変数"""
+    tmp_dir = os.path.dirname(db_path)
+    return {
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_DB_PATH': db_path,
+        # 計測中の書き込みが本番のFirestoreへ同期されないよう、存在しない鍵を指定して同期を無効にする
+        'FIREBASE_KEY_PATH': os.path.join(tmp_dir, 'no-firebase-key.json'),
+        'IMAGE_CACHE_DIR': os.path.join(tmp_dir, 'image_cache'),
+        'ANALYTICS_DIR': os.path.join(tmp_dir, 'analytics'),
+    }
+
+def setup_app(db_path):
+    """一時DBを使うようにしてからappを読み込み、ユーザーとメニューを用意する"""
+    os.environ.update(local_storage_env(db_path))
+    import app as app_module
+    from werkzeug.security import generate_password_hash
+    from menu_import import parse_menu_csv, sync_menu_items
+
+    db = app_module.db
+    db.collection('users').document(BENCH_USER).set({
+        'username': BENCH_USER, 'passwordHash': generate_password_hash(BENCH_PASSWORD), 'role': 'superadmin'
+    })
+    db.collection('store_settings').document('main').set({'isStoreOpen': True})
+    with open(MENU_CSV_PATH, 'r', encoding='utf-8-sig') as f:
+        sync_menu_items(db, parse_menu_csv(f), log=lambda message: None)
+    app_module.invalidate_menu_snapshot()
+    return app_module
+
+def build_cart(menu, rng):
+    """メニューから1〜3行のカートを作る (セットはお客さんが選んだ商品名の配列を持つ)"""
+    singles = [item for item in menu['items'] if not item.get('isSet') and not item.get('isSoldOut')]
+    sets = [item for item in menu['items'] if item.get('isSet') and not item.get('isSoldOut')]
+    names = {item['ItemID']: item['name'] for item in singles}
+    cart = []
+    for item in rng.sample(singles, min(len(singles), rng.randint(1, 2))):
+        cart.append({'id': item['ItemID'], 'name': item['name'], 'price': item['price'], 'quantity': rng.randint(1, 3)})
+    if sets and rng.random() < 0.4:
+        item = rng.choice(sets)
+        choices = [names[item_id] for item_id in item.get('setItems', []) if item_id in names] or list(names.values())
+        cart.append({'id': item['ItemID'], 'name': item['name'], 'price': item['price'], 'quantity': 1,
+                     'isSet': True, 'selectedItems': [rng.choice(choices) for _ in range(item.get('setCount', 0))]})
+    return cart
+
+def percentile(sorted_values, p):
+    """線形補間のパーセンタイル (sorted_values は昇順)"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class OrderPipeline:
+    """注文が 会計待ち → 調理中 → 提供可能 と流れていく共有キュー"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {'cashier': deque(), 'kitchen_ready': deque(), 'kitchen_done': deque()}
+
+    def push(self, stage, order):
+        with self.lock:
+            self.queues[stage].append(order)
+
+    def pop(self, stage):
+        with self.lock:
+            return self.queues[stage].popleft() if self.queues[stage] else None
+
+    def available(self):
+        with self.lock:
+            return [stage for stage, queue in self.queues.items() if queue]
+
+
+class Worker(threading.Thread):
+    def __init__(self, app_module, pipeline, deadline, measure_from, seed):
+        super().__init__(daemon=True)
+        self.app_module = app_module
+        self.pipeline = pipeline
+        self.deadline = deadline
+        self.measure_from = measure_from
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.etag = None
+
+    def call(self, name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = getattr(self.client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - started
+        # ウォームアップ中の結果は集計しない
+        if started >= self.measure_from:
+            self.latencies[name].append(elapsed * 1000)
+            if response.status_code >= 400:
+                self.errors[name] += 1
+        return response
+
+    def run(self):
+        self.client = self.app_module.app.test_client()
+        self.client.post('/login', data={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+        while time.perf_counter() < self.deadline:
+            actions = ['menu_view', 'create_order'] + self.pipeline.available()
+            action = self.rng.choices(actions, weights=[ACTION_WEIGHTS[a] for a in actions])[0]
+            getattr(self, action)()
+
+    def menu_view(self):
+        # 再訪問の客はブラウザのキャッシュ (If-None-Match) 付きで開く
+        headers = {'If-None-Match': self.etag} if self.etag and self.rng.random() < 0.5 else {}
+        response = self.call('GET /', 'get', '/', headers=headers)
+        self.etag = response.headers.get('ETag', self.etag)
+
+    def create_order(self):
+        cart = build_cart(self.app_module.get_menu_snapshot(), self.rng)
+        response = self.call('POST /order', 'post', '/order', json=cart)
+        if response.status_code == 200 and response.get_json().get('success'):
+            result = response.get_json()
+            self.pipeline.push('cashier', (result['ticketNumber'], result['orderId']))
+
+    def cashier(self):
+        order = self.pipeline.pop('cashier')
+        if order is None:
+            return
+        ticket_number, order_id = order
+        self.call('GET /api/get_order_by_ticket', 'get', '/api/get_order_by_ticket', query_string={'ticket': ticket_number})
+        self.call('POST /api/update_payment_status', 'post', '/api/update_payment_status', json={'docId': order_id})
+        self.pipeline.push('kitchen_ready', order)
+
+    def kitchen_ready(self):
+        order = self.pipeline.pop('kitchen_ready')
+        if order is None:
+            return
+        self.call('POST /api/update_order_status (ready)', 'post', '/api/update_order_status', json={'docId': order[1], 'status': '提供可能'})
+        self.pipeline.push('kitchen_done', order)
+
+    def kitchen_done(self):
+        order = self.pipeline.pop('kitchen_done')
+        if order is None:
+            return
+        self.call('POST /api/update_order_status (done)', 'post', '/api/update_order_status', json={'docId': order[1], 'status': '完了'})
+
+
+def run_benchmark(duration, workers, warmup, seed):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_module = setup_app(os.path.join(tmp_dir, 'benchmark.sqlite3'))
+        pipeline = OrderPipeline()
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+        threads = [Worker(app_module, pipeline, deadline, measure_from, seed + i) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - measure_from
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    for thread in threads:
+        for name, values in thread.latencies.items():
+            latencies[name].extend(values)
+        for name, count in thread.errors.items():
+            errors[name] += count
+
+    endpoints = {}
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        endpoints[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'throughputPerSec': round(len(values) / elapsed, 2),
+            'meanMs': round(sum(values) / len(values), 3),
+            'p50Ms': round(percentile(values, 50), 3),
+            'p95Ms': round(percentile(values, 95), 3),
+            'p99Ms': round(percentile(values, 99), 3),
+            'maxMs': round(values[-1], 3),
+        }
+    orders = endpoints.get('POST /order', {}).get('count', 0)
+    return {
+        'meta': {
+            'createdAt': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': 'local',
+            'workers': workers, 'durationSec': duration, 'warmupSec': warmup, 'seed': seed,
+        },
+        'ordersPerMinute': round(orders / elapsed * 60, 1),
+        'endpoints': endpoints,
+    }
+
+def run_startup_benchmark(runs):
+    """新しいプロセスで app の読み込み・create_app・最初の2回のリクエストにかかる時間を runs 回計測し、中央値を返す"""
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'startup.sqlite3')
+        # メニューを登録したDBを用意しておく (最初のリクエストでメニューを読み込ませる)
+        from local_store import LocalClient
+        from menu_import import parse_menu_csv, sync_menu_items
+        client = LocalClient(db_path)
+        client.collection('store_settings').document('main').set({'isStoreOpen': True})
+        with open(MENU_CSV_PATH, 'r', encoding='utf-8-sig') as f:
+            sync_menu_items(client, parse_menu_csv(f), log=lambda message: None)
+        # 計測するプロセスがDBを開けるよう、ロックを手放しておく
+        client.close()
+        env = dict(os.environ, **local_storage_env(db_path))
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=APP_DIR, env=env,
+                                       capture_output=True, text=True, check=True)
+            sample = json.loads(completed.stdout.strip().splitlines()[-1])
+            if sample.pop('status') >= 400:
+                raise RuntimeError(f"起動直後のリクエストが失敗しました: {completed.stdout}")
+            sample['processMs'] = (time.perf_counter() - started) * 1000
+            samples.append(sample)
+    return {'runs': runs, **{name: round(statistics.median(sample[name] for sample in samples), 1) for name in STARTUP_METRICS}}
+
+def print_startup_report(startup):
+    print(f"\n起動時間 (新しいプロセス {startup['runs']}回の中央値)")
+    print(f"  app の読み込み:      {startup['importMs']:>8.1f}ms")
+    print(f"  create_app:          {startup['createAppMs']:>8.1f}ms")
+    print(f"  最初のリクエスト:    {startup['firstRequestMs']:>8.1f}ms")
+    print(f"  2回目のリクエスト:   {startup['secondRequestMs']:>8.1f}ms")
+    print(f"  プロセス全体:        {startup['processMs']:>8.1f}ms")
+
+def print_report(result):
+    print(f"\n注文処理ベンチマーク ({result['meta']['workers']}スレッド, {result['meta']['durationSec']}秒)")
+    print(f"{'endpoint':<40}{'count':>8}{'err':>6}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in result['endpoints'].items():
+        print(f"{name:<40}{stats['count']:>8}{stats['errors']:>6}{stats['throughputPerSec']:>10.1f}"
+              f"{stats['p50Ms']:>9.2f}ms{stats['p95Ms']:>8.2f}ms{stats['p99Ms']:>8.2f}ms")
+    print(f"注文処理能力: {result['ordersPerMinute']} 件/分")
+
+def compare_with_baseline(result, baseline, tolerance):
+    """基準値より p95 が tolerance 以上遅い、またはスループットが tolerance 以上低いエンドポイントを返す"""
+    regressions = []
+    for name in ('importMs', 'firstRequestMs'):
+        base, current = baseline.get('startup', {}).get(name), result.get('startup', {}).get(name)
+        if base and current and current > base * (1 + tolerance):
+            regressions.append(f"起動時間 {name}: {base:.1f}ms → {current:.1f}ms")
+    for name, base in baseline.get('endpoints', {}).items() if 'endpoints' in result else ():
+        current = result['endpoints'].get(name)
+        if current is None:
+            regressions.append(f"{name}: 計測されませんでした")
+            continue
+        if current['p95Ms'] > base['p95Ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95Ms']:.2f}ms → {current['p95Ms']:.2f}ms")
+        if current['throughputPerSec'] < base['throughputPerSec'] * (1 - tolerance):
+            regressions.append(f"{name}: スループット {base['throughputPerSec']:.1f} → {current['throughputPerSec']:.1f} req/s")
+        if current['errors'] > base.get('errors', 0):
+            regressions.append(f"{name}: エラー {base.get('errors', 0)} → {current['errors']}件")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='注文処理の負荷テスト・レイテンシ計測')
+    parser.add_argument('--duration', type=float, default=20, help='計測時間(秒)')
+    parser.add_argument('--workers', type=int, default=8, help='同時に操作するスレッド数')
+    parser.add_argument('--warmup', type=float, default=2, help='集計しない最初の秒数')
+    parser.add_argument('--seed', type=int, default=1, help='操作を再現するための乱数シード')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='結果を基準値としてJSONに保存する')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='基準値のJSONと比較する')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='悪化とみなす割合 (0.2 = 20%%)')
+    parser.add_argument('--startup-runs', type=int, default=3, help='起動時間を計測する回数 (0なら計測しない)')
+    parser.add_argument('--startup-only', action='store_true', help='起動時間だけを計測する')
+    args = parser.parse_args()
+
+    startup = run_startup_benchmark(args.startup_runs) if args.startup_runs > 0 else None
+    if args.startup_only:
+        result = {'meta': {'createdAt': datetime.datetime.now().isoformat(timespec='seconds'),
+                           'python': platform.python_version(), 'platform': platform.platform(), 'backend': 'local'}}
+    else:
+        result = run_benchmark(args.duration, args.workers, args.warmup, args.seed)
+        print_report(result)
+    if startup:
+        result['startup'] = startup
+        print_startup_report(startup)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"基準値を保存しました: {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n基準値 ({args.compare}) より悪化しています:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n基準値 ({args.compare}) との比較: 問題なし")
+
+
+# --- スクリプトのエントリーポイント ---
+if __name__ == '__main__':
+    main()
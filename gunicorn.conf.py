@@ -0,0 +1,74 @@
+"""
+gunicorn の設定 (本番用)
+    python serve.py                                  # この設定で起動する
+    gunicorn -c gunicorn.conf.py 'app:create_app()'  # 同じ意味
+
+- ワーカー(プロセス)をCPUのコア数だけ起動し、各ワーカーはスレッドで同時に複数のリクエストを処理する (gthread)。
+  ただし STORAGE_BACKEND=local では、ローカルDBを開けるのは1つのプロセスだけのため、ワーカーは1つにする。
+- 注文フィード(SSE)は接続している間スレッドを1つ使い続ける。画面ごとの接続数は 厨房 1 (持ち場の画面も 1)・会計 1・
+  モニター 2 なので、同時に開く画面の数から必要な接続数を数え、WEB_THREADS をそれより FEED_THREAD_HEADROOM 以上多くする。
+  配信できる数 (FEED_STREAM_LIMIT) は WEB_THREADS - FEED_THREAD_HEADROOM とし、残りのスレッドは注文などのリクエストに使う。
+  上限を超えた画面には 503 (Retry-After) を返し、画面は少し待ってから接続し直す。
+  既定の 32 スレッドでは、ワーカー1つあたり 24 接続まで配信する。
+- 各ワーカーはリクエストを受け付ける前にメニュー・店舗設定・権限を読み込み、注文フィードの監視を始める (post_worker_init)。
+- 設定の再読み込み: kill -HUP <masterのPID> で新しいワーカーを起動し、古いワーカーは処理中のリクエストを
+  終えてから (最大 graceful_timeout 秒) 終了する。新しいワーカーは起動時にメニューを読み直す。
+- キャッシュ・注文フィード・待ち時間の見積もり・計測値 (/metrics の worker ラベル) はワーカーごとに持つ。
+  複数のワーカーで共有する状態 (注文・整理券番号・在庫・二重送信防止のキー・リセットの進捗) はFirestoreにあり、
+  トランザクションで読み書きする。ローカルDBは1プロセス専用で、複数のワーカーからは共有できない。
+"""
+
+import multiprocessing
+import os
+import secrets
+
+LOCAL_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore') == 'local'
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = 1 if LOCAL_BACKEND else int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 32))
+# SSEの配信に使わずに残しておくスレッド数
+FEED_THREAD_HEADROOM = 8
+os.environ.setdefault('FEED_STREAM_LIMIT', str(max(threads - FEED_THREAD_HEADROOM, threads // 2, 1)))
+# gthread ではワーカーの生存確認の間隔 (SSEの接続が長く続いても切られない)
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+# Firestoreのクライアント(gRPC)と監視のスレッドはforkの後に作る必要があるため、アプリはワーカーごとに読み込む
+preload_app = False
+accesslog = os.environ.get('ACCESS_LOG', '-')
+
+if LOCAL_BACKEND:
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        print("WARNING: STORAGE_BACKEND=local runs a single worker. WEB_CONCURRENCY is ignored.")
+    # 再読み込みで起動した新しいワーカーは、古いワーカーが処理を終えてDBのロックを手放すまで待つ
+    os.environ.setdefault('LOCAL_DB_LOCK_TIMEOUT', str(graceful_timeout + 5))
+
+# SECRET_KEY が無いとワーカーごとに別のランダムな鍵になり、別のワーカーに届いたリクエストでログインが外れる。
+# 設定されていなければmasterで1つ作ってワーカーに引き継ぐ (masterを再起動するとログインし直しになる)
+if not os.environ.get('SECRET_KEY'):
+    os.environ['SECRET_KEY'] = secrets.token_hex(32)
+    print("WARNING: SECRET_KEY is not set. Using a random key until the server is restarted.")
+
+
+def on_starting(server):
+    # 鍵ファイルが無いなどの設定の誤りは、ワーカーを起動する前に止める
+    import storage
+    try:
+        storage.check_config()
+    except storage.StorageConfigError as e:
+        server.log.error(f"FATAL ERROR: {e}")
+        raise SystemExit(1)
+    if LOCAL_BACKEND and server.cfg.workers > 1:
+        server.log.error("FATAL ERROR: STORAGE_BACKEND=local can only run a single worker (--workers 1).")
+        raise SystemExit(1)
+
+
+def post_worker_init(worker):
+    import app
+    status = app.warm_up()
+    if status['ready']:
+        worker.log.info(f"Worker {worker.pid} warmed up in {status['durationMs']}ms (menu {status['menuVersion']})")
+    else:
+        worker.log.warning(f"Worker {worker.pid} started without warm caches: {status['error']}")
@@ -0,0 +1,82 @@
+"""
+注文送信の二重登録防止 (Idempotency-Key)
+注文画面は1回の注文ごとにキーを作り、再送するときも同じキーを Idempotency-Key ヘッダーで送る。
+サーバーは idempotency_keys/<キー> に作成した注文を記録し、同じキーの再送には最初の注文をそのまま返す。
+キーの記録は注文と同じトランザクションで書き込むため、同時に再送されても注文は1件しかできない。
+記録は expiresAt を過ぎたら消してよい (Firestoreの TTLポリシーを expiresAt に設定するか、
+flask purge-idempotency-keys を定期的に実行する)。
+"""
+
+import datetime
+import hashlib
+import os
+import re
+
+from firebase_admin import firestore
+
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,128}$')
+PURGE_BATCH_LIMIT = 500
+
+
+class IdempotencyConflict(Exception):
+    """同じキーで内容の違う注文が送られた"""
+
+
+def validate_key(key):
+    """ヘッダーの値を検証する。キーが無ければNone、不正ならValueError"""
+    if not key:
+        return None
+    if not KEY_PATTERN.match(key):
+        raise ValueError('Idempotency-Key が不正です。')
+    return key
+
+def request_hash(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def key_ref(db, key):
+    return db.collection(IDEMPOTENCY_COLLECTION).document(key)
+
+def _result(record, body_hash):
+    """有効な記録なら (注文ID, 整理券番号) を返す。期限切れ・記録なしはNone"""
+    if record is None:
+        return None
+    expires_at = record.get('expiresAt')
+    if isinstance(expires_at, datetime.datetime) and expires_at <= datetime.datetime.now(datetime.timezone.utc):
+        return None
+    if record.get('requestHash') != body_hash:
+        raise IdempotencyConflict('このキーは別の注文内容で使われています。')
+    return record['orderId'], record['ticketNumber']
+
+def lookup(db, key, body_hash):
+    """トランザクションの外で、既に登録済みの注文を1回の読み取りで探す"""
+    doc = key_ref(db, key).get()
+    return _result(doc.to_dict() if doc.exists else None, body_hash)
+
+def read_in_transaction(transaction, ref, body_hash):
+    doc = ref.get(transaction=transaction)
+    return _result(doc.to_dict() if doc.exists else None, body_hash)
+
+def record_in_transaction(transaction, ref, body_hash, order_id, ticket_number):
+    transaction.set(ref, {
+        'orderId': order_id, 'ticketNumber': ticket_number, 'requestHash': body_hash,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'expiresAt': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+    })
+
+def purge_expired(db, log=print):
+    """期限切れのキーの記録を削除し、削除した件数を返す"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    deleted = 0
+    while True:
+        docs = list(db.collection(IDEMPOTENCY_COLLECTION).where('expiresAt', '<', now).limit(PURGE_BATCH_LIMIT).stream())
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(docs)
+    log(f"期限切れの注文キーを削除しました: {deleted}件")
+    return deleted
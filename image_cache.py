@@ -0,0 +1,186 @@
+"""
+メニュー・サイネージ画像の縮小版キャッシュ
+元画像(imageUrl / サイネージのurl)を1回だけ取得し、スマホ向けに縮小したWebP/JPEGを作ってディスクに保存する。
+縮小版のファイル名は元画像の内容のハッシュと幅から決まるため、同じ名前の内容が変わることはなく、
+ブラウザに長期間キャッシュさせることができる。
+Pillow は画像を作るときだけ読み込む。
+
+    IMAGE_CACHE_DIR/sources/<URLのハッシュ>.json   URL → 元画像の内容ハッシュ
+    IMAGE_CACHE_DIR/originals/<内容ハッシュ>        元画像
+    IMAGE_CACHE_DIR/variants/<内容ハッシュ>-<幅>.<webp|jpg>
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.request
+
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'image_cache')
+IMAGE_WIDTHS = (160, 320, 480, 640, 960, 1280, 1920)
+IMAGE_FORMATS = {'webp': 'webp', 'jpeg': 'jpg'}
+FETCH_TIMEOUT_SECONDS = 10
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+# 取得に失敗したURLは、この秒数の間は取得し直さない (表示のたびにタイムアウトを待たないため)
+FAILURE_RETRY_SECONDS = 300
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def snap_width(width):
+    """要求された幅を、用意している幅のうちそれ以上で最小のものに揃える"""
+    for candidate in IMAGE_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return IMAGE_WIDTHS[-1]
+
+def _url_key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, static_folder=None):
+        self.directory = directory
+        self.static_folder = static_folder
+        self.variant_dir = os.path.join(directory, 'variants')
+        self._sources = {}        # URL -> 元画像の内容ハッシュ
+        self._failures = {}       # URL -> 再取得してよい時刻
+        self._locks = {}
+        self._lock = threading.Lock()
+        for name in ('sources', 'originals', 'variants'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    # --- 元画像 ---
+    def _fetch(self, url):
+        """元画像を取得する。'/static/...' はアプリのstaticフォルダから読む"""
+        if url.startswith('/static/') and self.static_folder:
+            root = os.path.realpath(self.static_folder)
+            path = os.path.realpath(os.path.join(root, url[len('/static/'):]))
+            if not path.startswith(root + os.sep):
+                raise ValueError(f"Invalid image path: {url}")
+            with open(path, 'rb') as f:
+                return f.read()
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError(f"Unsupported image URL: {url}")
+        request = urllib.request.Request(url, headers={'User-Agent': 'sangisai-ordersystem image cache'})
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+            data = response.read(MAX_SOURCE_BYTES + 1)
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError(f"Image too large: {url}")
+        return data
+
+    def source_hash(self, url, refresh=False):
+        """URLの元画像の内容ハッシュを返す。まだ取得していなければ取得して保存する"""
+        if not refresh:
+            content_hash = self._sources.get(url) or self._load_source(url)
+            if content_hash:
+                return content_hash
+        with self._key_lock(('source', url)):
+            if not refresh and self._sources.get(url):
+                return self._sources[url]
+            if not refresh and self._failures.get(url, 0) > time.monotonic():
+                raise ValueError(f"Image fetch recently failed: {url}")
+            try:
+                data = self._fetch(url)
+            except Exception:
+                self._failures[url] = time.monotonic() + FAILURE_RETRY_SECONDS
+                raise
+            self._failures.pop(url, None)
+            content_hash = hashlib.sha256(data).hexdigest()[:20]
+            original_path = os.path.join(self.directory, 'originals', content_hash)
+            if not os.path.exists(original_path):
+                _write_atomic(original_path, data)
+            _write_atomic(os.path.join(self.directory, 'sources', f"{_url_key(url)}.json"),
+                          json.dumps({'url': url, 'hash': content_hash}).encode('utf-8'))
+            self._sources[url] = content_hash
+            return content_hash
+
+    def _load_source(self, url):
+        try:
+            with open(os.path.join(self.directory, 'sources', f"{_url_key(url)}.json"), 'r', encoding='utf-8') as f:
+                content_hash = json.load(f)['hash']
+        except (OSError, ValueError, KeyError):
+            return None
+        if not os.path.exists(os.path.join(self.directory, 'originals', content_hash)):
+            return None
+        self._sources[url] = content_hash
+        return content_hash
+
+    def cached_hash(self, url):
+        """取得済みの元画像の内容ハッシュを返す。まだ取得していなければNone (画像の取得はしない)"""
+        return self._sources.get(url) or self._load_source(url)
+
+    # --- 縮小版 ---
+    def cached_variant(self, url, width, fmt):
+        """縮小版が既にあればファイル名を、無ければNoneを返す (画像の取得・変換はしない)"""
+        content_hash = self.cached_hash(url)
+        if not content_hash:
+            return None
+        name = f"{content_hash}-{width}.{IMAGE_FORMATS[fmt]}"
+        return name if os.path.exists(os.path.join(self.variant_dir, name)) else None
+
+    def ensure_variant(self, url, width, fmt, refresh=False):
+        """縮小版を(無ければ作って)そのファイル名を返す"""
+        content_hash = self.source_hash(url, refresh=refresh)
+        name = f"{content_hash}-{width}.{IMAGE_FORMATS[fmt]}"
+        path = os.path.join(self.variant_dir, name)
+        if os.path.exists(path):
+            return name
+        with self._key_lock(('variant', name)):
+            if not os.path.exists(path):
+                with open(os.path.join(self.directory, 'originals', content_hash), 'rb') as f:
+                    _write_atomic(path, self._resize(f.read(), width, fmt))
+        return name
+
+    def _resize(self, data, width, fmt):
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            output = io.BytesIO()
+            if fmt == 'webp':
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                image.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                if 'A' in image.getbands():
+                    # JPEGは透過を持てないため白背景に合成する
+                    background = Image.new('RGB', image.size, (255, 255, 255))
+                    background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+                    image = background
+                image.convert('RGB').save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            return output.getvalue()
+
+    def prewarm(self, urls, widths, formats=tuple(IMAGE_FORMATS), on_done=None):
+        """バックグラウンドで元画像を取得し直し、縮小版を作っておく"""
+        def run():
+            done = failed = 0
+            for url in dict.fromkeys(url for url in urls if url):
+                try:
+                    self.source_hash(url, refresh=True)
+                    for width in widths:
+                        for fmt in formats:
+                            self.ensure_variant(url, width, fmt)
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"Error preparing image {url}: {e}")
+            print(f"画像キャッシュの準備が完了しました: {done}件 (失敗 {failed}件)")
+            if on_done:
+                on_done()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
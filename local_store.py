@@ -0,0 +1,617 @@
+"""
+ローカル保存用のストレージバックエンド (SQLite)
+app.py が使っている Firestore クライアントの機能 (collection / document / where / order_by /
+limit / start_after / batch / transaction / on_snapshot / get_all) を同じ呼び出し方で提供する。
+
+書き込みはまずローカルのSQLiteに保存され、同じSQLiteトランザクションで送信待ちキュー(outbox)にも
+記録される。OutboxSyncer がネットワークに繋がっている間にキューをまとめてFirestoreへ送るため、
+Wi-Fiが不安定でも注文の受付は止まらない。
+
+1台のサーバーがデータの正となる運用を前提としており、Firestore側への反映は後勝ちで上書きする。
+読み取りはメモリ上の写しから返すため、1つのSQLiteファイルを開けるのは1つのプロセスだけとする
+(<DBのパス>.lock を排他ロックし、他のプロセスが使用中なら LocalStoreLocked で起動を止める)。
+"""
+
+import copy
+import datetime
+import json
+import os
+import queue
+import random
+import sqlite3
+import string
+import threading
+import time
+from enum import Enum
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1 import transforms
+
+# Firestoreの1バッチあたりの書き込み上限
+SYNC_BATCH_SIZE = 500
+SYNC_INTERVAL_SECONDS = 2.0
+SYNC_MAX_BACKOFF_SECONDS = 60.0
+
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LocalStoreLocked(RuntimeError):
+    """ローカルDBを別のプロセスが使用中"""
+
+
+# --- プロセス間の排他 ---
+def _try_lock(lock_file):
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _acquire_lock(path, timeout):
+    """path をロックしたファイルを返す。timeout 秒待っても取れなければ LocalStoreLocked"""
+    lock_file = open(path, 'a+')
+    lock_file.seek(0)
+    deadline = time.monotonic() + timeout
+    while not _try_lock(lock_file):
+        if time.monotonic() >= deadline:
+            lock_file.close()
+            raise LocalStoreLocked(f"'{path}' is locked by another process. "
+                                   "Only one process can use the local database at a time (stop the server first).")
+        time.sleep(0.2)
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+# --- 値の変換 ---
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _json_hook(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+def _encode(data):
+    return json.dumps(data, default=_json_default, ensure_ascii=False)
+
+def _decode(text):
+    return json.loads(text, object_hook=_json_hook)
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _resolve(current, value):
+    """書き込む値に含まれる SERVER_TIMESTAMP / Increment などを実際の値に置き換える"""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        return result + [v for v in value.values if v not in result]
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (current if isinstance(current, list) else []) if v not in value.values]
+    if isinstance(value, dict):
+        resolved = {}
+        _merge_into(resolved, value)
+        return resolved
+    return copy.deepcopy(value)
+
+def _merge_into(target, updates):
+    """Firestoreの set(merge=True) と同じく、入れ子のマップを再帰的にマージする"""
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = _resolve(target.get(key), value)
+
+def _apply_update(target, updates):
+    """update() の 'a.b' 形式のフィールドパスを解釈して値を書き換える"""
+    for path, value in updates.items():
+        parts = path.split('.')
+        node = target
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is transforms.DELETE_FIELD:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = _resolve(node.get(parts[-1]), value)
+
+def _get_field(data, path):
+    node = data
+    for part in path.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+# --- ドキュメント ---
+class LocalDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_field(self._data or {}, field_path))
+
+
+class LocalDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.collection_name = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self.collection_name}/{self.id}"
+
+    def get(self, transaction=None, **kwargs):
+        return LocalDocumentSnapshot(self, self._client._read(self.collection_name, self.id))
+
+    def set(self, document_data, merge=False):
+        self._client._commit([('set', self, document_data, merge)])
+
+    def create(self, document_data):
+        self._client._commit([('create', self, document_data, False)])
+
+    def update(self, field_updates):
+        self._client._commit([('update', self, field_updates, False)])
+
+    def delete(self):
+        self._client._commit([('delete', self, None, False)])
+
+    def __eq__(self, other):
+        return isinstance(other, LocalDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+# --- クエリ ---
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a is not None and a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a is not None and a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+class LocalQuery:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, collection, filters=(), orders=(), limit_count=None, cursor=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_count
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        params = {'filters': self._filters, 'orders': self._orders, 'limit_count': self._limit, 'cursor': self._cursor}
+        params.update(changes)
+        return LocalQuery(self._client, self._collection, **params)
+
+    def where(self, field_path, op_string, value):
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Unsupported operator: {op_string}")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def start_after(self, document_snapshot):
+        return self._copy(cursor=document_snapshot)
+
+    def _sorted(self, rows):
+        # _scan はID順に返すため、安定ソートを重ねるとFirestoreと同じくIDが最後の並び順になる
+        rows = sorted(rows, key=lambda row: row[0])
+        for field, direction in reversed(self._orders):
+            rows.sort(key=lambda row: _get_field(row[1], field), reverse=(direction == self.DESCENDING))
+        return rows
+
+    def _run(self):
+        rows = []
+        for doc_id, data in self._client._scan(self._collection):
+            if not all(_OPERATORS[op](_get_field(data, field), value) for field, op, value in self._filters):
+                continue
+            # order_by の対象フィールドを持たないドキュメントはFirestoreと同じく結果から除く
+            if any(_get_field(data, field) is None for field, _ in self._orders):
+                continue
+            rows.append((doc_id, data))
+        rows = self._sorted(rows)
+        if self._cursor is not None:
+            # カーソルのドキュメントを並びに加えて位置を求め、それより後ろだけを返す
+            cursor_row = (self._cursor.id, self._cursor.to_dict() or {})
+            ordered = self._sorted([row for row in rows if row[0] != cursor_row[0]] + [cursor_row])
+            position = next(i for i, row in enumerate(ordered) if row[0] == cursor_row[0])
+            rows = ordered[position + 1:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return [LocalDocumentSnapshot(LocalDocumentReference(self._client, self._collection, doc_id), data)
+                for doc_id, data in rows]
+
+    def stream(self, transaction=None):
+        yield from self._run()
+
+    def get(self, transaction=None):
+        return self._run()
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = ''.join(random.choices(_AUTO_ID_CHARS, k=20))
+        return LocalDocumentReference(self._client, self._collection, document_id)
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return _now(), ref
+
+    def list_documents(self, page_size=None):
+        return [LocalDocumentReference(self._client, self._collection, doc_id)
+                for doc_id, _ in self._client._scan(self._collection)]
+
+
+# --- バッチ / トランザクション ---
+class LocalWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(('set', reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._ops.append(('create', reference, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._ops.append(('update', reference, field_updates, False))
+
+    def delete(self, reference):
+        self._ops.append(('delete', reference, None, False))
+
+    def commit(self):
+        self._client._commit(self._ops)
+        self._ops = []
+
+
+class LocalTransaction(LocalWriteBatch):
+    """ローカルでは関数の実行中ずっと書き込みロックを持つため、再試行は不要"""
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, LocalDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+    def get_all(self, references):
+        return self._client.get_all(references)
+
+    def run(self, fn, *args, **kwargs):
+        with self._client._lock:
+            result = fn(self, *args, **kwargs)
+            self.commit()
+            return result
+
+
+# --- 変更の監視 (on_snapshot) ---
+class ChangeType(Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class LocalDocumentChange:
+    def __init__(self, change_type, document, old_index, new_index):
+        self.type = change_type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+class LocalWatch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self.query = query
+        self.callback = callback
+        self.is_active = True
+        self._previous = {}
+        self._delivered = False
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._unwatch(self)
+
+    def _refresh(self):
+        docs = self.query.get()
+        current = {doc.id: (index, doc) for index, doc in enumerate(docs)}
+        changes = []
+        for doc_id, (old_index, old_doc) in self._previous.items():
+            if doc_id not in current:
+                changes.append(LocalDocumentChange(ChangeType.REMOVED, old_doc, old_index, -1))
+        for doc_id, (new_index, doc) in current.items():
+            previous = self._previous.get(doc_id)
+            if previous is None:
+                changes.append(LocalDocumentChange(ChangeType.ADDED, doc, -1, new_index))
+            elif previous[1].to_dict() != doc.to_dict():
+                changes.append(LocalDocumentChange(ChangeType.MODIFIED, doc, previous[0], new_index))
+        self._previous = current
+        if changes or not self._delivered:
+            self._delivered = True
+            self.callback(docs, changes, _now())
+
+
+# --- クライアント本体 ---
+class LocalClient:
+    """
+    SQLiteに保存し、読み取りはメモリ上の写しから返すFirestore互換クライアント。
+    他のプロセスの書き込みは写しに反映されないため、開いている間はDBファイルを排他ロックする。
+    lock_timeout 秒の間は、前のプロセスが終了してロックを手放すのを待つ (gunicornの再読み込み時など)
+    """
+    def __init__(self, path, lock_timeout=0):
+        self.path = path
+        self._lock = threading.RLock()
+        self._lock_file = _acquire_lock(f"{path}.lock", lock_timeout)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS documents (collection TEXT NOT NULL, id TEXT NOT NULL, '
+                           'data TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (collection, id))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'collection TEXT NOT NULL, id TEXT NOT NULL, op TEXT NOT NULL, data TEXT, queued_at REAL NOT NULL)')
+        self._docs = {}
+        for collection, doc_id, data in self._conn.execute('SELECT collection, id, data FROM documents'):
+            self._docs.setdefault(collection, {})[doc_id] = _decode(data)
+        self._watches = []
+        self._watch_queue = queue.Queue()
+        self._watch_thread = None
+        self.outbox_event = threading.Event()
+
+    def close(self):
+        """DBを閉じてロックを手放す (同じファイルを別のプロセスで開く前に呼ぶ)"""
+        with self._lock:
+            self._conn.close()
+            self._lock_file.close()
+
+    # --- Firestoreクライアントと同じ入口 ---
+    def collection(self, name):
+        return LocalCollectionReference(self, name)
+
+    def document(self, path):
+        collection, doc_id = path.split('/', 1)
+        return LocalDocumentReference(self, collection, doc_id)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return LocalTransaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for ref in references:
+            yield ref.get()
+
+    def collections(self):
+        with self._lock:
+            return [LocalCollectionReference(self, name) for name, docs in sorted(self._docs.items()) if docs]
+
+    # --- 読み取り ---
+    def _read(self, collection, doc_id):
+        with self._lock:
+            data = self._docs.get(collection, {}).get(doc_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _scan(self, collection):
+        with self._lock:
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in sorted(self._docs.get(collection, {}).items())]
+
+    # --- 書き込み ---
+    def _commit(self, operations, enqueue=True):
+        """複数の書き込みを1つのSQLiteトランザクションで反映し、送信待ちキューにも積む"""
+        if not operations:
+            return
+        with self._lock:
+            staged = {}
+            for op, ref, data, merge in operations:
+                key = (ref.collection_name, ref.id)
+                current = staged[key] if key in staged else self._docs.get(ref.collection_name, {}).get(ref.id)
+                if op == 'create' and current is not None:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                if op == 'update' and current is None:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if op == 'delete':
+                    staged[key] = None
+                elif op == 'update':
+                    new_data = copy.deepcopy(current)
+                    _apply_update(new_data, data)
+                    staged[key] = new_data
+                else:
+                    new_data = copy.deepcopy(current) if (merge and current is not None) else {}
+                    _merge_into(new_data, data)
+                    staged[key] = new_data
+
+            now = time.time()
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                for (collection, doc_id), new_data in staged.items():
+                    if new_data is None:
+                        cur.execute('DELETE FROM documents WHERE collection = ? AND id = ?', (collection, doc_id))
+                    else:
+                        cur.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)', (collection, doc_id, _encode(new_data), now))
+                    if enqueue:
+                        cur.execute('INSERT INTO outbox (collection, id, op, data, queued_at) VALUES (?, ?, ?, ?, ?)',
+                                    (collection, doc_id, 'delete' if new_data is None else 'set',
+                                     None if new_data is None else _encode(new_data), now))
+                cur.execute('COMMIT')
+            except Exception:
+                cur.execute('ROLLBACK')
+                raise
+            for (collection, doc_id), new_data in staged.items():
+                if new_data is None:
+                    self._docs.get(collection, {}).pop(doc_id, None)
+                else:
+                    self._docs.setdefault(collection, {})[doc_id] = new_data
+        if enqueue:
+            self.outbox_event.set()
+        for collection in {collection for collection, _ in staged}:
+            self._watch_queue.put(collection)
+
+    def import_documents(self, collection, documents):
+        """Firestoreから取り込んだドキュメントを、送信待ちキューに積まずに保存する"""
+        self._commit([('set', LocalDocumentReference(self, collection, doc_id), data, False)
+                      for doc_id, data in documents], enqueue=False)
+
+    def is_empty(self):
+        with self._lock:
+            return not any(self._docs.values())
+
+    # --- on_snapshot ---
+    def _watch(self, query, callback):
+        watch = LocalWatch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+            if self._watch_thread is None:
+                self._watch_thread = threading.Thread(target=self._dispatch_watches, daemon=True)
+                self._watch_thread.start()
+        self._watch_queue.put(watch)
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _dispatch_watches(self):
+        """書き込みのあったコレクションを監視しているクエリを評価し直し、差分をコールバックに渡す"""
+        while True:
+            item = self._watch_queue.get()
+            with self._lock:
+                if isinstance(item, LocalWatch):
+                    targets = [item] if item.is_active else []
+                else:
+                    targets = [w for w in self._watches if w.query._collection == item]
+            for watch in targets:
+                try:
+                    watch._refresh()
+                except Exception as e:
+                    print(f"Error in local snapshot listener: {e}")
+
+    # --- 送信待ちキュー ---
+    def pending_outbox(self, limit):
+        with self._lock:
+            return self._conn.execute('SELECT seq, collection, id, op, data FROM outbox ORDER BY seq LIMIT ?', (limit,)).fetchall()
+
+    def ack_outbox(self, max_seq):
+        with self._lock:
+            self._conn.execute('DELETE FROM outbox WHERE seq <= ?', (max_seq,))
+
+    def outbox_size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+
+class OutboxSyncer:
+    """送信待ちキューをバッチにまとめてFirestoreへ送るバックグラウンド処理"""
+    def __init__(self, local, remote, interval=SYNC_INTERVAL_SECONDS):
+        self.local = local
+        self.remote = remote
+        self.interval = interval
+        self.last_synced_at = None
+        self.last_error = None
+        self.synced_writes = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def sync_once(self):
+        """キューの先頭から最大500件を送信し、送信した件数を返す"""
+        rows = self.local.pending_outbox(SYNC_BATCH_SIZE)
+        if not rows:
+            return 0
+        # 同じドキュメントへの書き込みが続いている場合は最後の状態だけを送る
+        latest = {}
+        for seq, collection, doc_id, op, data in rows:
+            latest[(collection, doc_id)] = (op, data)
+        batch = self.remote.batch()
+        for (collection, doc_id), (op, data) in latest.items():
+            ref = self.remote.collection(collection).document(doc_id)
+            if op == 'delete':
+                batch.delete(ref)
+            else:
+                batch.set(ref, _decode(data))
+        batch.commit()
+        self.local.ack_outbox(rows[-1][0])
+        self.synced_writes += len(latest)
+        self.last_synced_at = time.time()
+        self.last_error = None
+        return len(rows)
+
+    def _run(self):
+        backoff = self.interval
+        while True:
+            try:
+                if self.sync_once() == SYNC_BATCH_SIZE:
+                    continue
+                backoff = self.interval
+                self.local.outbox_event.wait(self.interval)
+                self.local.outbox_event.clear()
+            except Exception as e:
+                # 通信できない間はキューに溜めたまま、間隔を空けて再試行する
+                self.last_error = str(e)
+                print(f"Firestore sync failed (pending {self.local.outbox_size()}): {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, SYNC_MAX_BACKOFF_SECONDS)
+
+    def status(self):
+        return {
+            'pending': self.local.outbox_size(), 'syncedWrites': self.synced_writes,
+            'lastSyncedAt': self.last_synced_at, 'lastError': self.last_error
+        }
@@ -0,0 +1,143 @@
+"""
+メニューCSVの取り込み処理
+管理画面のCSVアップロード (app.py) と import_csv.py の両方から使う共通の取り込みエンジン
+pandas は読み込みに時間がかかるため、CSVを取り込むときだけ読み込む。
+"""
+
+import time
+
+from stock import stock_shards
+
+# Firestoreの1バッチあたりの書き込み上限
+FIRESTORE_BATCH_LIMIT = 500
+
+REQUIRED_COLUMNS = ['ItemID', 'Name', 'Price', 'Category']
+OPTIONAL_COLUMNS = ['ImageURL', 'Description', 'Status', 'Allergens', 'IsSet', 'SetCount', 'SetItems', 'Stock']
+
+def _split_list(value):
+    """'A, B,C' のようなカンマ区切り文字列をリストに変換する"""
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+def parse_menu_csv(csv_file):
+    """メニューCSV(パスまたはファイルオブジェクト)を読み込み、{ItemID: 商品データ} を返す"""
+    import pandas as pd
+
+    df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    df.columns = df.columns.str.strip()
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"CSVに必要な列がありません: {', '.join(missing)}")
+    for col in OPTIONAL_COLUMNS:
+        if col not in df.columns:
+            df[col] = ''
+    df = df.apply(lambda col: col.str.strip())
+    df = df[df['ItemID'] != '']
+
+    # --- 列単位でまとめて変換する ---
+    prices = pd.to_numeric(df['Price'], errors='coerce')
+    if prices.isna().any():
+        bad_ids = df.loc[prices.isna(), 'ItemID'].tolist()
+        raise ValueError(f"価格を数値に変換できない行があります: {', '.join(bad_ids)}")
+    is_set = df['IsSet'].str.lower().isin(['true', '1', 'yes'])
+    set_counts = pd.to_numeric(df['SetCount'], errors='coerce').fillna(0).where(is_set, 0)
+    # Stock列が空の商品は在庫を管理しない
+    stocks = pd.to_numeric(df['Stock'], errors='coerce')
+    bad_stock = (df['Stock'] != '') & (stocks.isna() | (stocks < 0))
+    if bad_stock.any():
+        raise ValueError(f"在庫数を0以上の数値に変換できない行があります: {', '.join(df.loc[bad_stock, 'ItemID'].tolist())}")
+    stocks = stocks.astype(object).where(stocks.notna(), None)
+    allergens = df['Allergens'].map(_split_list)
+    set_items = df['SetItems'].map(_split_list)
+
+    items = {}
+    for item_id, name, price, category, image_url, description, status, allergen_list, item_is_set, set_count, set_item_list, stock in zip(
+            df['ItemID'].tolist(), df['Name'].tolist(), prices.astype(int).tolist(), df['Category'].tolist(),
+            df['ImageURL'].tolist(), df['Description'].tolist(), df['Status'].tolist(), allergens.tolist(),
+            is_set.tolist(), set_counts.astype(int).tolist(), set_items.tolist(), stocks.tolist()):
+        stock = None if stock is None else int(stock)
+        items[item_id] = {
+            'name': name, 'price': price, 'category': category,
+            'imageUrl': image_url,
+            'description': description,
+            'isSoldOut': status == '売り切れ' or stock == 0,
+            'allergens': allergen_list,
+            'isSet': item_is_set,
+            'setCount': set_count,
+            'setItems': set_item_list if item_is_set else [],
+            'trackStock': stock is not None,
+            'stock': stock
+        }
+    return items
+
+def sync_menu_items(db, new_items, prune=True, log=print):
+    """
+    現在のitemsコレクションと比較し、差分だけをバッチで書き込む。
+    prune=True の場合、CSVに無い商品も同じバッチで削除する。
+    在庫数(stock)が指定された商品は、在庫のシャードをその数で置き換える (内容が変わるシャードだけを書き込む)。
+    削除した商品や在庫を管理しなくなった商品のシャードは削除する。
+
+    書き込みが500件以内なら1つのバッチで不可分に反映される。超える場合は複数のバッチに分かれて順に反映されるため、
+    途中のバッチで失敗すると一部だけが反映される。その場合も、どの時点で止まっても在庫を管理する商品にシャードが
+    無い状態にならないよう、シャードの書き込み → 商品の追加・更新 → 商品の削除 → 不要なシャードの削除 の順に書き込む。
+    同じCSVを取り込み直せば、残りの差分だけが書き込まれて揃う。
+    """
+    started = time.perf_counter()
+    items_ref = db.collection('items')
+    current_items = {doc.id: doc.to_dict() for doc in items_ref.stream()}
+    current_shards = {doc.id: doc.to_dict() for doc in db.collection('stock').stream()}
+
+    shard_writes, item_writes, item_deletes = [], [], []
+    wanted_shards = set()
+    added = updated = stocked = 0
+    for item_id, item_data in new_items.items():
+        item_data = dict(item_data)
+        stock = item_data.pop('stock', None)
+        if stock is not None:
+            stocked += 1
+            for ref, data in stock_shards(db, item_id, stock):
+                wanted_shards.add(ref.id)
+                if current_shards.get(ref.id) != data:
+                    shard_writes.append(('set', ref, data))
+        current = current_items.get(item_id)
+        if current == item_data:
+            continue
+        if current is None:
+            added += 1
+        else:
+            updated += 1
+        item_writes.append(('set', items_ref.document(item_id), item_data))
+    if prune:
+        item_deletes = [('delete', items_ref.document(item_id), None) for item_id in current_items if item_id not in new_items]
+    # 取り込んだ商品のうち在庫数が無い (在庫を管理しない) 商品と、削除する商品のシャードは不要になる
+    kept_items = set() if prune else set(current_items) - set(new_items)
+    shard_deletes = [('delete', db.collection('stock').document(shard_id), None)
+                     for shard_id, data in current_shards.items()
+                     if shard_id not in wanted_shards and data.get('itemId') not in kept_items]
+    operations = shard_writes + item_writes + item_deletes + shard_deletes
+
+    batches = 0
+    for start in range(0, len(operations), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for op, ref, data in operations[start:start + FIRESTORE_BATCH_LIMIT]:
+            if op == 'set':
+                batch.set(ref, data)
+            else:
+                batch.delete(ref)
+        batch.commit()
+        batches += 1
+
+    summary = {
+        'added': added, 'updated': updated,
+        'unchanged': len(new_items) - added - updated,
+        'deleted': len(item_deletes),
+        'stocked': stocked,
+        'stockShardsWritten': len(shard_writes),
+        'stockShardsDeleted': len(shard_deletes),
+        'batches': batches,
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+    log(f"メニュー取り込み完了: 追加 {summary['added']}件 / 更新 {summary['updated']}件 / "
+        f"変更なし {summary['unchanged']}件 / 削除 {summary['deleted']}件 / 在庫設定 {summary['stocked']}件 "
+        f"(シャード 書き込み {summary['stockShardsWritten']}件 / 削除 {summary['stockShardsDeleted']}件) "
+        f"({summary['batches']}バッチ, {summary['elapsedMs']}ms)")
+    return summary
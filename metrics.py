@@ -0,0 +1,296 @@
+"""
+リクエストごとの性能計測
+ルートごとのレイテンシ・エラー数と、1リクエストの中で行われたFirestore呼び出しの回数・時間、
+ログイン確認や権限チェックなどの処理段階(phase)ごとの時間を記録する。
+結果は Prometheus形式 (/metrics) と、管理画面向けのJSONで公開する。
+計測値はプロセス(gunicornのワーカー)ごとに持つ。/metrics はリクエストを受けたワーカーの値だけを返すため、
+全ての系列に worker ラベル (プロセスID) を付ける。合計は Prometheus 側で sum without (worker) で求める。
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+from flask import request
+
+# この時間(ミリ秒)を超えたリクエストをログに出す。0なら出さない
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# パーセンタイル計算用に保持する、ルートごとの直近のレイテンシ数
+RECENT_SAMPLES = 1000
+BACKGROUND_ROUTE = '(background)'
+
+# 計測対象のFirestore呼び出し { クラス: (ラベル, メソッド名) }
+FIRESTORE_METHODS = {
+    'document': ('get', 'set', 'update', 'delete', 'create'),
+    'query': ('get', 'stream'),
+    'collection': ('get', 'stream', 'add', 'list_documents'),
+    'batch': ('commit',),
+    'transaction': ('get', 'get_all', '_commit'),
+    'client': ('get_all',),
+}
+# 結果を順に読み出すメソッド。時間は読み出し終わるまでを数える
+ITERATOR_METHODS = ('stream', 'get_all')
+
+_local = threading.local()
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + '}'
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = defaultdict(int)
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        self.firestore_calls = 0
+        self.firestore_seconds = 0.0
+
+    def observe(self, seconds, status, firestore_calls, firestore_seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.statuses[status] += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+        self.recent.append(seconds)
+        self.firestore_calls += firestore_calls
+        self.firestore_seconds += firestore_seconds
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = defaultdict(RouteStats)                # (method, route) -> RouteStats
+        self.firestore = defaultdict(lambda: [0, 0.0])       # (route, operation) -> [回数, 秒]
+        self.phases = defaultdict(lambda: [0, 0.0])          # (route, phase) -> [回数, 秒]
+        self.started_at = time.time()
+
+    # --- 記録 ---
+    def start_request(self, route):
+        _local.request = {'route': route, 'started': time.perf_counter(),
+                          'firestoreCalls': 0, 'firestoreSeconds': 0.0, 'phases': defaultdict(float)}
+
+    def set_status(self, status):
+        """リクエストの応答のステータスを記録しておく (finish_request で使う)"""
+        context = getattr(_local, 'request', None)
+        if context is not None:
+            context['status'] = status
+
+    def finish_request(self, method, path, status=None):
+        """リクエストの計測を終える。status を省略すると set_status で記録したもの (無ければ500) を使う"""
+        context = getattr(_local, 'request', None)
+        if context is None:
+            return
+        _local.request = None
+        if status is None:
+            status = context.get('status', 500)
+        seconds = time.perf_counter() - context['started']
+        with self._lock:
+            self.routes[(method, context['route'])].observe(seconds, status, context['firestoreCalls'], context['firestoreSeconds'])
+        if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+            phases = ', '.join(f"{name} {phase_seconds * 1000:.1f}ms" for name, phase_seconds in context['phases'].items())
+            print(f"SLOW REQUEST: {method} {path} -> {status} {seconds * 1000:.1f}ms "
+                  f"(Firestore {context['firestoreCalls']}回 / {context['firestoreSeconds'] * 1000:.1f}ms"
+                  f"{', ' + phases if phases else ''})")
+
+    def record_firestore(self, operation, seconds):
+        context = getattr(_local, 'request', None)
+        if context is not None:
+            context['firestoreCalls'] += 1
+            context['firestoreSeconds'] += seconds
+        with self._lock:
+            entry = self.firestore[(context['route'] if context else BACKGROUND_ROUTE, operation)]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def record_phase(self, phase, seconds):
+        context = getattr(_local, 'request', None)
+        if context is not None:
+            context['phases'][phase] += seconds
+        with self._lock:
+            entry = self.phases[(context['route'] if context else BACKGROUND_ROUTE, phase)]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def timed(self, phase):
+        """関数の実行時間を処理段階(phase)として記録するデコレータ"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record_phase(phase, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    # --- 出力 ---
+    def summary(self):
+        """管理画面向けのルートごとの集計"""
+        with self._lock:
+            routes = []
+            for (method, route), stats in sorted(self.routes.items(), key=lambda entry: -entry[1].total_seconds):
+                recent = sorted(stats.recent)
+                phases = {phase: round(seconds / stats.count * 1000, 3)
+                          for (phase_route, phase), (_, seconds) in self.phases.items() if phase_route == route}
+                routes.append({
+                    'method': method, 'route': route, 'count': stats.count,
+                    'errors': sum(count for status, count in stats.statuses.items() if status >= 500),
+                    'clientErrors': sum(count for status, count in stats.statuses.items() if 400 <= status < 500),
+                    'meanMs': round(stats.total_seconds / stats.count * 1000, 3),
+                    'p50Ms': round(_percentile(recent, 50) * 1000, 3),
+                    'p95Ms': round(_percentile(recent, 95) * 1000, 3),
+                    'p99Ms': round(_percentile(recent, 99) * 1000, 3),
+                    'maxMs': round(stats.max_seconds * 1000, 3),
+                    'firestoreCallsPerRequest': round(stats.firestore_calls / stats.count, 2),
+                    'firestoreMsPerRequest': round(stats.firestore_seconds / stats.count * 1000, 3),
+                    'phasesMsPerRequest': phases,
+                })
+            firestore = [{'route': route, 'operation': operation, 'count': count, 'totalMs': round(seconds * 1000, 3)}
+                         for (route, operation), (count, seconds) in sorted(self.firestore.items())]
+        return {'uptimeSeconds': round(time.time() - self.started_at), 'slowRequestMs': SLOW_REQUEST_MS,
+                'routes': routes, 'firestore': firestore}
+
+    def render_prometheus(self, gauges=()):
+        """Prometheusのテキスト形式で出力する。gauges は (名前, 説明, 値) の並び"""
+        lines = []
+        worker = os.getpid()
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            routes = sorted(self.routes.items())
+            header('http_requests_total', 'counter', 'Number of HTTP requests by route and status.')
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f"http_requests_total{_labels(worker=worker, method=method, route=route, status=status)} {count}")
+            header('http_request_duration_seconds', 'histogram', 'HTTP request latency by route.')
+            for (method, route), stats in routes:
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    lines.append(f"http_request_duration_seconds_bucket{_labels(worker=worker, method=method, route=route, le=bound)} {count}")
+                lines.append(f"http_request_duration_seconds_bucket{_labels(worker=worker, method=method, route=route, le='+Inf')} {stats.count}")
+                lines.append(f"http_request_duration_seconds_sum{_labels(worker=worker, method=method, route=route)} {stats.total_seconds:.6f}")
+                lines.append(f"http_request_duration_seconds_count{_labels(worker=worker, method=method, route=route)} {stats.count}")
+            header('firestore_calls_total', 'counter', 'Number of Firestore calls by route and operation.')
+            for (route, operation), (count, _) in sorted(self.firestore.items()):
+                lines.append(f"firestore_calls_total{_labels(worker=worker, route=route, operation=operation)} {count}")
+            header('firestore_call_duration_seconds_total', 'counter', 'Time spent in Firestore calls by route and operation.')
+            for (route, operation), (_, seconds) in sorted(self.firestore.items()):
+                lines.append(f"firestore_call_duration_seconds_total{_labels(worker=worker, route=route, operation=operation)} {seconds:.6f}")
+            header('request_phase_duration_seconds_total', 'counter', 'Time spent in request phases such as load_user.')
+            for (route, phase), (_, seconds) in sorted(self.phases.items()):
+                lines.append(f"request_phase_duration_seconds_total{_labels(worker=worker, route=route, phase=phase)} {seconds:.6f}")
+        for name, help_text, value in gauges:
+            header(name, 'gauge', help_text)
+            lines.append(f"{name}{_labels(worker=worker)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+# --- Firestore呼び出しの計測 ---
+# 計測中の呼び出しの中から呼ばれた呼び出し (例: get() の内部の stream()) は二重に数えない
+def _enter():
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    return depth == 0
+
+def _exit():
+    _local.depth -= 1
+
+def _timed_iterator(operation, iterator):
+    elapsed = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            _enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _exit()
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        metrics.record_firestore(operation, elapsed)
+
+def _instrument(cls, method_name, operation):
+    original = cls.__dict__.get(method_name)
+    if original is None or getattr(original, '_metrics_operation', None):
+        return
+    @wraps(original)
+    def wrapper(*args, **kwargs):
+        if not _enter():
+            try:
+                return original(*args, **kwargs)
+            finally:
+                _exit()
+        started = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        except Exception:
+            _exit()
+            metrics.record_firestore(operation, time.perf_counter() - started)
+            raise
+        _exit()
+        if method_name in ITERATOR_METHODS and not isinstance(result, (list, tuple)):
+            return _timed_iterator(operation, iter(result))
+        metrics.record_firestore(operation, time.perf_counter() - started)
+        return result
+    wrapper._metrics_operation = operation
+    setattr(cls, method_name, wrapper)
+
+def instrument_firestore():
+    """Firestoreクライアントとローカルストレージのクラスに計測を組み込む (何度呼んでもよい)"""
+    from google.cloud.firestore_v1 import batch, client, collection, document, query, transaction
+    import local_store
+    classes = {
+        'document': [document.DocumentReference, local_store.LocalDocumentReference],
+        'query': [query.Query, local_store.LocalQuery],
+        'collection': [collection.CollectionReference, local_store.LocalCollectionReference],
+        'batch': [batch.WriteBatch, local_store.LocalWriteBatch],
+        'transaction': [transaction.Transaction, local_store.LocalTransaction],
+        'client': [client.Client, local_store.LocalClient],
+    }
+    for label, method_names in FIRESTORE_METHODS.items():
+        for cls in classes[label]:
+            for method_name in method_names:
+                _instrument(cls, method_name, f"{label}.{method_name.lstrip('_')}")
+
+def init_app(app):
+    """Flaskアプリにリクエスト計測を組み込む"""
+    @app.before_request
+    def _start_request_metrics():
+        metrics.start_request(request.url_rule.rule if request.url_rule else '(unmatched)')
+
+    @app.after_request
+    def _record_response_status(response):
+        metrics.set_status(response.status_code)
+        return response
+
+    # 処理されなかった例外で after_request が呼ばれない場合も数えるため、計測は teardown_request で終える
+    @app.teardown_request
+    def _finish_request_metrics(exc):
+        metrics.finish_request(request.method, request.path, 500 if exc is not None else None)
@@ -0,0 +1,106 @@
+"""
+受け渡し・会計が済んだ注文の日別アーカイブ
+orders には調理中〜受け渡し待ちの注文だけを残し、完了かつ会計済の注文は
+注文日(日本時間)ごとの orders_archive_YYYYMMDD コレクションへ移す。
+どの日のアーカイブがあるかは order_archives/<YYYYMMDD> に記録する。
+"""
+
+import datetime
+import heapq
+
+from firebase_admin import firestore
+
+ARCHIVE_PREFIX = 'orders_archive_'
+ARCHIVE_INDEX = 'order_archives'
+# 1注文あたり 注文の追加・削除・整理券の更新 の3件を書くため、1バッチ(500件)に収まる件数にする
+ARCHIVE_BATCH_ORDERS = 150
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+def is_finished(order_data):
+    return order_data.get('status') == '完了' and order_data.get('paymentStatus') == '会計済'
+
+def archive_day(order_data):
+    """注文日(日本時間)を 'YYYYMMDD' で返す"""
+    created_at = order_data.get('createdAt')
+    if not isinstance(created_at, datetime.datetime):
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+    return created_at.astimezone(JST).strftime('%Y%m%d')
+
+def archive_collection_name(day):
+    return f"{ARCHIVE_PREFIX}{day}"
+
+def archive_collection_names(db):
+    """アーカイブのコレクション名を日付順に返す"""
+    return [archive_collection_name(doc.id) for doc in sorted(db.collection(ARCHIVE_INDEX).stream(), key=lambda doc: doc.id)]
+
+def _archive_writes(writer, db, order_ref, order_data, ticket_doc, counts):
+    day = archive_day(order_data)
+    collection_name = archive_collection_name(day)
+    writer.set(db.collection(collection_name).document(order_ref.id), dict(order_data, archivedAt=firestore.SERVER_TIMESTAMP))
+    writer.delete(order_ref)
+    # 整理券番号から引けるよう、索引にアーカイブ先を残す (番号が別の注文に再割り当て済みなら触らない)
+    if ticket_doc is not None and ticket_doc.exists and ticket_doc.to_dict().get('orderId') == order_ref.id:
+        writer.update(ticket_doc.reference, {'released': True, 'archive': collection_name})
+    counts[day] = counts.get(day, 0) + 1
+
+def _index_writes(writer, db, counts):
+    for day, count in counts.items():
+        writer.set(db.collection(ARCHIVE_INDEX).document(day), {
+            'collection': archive_collection_name(day), 'count': firestore.Increment(count),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+def archive_in_transaction(transaction, db, order_ref, order_data, ticket_doc):
+    """トランザクション内で1件の注文をアーカイブへ移す (読み取りは呼び出し側で済ませておく)"""
+    counts = {}
+    _archive_writes(transaction, db, order_ref, order_data, ticket_doc, counts)
+    _index_writes(transaction, db, counts)
+    return archive_collection_name(archive_day(order_data))
+
+def archive_orders_in_transaction(transaction, db, orders):
+    """トランザクション内で複数の注文 [(参照, 内容, 整理券ドキュメント)] をアーカイブへ移す"""
+    counts = {}
+    for order_ref, order_data, ticket_doc in orders:
+        _archive_writes(transaction, db, order_ref, order_data, ticket_doc, counts)
+    _index_writes(transaction, db, counts)
+
+def archive_finished_orders(db, log=print):
+    """orders に残っている完了・会計済の注文をまとめてアーカイブへ移す。移した件数を返す"""
+    finished = [doc for doc in db.collection('orders').where('status', '==', '完了').stream() if is_finished(doc.to_dict())]
+    for start in range(0, len(finished), ARCHIVE_BATCH_ORDERS):
+        chunk = finished[start:start + ARCHIVE_BATCH_ORDERS]
+        ticket_refs = {doc.id: db.collection('tickets').document(doc.to_dict()['ticketNumber'])
+                       for doc in chunk if doc.to_dict().get('ticketNumber')}
+        tickets = {ticket.reference.path: ticket for ticket in db.get_all(list(ticket_refs.values()))} if ticket_refs else {}
+        batch = db.batch()
+        counts = {}
+        for doc in chunk:
+            ticket_ref = ticket_refs.get(doc.id)
+            _archive_writes(batch, db, doc.reference, doc.to_dict(), tickets.get(ticket_ref.path) if ticket_ref else None, counts)
+        _index_writes(batch, db, counts)
+        batch.commit()
+    log(f"注文をアーカイブしました: {len(finished)}件")
+    return len(finished)
+
+def find_archived_order(db, order_id, collection_name=None):
+    """アーカイブから注文を探す。collection_name が分からなければ全ての日を1回の get_all で探す"""
+    names = [collection_name] if collection_name else archive_collection_names(db)
+    if not names:
+        return None
+    for doc in db.get_all([db.collection(name).document(order_id) for name in names]):
+        if doc.exists:
+            return doc
+    return None
+
+def merge_by_created_at(*doc_iterators):
+    """createdAt順に並んだ複数のドキュメント列を、createdAt順の1つの列にまとめる"""
+    def created_at(doc):
+        value = doc.to_dict().get('createdAt')
+        return value.timestamp() if isinstance(value, datetime.datetime) else 0
+    return heapq.merge(*doc_iterators, key=created_at)
+
+def iter_all_orders(db):
+    """orders とすべてのアーカイブの注文を順に返す"""
+    yield from db.collection('orders').stream()
+    for name in archive_collection_names(db):
+        yield from db.collection(name).stream()
@@ -0,0 +1,293 @@
+"""
+注文ステータスの変更フィード
+ステータス(調理中 / 提供可能)ごとにFirestoreのon_snapshot監視を1つだけ持ち、
+その差分を Server-Sent Events で任意の数の画面へ配信する。
+調理中のフィードからは、持ち場(メニューのカテゴリ)ごとの「作る商品の合計個数」も集計して配信する。
+"""
+
+import datetime
+import json
+import threading
+import uuid
+from collections import deque
+
+from order_lines import item_units
+
+# 再接続時に Last-Event-ID から再送できるイベント数。これを超えて遅れた接続には全件を送り直す
+FEED_BUFFER_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+RECONNECT_MILLISECONDS = 3000
+
+# プロセスが再起動するとイベント番号が振り直されるため、IDにプロセス固有の値を含めて区別する
+_FEED_EPOCH = uuid.uuid4().hex[:8]
+
+def to_jsonable(value):
+    """Firestoreのドキュメント内容をJSONに変換できる形にする (日時はISO形式の文字列へ)"""
+    if isinstance(value, dict):
+        return {key: to_jsonable(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def serialize_order(doc):
+    data = doc.to_dict()
+    order = to_jsonable(data)
+    created_at = data.get('createdAt')
+    order['createdAtMs'] = int(created_at.timestamp() * 1000) if isinstance(created_at, datetime.datetime) else 0
+    ready_at = data.get('readyAt')
+    if isinstance(ready_at, datetime.datetime):
+        order['readyAtMs'] = int(ready_at.timestamp() * 1000)
+    return order
+
+
+class EventChannel:
+    """連番付きイベントのリングバッファ。購読者はそれぞれカーソル(最後に受け取った番号)を持って追いかける"""
+    def __init__(self, maxlen=FEED_BUFFER_SIZE):
+        self._events = deque(maxlen=maxlen)
+        self._last_id = 0
+        self._cond = threading.Condition()
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def publish(self, payload):
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, payload))
+            self._cond.notify_all()
+            return self._last_id
+
+    def events_after(self, cursor):
+        """cursor より後のイベントを返す。既にバッファから押し出されている場合はNone"""
+        with self._cond:
+            if cursor > self._last_id:
+                return None
+            if cursor == self._last_id:
+                return []
+            if not self._events or self._events[0][0] > cursor + 1:
+                return None
+            return [event for event in self._events if event[0] > cursor]
+
+    def reset(self):
+        """バッファを捨てる。購読中の画面は続きを受け取れなくなり、全件 (reset) を受け取り直す"""
+        with self._cond:
+            self._events.clear()
+            self._last_id += 1
+            self._cond.notify_all()
+
+    def wait(self, cursor, timeout):
+        """cursor より新しいイベントが来るまで待つ。タイムアウトした場合はFalse"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._last_id > cursor, timeout)
+
+
+class OrderStatusFeed:
+    """1つのステータスに属する注文の一覧を監視し、差分をEventChannelへ流す"""
+    def __init__(self, db, status):
+        self.db = db
+        self.status = status
+        self.channel = EventChannel()
+        self.orders = {}
+        self._stale_orders = None # 監視を張り直したときの前の一覧。次のスナップショットで差分を取ってから捨てる
+        self._watch = None
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """差分 (画面へ送るものと同じ changes のリスト) を受け取るコールバックを登録する"""
+        self._listeners.append(callback)
+
+    def is_ready(self):
+        """監視が動いていて、初回のスナップショットが届いているか (監視は開始しない)"""
+        with self._lock:
+            return self._ready.is_set() and self._watch is not None and getattr(self._watch, 'is_active', True)
+
+    def ensure_started(self, timeout=10):
+        """監視が動いていなければ開始し、初回のスナップショットが届くまで待つ"""
+        with self._lock:
+            if self._watch is None or not getattr(self._watch, 'is_active', True):
+                if self._watch is not None:
+                    # 止まっていた間の変更は届かないため、前の一覧は使わず最初のスナップショットから作り直す
+                    self._stale_orders, self.orders = self.orders, {}
+                    self._ready.clear()
+                query = self.db.collection('orders').where('status', '==', self.status).order_by('createdAt')
+                self._watch = query.on_snapshot(self._on_snapshot)
+        self._ready.wait(timeout)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            if self._stale_orders is not None:
+                changed = self._resync(docs)
+            else:
+                changed = self._apply(changes)
+        self._ready.set()
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                print(f"Error in order feed listener ({self.status}): {e}")
+
+    def _apply(self, changes):
+        """差分を一覧に反映して配信する。ロックを持った状態で呼ぶ"""
+        changed = []
+        for change in changes:
+            doc = change.document
+            if change.type.name == 'REMOVED':
+                self.orders.pop(doc.id, None)
+                changed.append({'type': 'removed', 'id': doc.id})
+            else:
+                order = serialize_order(doc)
+                self.orders[doc.id] = order
+                changed.append({'type': change.type.name.lower(), 'id': doc.id, 'order': order})
+        # 1回のスナップショットの差分はまとめて1イベントにする (画面の再描画を1回で済ませる)
+        if changed:
+            self.channel.publish({'status': self.status, 'changes': changed})
+        return changed
+
+    def _resync(self, docs):
+        """
+        監視を張り直した後の最初のスナップショットで一覧を作り直す。ロックを持った状態で呼ぶ。
+        画面には全件を送り直させ (reset)、リスナーには前の一覧から消えた注文の removed と全注文の added を渡す
+        """
+        stale, self._stale_orders = self._stale_orders, None
+        self.orders = {doc.id: serialize_order(doc) for doc in docs}
+        changed = [{'type': 'removed', 'id': order_id} for order_id in stale if order_id not in self.orders]
+        changed += [{'type': 'added', 'id': order_id, 'order': order} for order_id, order in self.orders.items()]
+        self.channel.reset()
+        return changed
+
+    def get(self, order_id):
+        """一覧にある注文のデータを返す。無ければNone"""
+        with self._lock:
+            return self.orders.get(order_id)
+
+    def snapshot(self):
+        """現在の注文一覧(作成順)と、その時点のイベント番号を返す"""
+        with self._lock:
+            orders = sorted(({'id': order_id, 'order': order} for order_id, order in self.orders.items()),
+                            key=lambda entry: entry['order'].get('createdAtMs', 0))
+            return orders, self.channel.last_id
+
+    def stream(self, last_event_id=None):
+        """SSEの本文を生成する。Last-Event-ID が有効ならその続きから、無効なら全件から送る"""
+        self.ensure_started()
+        def reset():
+            orders, cursor = self.snapshot()
+            return cursor, {'status': self.status, 'orders': orders}
+        return _stream_channel(self.channel, reset, last_event_id)
+
+
+class PrepBoard:
+    """
+    調理中の注文から、持ち場(商品のカテゴリ)ごとに作る商品の合計個数を集計する。
+    調理中フィードの差分を受け取って、変わった注文の分だけ数え直す。
+    持ち場ごとにEventChannelを持ち、その持ち場の個数が変わったときだけ差分を配信する。
+    """
+    def __init__(self, feed, menu_provider):
+        self.feed = feed
+        self.menu_provider = menu_provider
+        self.counts = {}         # 持ち場 -> {ItemID: 個数}
+        self.order_counts = {}   # 持ち場 -> その持ち場の商品を含む注文の件数
+        self._contributions = {} # 注文ID -> {持ち場: {ItemID: 個数}}
+        self._channels = {}
+        self._lock = threading.RLock()
+        feed.add_listener(self.apply_changes)
+
+    def _station_units(self, order):
+        menu = self.menu_provider()
+        stations = {}
+        for item_id, quantity in item_units(order, menu).items():
+            item = menu['items_by_id'].get(item_id) or menu['items_by_name'].get(item_id) or {}
+            station = stations.setdefault(item.get('category', '未分類'), {})
+            station[item_id] = station.get(item_id, 0) + quantity
+        return stations
+
+    def _channel(self, station):
+        if station not in self._channels:
+            self._channels[station] = EventChannel()
+        return self._channels[station]
+
+    def apply_changes(self, changes):
+        """調理中フィードの差分を反映し、個数が変わった持ち場へ {ItemID: 新しい個数} を配信する"""
+        with self._lock:
+            touched = {}
+            for change in changes:
+                new = {} if change['type'] == 'removed' else self._station_units(change['order'])
+                old = self._contributions.pop(change['id'], {})
+                if new:
+                    self._contributions[change['id']] = new
+                for station in set(old) | set(new):
+                    counts = self.counts.setdefault(station, {})
+                    for item_id in set(old.get(station, {})) | set(new.get(station, {})):
+                        counts[item_id] = counts.get(item_id, 0) - old.get(station, {}).get(item_id, 0) + new.get(station, {}).get(item_id, 0)
+                        touched.setdefault(station, set()).add(item_id)
+                    self.order_counts[station] = self.order_counts.get(station, 0) - (station in old) + (station in new)
+            for station, item_ids in touched.items():
+                counts = self.counts[station]
+                delta = {item_id: counts[item_id] for item_id in item_ids}
+                for item_id, count in delta.items():
+                    if not count:
+                        del counts[item_id]
+                if delta:
+                    self._channel(station).publish({'station': station, 'items': delta, 'orders': self.order_counts[station]})
+
+    def stations(self):
+        with self._lock:
+            return sorted(station for station, counts in self.counts.items() if counts)
+
+    def snapshot(self, station):
+        """持ち場の現在の個数と、その時点のイベント番号を返す"""
+        with self._lock:
+            return dict(self.counts.get(station, {})), self.order_counts.get(station, 0), self._channel(station).last_id
+
+    def stream(self, station, last_event_id=None):
+        """持ち場1つ分の個数をSSEで配信する。最初(と再送できないとき)は全件、その後は変わった商品だけを送る"""
+        self.feed.ensure_started()
+        def reset():
+            counts, orders, cursor = self.snapshot(station)
+            return cursor, {'station': station, 'items': counts, 'orders': orders}
+        with self._lock:
+            channel = self._channel(station)
+        return _stream_channel(channel, reset, last_event_id)
+
+
+def _stream_channel(channel, reset, last_event_id=None):
+    """
+    EventChannelの内容をSSEの本文にする。Last-Event-ID が有効ならその続きから送り、
+    無効なら reset() が返す (イベント番号, 全件) を送ってから続きを送る
+    """
+    yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+    cursor = _parse_event_id(last_event_id)
+    if cursor is None or channel.events_after(cursor) is None:
+        cursor = None
+    while True:
+        if cursor is None:
+            cursor, payload = reset()
+            yield _format_event(cursor, 'reset', payload)
+        events = channel.events_after(cursor)
+        if events is None:
+            # 送信が追いつかずバッファから押し出された場合は、全件を送り直して追いつかせる
+            cursor = None
+            continue
+        for event_id, payload in events:
+            yield _format_event(event_id, 'changes', payload)
+            cursor = event_id
+        if not events and not channel.wait(cursor, HEARTBEAT_SECONDS):
+            yield ": keep-alive\n\n"
+
+
+def _parse_event_id(value):
+    try:
+        epoch, seq = (value or '').split(':')
+        return int(seq) if epoch == _FEED_EPOCH else None
+    except ValueError:
+        return None
+
+def _format_event(event_id, event_type, payload):
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {_FEED_EPOCH}:{event_id}\nevent: {event_type}\ndata: {data}\n\n"
@@ -0,0 +1,105 @@
+"""
+注文明細の保存形式
+注文ドキュメントには商品名を持たせず、商品ID・数量・単価(注文時点で確定)と、セットで選ばれた商品のIDだけを
+lines に保存する。表示や集計で使うときは、メニューの索引から商品名を引いて従来の items の形に戻す。
+以前の形式 (items に商品名・単価・数量をそのまま持つ) の注文もそのまま読める。
+
+    lines: [{'id': 'JB-01', 'q': 2, 'p': 250}, {'id': 'SET-01', 'q': 1, 'p': 500, 'sel': ['JB-01', 'JB-02']}]
+"""
+
+from order_archive import archive_collection_names
+
+# Firestoreの1バッチあたりの書き込み上限
+MIGRATE_BATCH_LIMIT = 500
+
+def _item_id(name, menu):
+    item = menu['items_by_name'].get(name)
+    if item is None:
+        raise ValueError(f"「{name}」はメニューにありません。")
+    return item['ItemID']
+
+def _item_name(item_id, menu):
+    # メニューから削除された商品は商品IDのまま表示する
+    return menu['items_by_id'].get(item_id, {}).get('name', item_id)
+
+def compact_lines(items, menu):
+    """items 形式の明細を lines 形式にする。商品名をメニューから引けなければValueError"""
+    lines = []
+    for item in items:
+        line = {'id': item.get('id') or _item_id(item['name'], menu), 'q': item['quantity'], 'p': item['price']}
+        if item.get('isSet'):
+            line['sel'] = [_item_id(name, menu) for name in item.get('selectedItems', [])]
+        lines.append(line)
+    return lines
+
+def expand_lines(order_data, menu):
+    """注文の明細を items 形式 [{id, name, price, quantity[, isSet, selectedItems]}] で返す"""
+    if 'lines' not in order_data:
+        return order_data.get('items', [])
+    items = []
+    for line in order_data['lines']:
+        item = {'id': line['id'], 'name': _item_name(line['id'], menu), 'price': line['p'], 'quantity': line['q']}
+        if 'sel' in line:
+            item.update(isSet=True, selectedItems=[_item_name(item_id, menu) for item_id in line['sel']])
+        items.append(item)
+    return items
+
+def expand_order(order_data, menu):
+    """lines 形式の注文を、items を持つ従来の形の注文データにして返す"""
+    if 'lines' not in order_data:
+        return order_data
+    expanded = {key: value for key, value in order_data.items() if key != 'lines'}
+    expanded['items'] = expand_lines(order_data, menu)
+    return expanded
+
+def item_units(order_data, menu=None):
+    """注文で作る商品の個数 {ItemID: 個数}。セットは選ばれた中身の商品として数える。
+    以前の形式の注文は、menu があれば商品名から商品IDを引き、無ければ商品名のまま数える"""
+    units = {}
+    def add(item_id, quantity):
+        units[item_id] = units.get(item_id, 0) + quantity
+    def legacy_id(name):
+        item = menu['items_by_name'].get(name) if menu else None
+        return item['ItemID'] if item else name
+    if 'lines' not in order_data:
+        for item in order_data.get('items', []):
+            if item.get('isSet') and menu:
+                for name in item.get('selectedItems', []):
+                    add(legacy_id(name), item.get('quantity', 1))
+            else:
+                add(item.get('id') or legacy_id(item.get('name')), item.get('quantity', 1))
+        return units
+    for line in order_data['lines']:
+        if 'sel' in line:
+            for item_id in line['sel']:
+                add(item_id, 1)
+        else:
+            add(line['id'], line['q'])
+    return units
+
+def migrate_orders(db, menu, log=print):
+    """orders とアーカイブに残っている以前の形式の注文を lines 形式に書き換える。(変換した件数, 変換できなかった件数) を返す"""
+    migrated = skipped = 0
+    batch, pending = db.batch(), 0
+    for name in ['orders'] + archive_collection_names(db):
+        for doc in db.collection(name).stream():
+            order_data = doc.to_dict()
+            if 'lines' in order_data or 'items' not in order_data:
+                continue
+            try:
+                lines = compact_lines(order_data['items'], menu)
+            except (KeyError, ValueError) as e:
+                log(f"注文 {name}/{doc.id} を変換できませんでした: {e}")
+                skipped += 1
+                continue
+            order_data.pop('items')
+            batch.set(doc.reference, dict(order_data, lines=lines))
+            migrated += 1
+            pending += 1
+            if pending >= MIGRATE_BATCH_LIMIT:
+                batch.commit()
+                batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    log(f"注文明細を変換しました: {migrated}件 (変換できなかった注文 {skipped}件)")
+    return migrated, skipped
@@ -0,0 +1,18 @@
+"""
+本番用の起動スクリプト
+gunicorn.conf.py の設定で、複数のワーカーでアプリを起動する。引数はそのまま gunicorn に渡す。
+    python serve.py
+    python serve.py --workers 2 --bind 127.0.0.1:8080
+"""
+
+import os
+import sys
+
+from gunicorn.app.wsgiapp import run
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(APP_DIR, 'gunicorn.conf.py')
+
+if __name__ == '__main__':
+    sys.argv = [sys.argv[0], '--config', CONFIG_PATH, '--chdir', APP_DIR, *sys.argv[1:], 'app:create_app()']
+    sys.exit(run())
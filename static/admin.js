@@ -79,6 +79,7 @@ document.addEventListener('DOMContentLoaded', () => {
         fetch('/api/get_sales_data').then(res => res.json()).then(data => {
             if (data.error) { return console.error("ダッシュボードデータ読み込み失敗:", data.error); }
             
+            document.getElementById('sales-rebuild-notice').style.display = data.rebuild_required ? 'block' : 'none';
             totalRevenueEl.textContent = `¥ ${data.total_revenue.toLocaleString()}`;
             document.getElementById('total-orders').textContent = data.total_orders;
 
@@ -101,6 +102,20 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     renderDashboard();
 
+    const rebuildSalesBtn = document.getElementById('rebuild-sales-btn');
+    if (rebuildSalesBtn) {
+        rebuildSalesBtn.addEventListener('click', () => {
+            rebuildSalesBtn.disabled = true;
+            fetch('/api/rebuild_sales_summary', { method: 'POST' }).then(res => res.json()).then(data => {
+                if (data.success) renderDashboard();
+                else alert('売上集計の再構築に失敗しました: ' + data.error);
+            }).catch(error => {
+                console.error('売上集計を再構築できませんでした:', error);
+                alert('通信エラーが発生しました。');
+            }).finally(() => { rebuildSalesBtn.disabled = false; });
+        });
+    }
+
     // --- 店舗設定 ---
     const storeSettingsForm = document.getElementById('store-settings-form');
     if (storeSettingsForm) {
@@ -164,6 +179,10 @@ document.addEventListener('DOMContentLoaded', () => {
                     formatter: (cell) => Array.isArray(cell.getValue()) ? cell.getValue().join(', ') : '',
                     mutator: (value, data, type) => (type === 'edit') ? value.split(',').map(s => s.trim()).filter(s => s) : value
                 },
+                {
+                    title: "在庫", field: "stock", editor: "number", hozAlign: "right", width: 90,
+                    formatter: (cell) => [null, undefined, ''].includes(cell.getValue()) ? '―' : cell.getValue()
+                },
                 {
                     title: "販売中", field: "isSoldOut", hozAlign: "center", width: 100,
                     formatter: "tickCross",
@@ -186,7 +205,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (!data.success) { 
                     alert("更新失敗: " + data.error); 
                     cell.restoreOldValue(); 
-                } 
+                } else if (field === 'stock' && value !== '') {
+                    // 在庫を設定すると、0なら売り切れ・1以上なら販売中になる
+                    cell.getRow().update({ isSoldOut: value !== 0 });
+                }
             });
         });
 
@@ -361,17 +383,38 @@ document.addEventListener('DOMContentLoaded', () => {
             if (confirmation) {
                 fetch(apiEndpoint, {method: 'POST'}).then(res => res.json()).then(data => {
                     if(data.success) {
-                        alert('リセットが完了しました。');
-                        if (buttonId === 'reset-super-btn') {
-                            window.location.href = '/logout';
-                        } else {
-                            window.location.reload();
-                        }
+                        button.disabled = true;
+                        pollResetJob(data.jobId, button, () => {
+                            alert('リセットが完了しました。');
+                            if (buttonId === 'reset-super-btn') {
+                                window.location.href = '/logout';
+                            } else {
+                                window.location.reload();
+                            }
+                        });
                     } else { alert('リセット失敗: ' + data.error); }
                 });
             }
         });
     }
+
+    // リセットはサーバー側のバックグラウンドジョブで実行されるため、完了まで進捗を確認する
+    function pollResetJob(jobId, button, onDone) {
+        const originalText = button.textContent;
+        const timer = setInterval(() => {
+            fetch(`/api/reset_status/${jobId}`).then(res => res.json()).then(job => {
+                if (job.state === 'running') {
+                    button.textContent = `削除中... ${job.deleted}件 (${job.current || ''})`;
+                    return;
+                }
+                clearInterval(timer);
+                button.textContent = originalText;
+                button.disabled = false;
+                if (job.state === 'done') { onDone(); }
+                else { alert('リセット失敗: ' + (job.error || '不明なエラー')); }
+            }).catch(err => console.error('リセット状況の取得に失敗:', err));
+        }, 1000);
+    }
     setupResetButton('reset-data-btn', '/api/reset_data', '本当にすべての運営データ（注文、商品、サイネージ）を削除しますか？\nこの操作は取り消せません。');
     setupResetButton('reset-all-btn', '/api/reset_all', '【最終確認】本当に運営データと、あなた以外のアカウントをすべて削除しますか？');
     setupResetButton('reset-super-btn', '/api/reset_super', ''); // prompt message is handled inside
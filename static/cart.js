@@ -74,24 +74,81 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // --- 注文の送信 ---
+    // 通信が不安定でも注文が二重にならないよう、同じカートの送信には同じ Idempotency-Key を付けて再送する
+    const ORDER_TIMEOUT_MS = 10000;
+    const ORDER_RETRY_DELAYS_MS = [1000, 2000, 4000, 8000];
+
+    function createOrderKey() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        const bytes = new Uint8Array(16);
+        crypto.getRandomValues(bytes);
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // カートの内容が同じ間は同じキーを使う (送信中にページを開き直して再度押した場合も含む)
+    function orderKeyFor(body) {
+        const saved = JSON.parse(localStorage.getItem('orderKey') || 'null');
+        if (saved && saved.body === body) return saved.key;
+        const key = createOrderKey();
+        localStorage.setItem('orderKey', JSON.stringify({ key: key, body: body }));
+        return key;
+    }
+
+    function postOrder(body, key) {
+        const controller = new AbortController();
+        const timer = setTimeout(() => controller.abort(), ORDER_TIMEOUT_MS);
+        return fetch('/order', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+            body: body,
+            signal: controller.signal,
+        }).then(res => res.json().then(data => ({ status: res.status, data })))
+          .finally(() => clearTimeout(timer));
+    }
+
+    // 通信エラー・タイムアウト・サーバーエラーのときは、待ち時間を延ばしながら同じキーで再送する
+    function submitOrder(body, key, attempt = 0) {
+        return postOrder(body, key).then(result => {
+            if (result.status >= 500 && attempt < ORDER_RETRY_DELAYS_MS.length) throw result;
+            return result;
+        }).catch(error => {
+            if (attempt >= ORDER_RETRY_DELAYS_MS.length) throw error;
+            const delay = ORDER_RETRY_DELAYS_MS[attempt] * (0.75 + Math.random() * 0.5);
+            console.warn(`注文の送信に失敗しました。${Math.round(delay)}ms 後に再送します (${attempt + 1}回目)`, error);
+            orderBtn.textContent = '再送信中...';
+            return new Promise(resolve => setTimeout(resolve, delay)).then(() => submitOrder(body, key, attempt + 1));
+        });
+    }
+
     orderBtn.addEventListener('click', () => {
         let cart = JSON.parse(localStorage.getItem('cart')) || [];
         if (cart.length === 0) return alert('カートは空です。');
 
-        fetch('/order', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(cart),
-        }).then(res => res.json()).then(data => {
+        const body = JSON.stringify(cart);
+        const originalLabel = orderBtn.textContent;
+        orderBtn.disabled = true;
+        orderBtn.textContent = '送信中...';
+        submitOrder(body, orderKeyFor(body)).then(({ status, data }) => {
             if (data.success) {
                 localStorage.removeItem('cart');
+                localStorage.removeItem('orderKey');
                 window.location.href = `/order_complete?order_id=${data.orderId}`;
+                return;
+            }
+            if (status === 400 && data.error) {
+                // 売り切れ・メニュー変更などでサーバーが受け付けなかった場合は理由を表示する
+                alert(data.error);
             } else {
                 alert('注文処理中にエラーが発生しました。');
             }
+            orderBtn.disabled = false;
+            orderBtn.textContent = originalLabel;
         }).catch(error => {
             console.error('注文APIエラー:', error);
-            alert('通信エラーが発生しました。');
+            alert('通信エラーが発生しました。もう一度「注文を確定する」を押してください。');
+            orderBtn.disabled = false;
+            orderBtn.textContent = originalLabel;
         });
     });
 
@@ -5,7 +5,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const ticketInputEl = document.getElementById('ticket-input');
     const submitBtnEl = document.getElementById('submit-ticket');
     const readyListContainerEl = document.getElementById('ready-list-container');
+    const selectModeBtnEl = document.getElementById('select-mode-btn');
+    const bulkCompleteBtnEl = document.getElementById('bulk-complete-btn');
     let html5QrcodeScanner;
+    let isSelectMode = false;
+    const selectedOrders = new Map(); // まとめて受け渡し完了にする注文 { docId: 番号 }
 
     const fullscreenBtn = document.getElementById('fullscreen-btn');
     if (fullscreenBtn) {
@@ -83,38 +87,90 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // --- まとめて受け渡し ---
+    function updateBulkButtons() {
+        selectModeBtnEl.textContent = isSelectMode ? '選択をやめる' : 'まとめて渡す';
+        selectModeBtnEl.classList.toggle('active', isSelectMode);
+        bulkCompleteBtnEl.hidden = !isSelectMode;
+        bulkCompleteBtnEl.disabled = selectedOrders.size === 0;
+        bulkCompleteBtnEl.textContent = `選択した${selectedOrders.size}件を渡した`;
+    }
+
+    function setSelectMode(enabled) {
+        isSelectMode = enabled;
+        selectedOrders.clear();
+        document.querySelectorAll('.ready-ticket.selected').forEach(el => el.classList.remove('selected'));
+        updateBulkButtons();
+    }
+
+    selectModeBtnEl.addEventListener('click', () => setSelectMode(!isSelectMode));
+
+    bulkCompleteBtnEl.addEventListener('click', () => {
+        const tickets = Array.from(selectedOrders.values()).join(', ');
+        if (selectedOrders.size === 0 || !confirm(`番号 ${tickets} の商品を渡しましたか？`)) return;
+        bulkCompleteBtnEl.disabled = true;
+        fetch('/api/bulk_update_order_status', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ docIds: Array.from(selectedOrders.keys()), status: '完了' })
+        }).then(res => res.json()).then(data => {
+            if (data.success) {
+                showToast(`${tickets} を受け渡し済みにしました`, 'success');
+                setSelectMode(false);
+            } else {
+                alert('ステータスの更新に失敗しました: ' + data.error);
+                updateBulkButtons();
+            }
+        }).catch(error => {
+            console.error('まとめて更新できませんでした:', error);
+            showToast('通信エラーが発生しました', 'error');
+            updateBulkButtons();
+        });
+    });
+
     try {
-        db.collection('orders').where('status', '==', '提供可能').orderBy('createdAt', 'asc')
-            .onSnapshot(querySnapshot => {
-                readyListContainerEl.innerHTML = '';
-                querySnapshot.forEach(doc => {
-                    const order = doc.data();
-                    const docId = doc.id;
-                    const ticketDiv = document.createElement('div');
-                    ticketDiv.className = 'ready-ticket';
-                    ticketDiv.textContent = order.ticketNumber;
-                    ticketDiv.classList.add(order.paymentStatus === '未会計' ? 'unpaid' : 'paid');
+        subscribeOrders('提供可能', querySnapshot => {
+            readyListContainerEl.innerHTML = '';
+            // 一覧から消えた注文は選択から外す
+            const currentIds = new Set(querySnapshot.docs.map(doc => doc.id));
+            Array.from(selectedOrders.keys()).forEach(docId => { if (!currentIds.has(docId)) selectedOrders.delete(docId); });
+            updateBulkButtons();
+            querySnapshot.forEach(doc => {
+                const order = doc.data();
+                const docId = doc.id;
+                const ticketDiv = document.createElement('div');
+                ticketDiv.className = 'ready-ticket';
+                ticketDiv.textContent = order.ticketNumber;
+                ticketDiv.classList.add(order.paymentStatus === '未会計' ? 'unpaid' : 'paid');
+                ticketDiv.classList.toggle('selected', selectedOrders.has(docId));
 
-                    ticketDiv.addEventListener('click', () => {
-                        if (order.paymentStatus === '未会計') {
-                            alert(`【未会計】番号 ${order.ticketNumber}\n\nお客様に、先に二次元コードを提示してお会計を済ませるよう案内してください。`);
-                            return;
-                        }
-                        if (confirm(`番号 ${order.ticketNumber} の商品を渡しましたか？`)) {
-                            fetch('/api/update_order_status', {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify({ docId: docId, status: '完了' })
-                            }).then(res => res.json()).then(data => {
-                                if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
-                            });
-                        }
-                    });
-                    readyListContainerEl.appendChild(ticketDiv);
+                ticketDiv.addEventListener('click', () => {
+                    if (order.paymentStatus === '未会計') {
+                        alert(`【未会計】番号 ${order.ticketNumber}\n\nお客様に、先に二次元コードを提示してお会計を済ませるよう案内してください。`);
+                        return;
+                    }
+                    if (isSelectMode) {
+                        if (selectedOrders.has(docId)) selectedOrders.delete(docId);
+                        else selectedOrders.set(docId, order.ticketNumber);
+                        ticketDiv.classList.toggle('selected', selectedOrders.has(docId));
+                        updateBulkButtons();
+                        return;
+                    }
+                    if (confirm(`番号 ${order.ticketNumber} の商品を渡しましたか？`)) {
+                        fetch('/api/update_order_status', {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify({ docId: docId, status: '完了' })
+                        }).then(res => res.json()).then(data => {
+                            if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
+                        });
+                    }
                 });
+                readyListContainerEl.appendChild(ticketDiv);
             });
+        });
     } catch (e) {
-        console.error("Firebaseの接続またはリアルタイム更新に失敗しました:", e);
+        console.error("注文フィードの接続またはリアルタイム更新に失敗しました:", e);
         alert("データベースとの接続に失敗しました。");
     }
 });
\ No newline at end of file
@@ -5,10 +5,13 @@ document.addEventListener('DOMContentLoaded', () => {
     const cookingTicketsList = document.getElementById('cooking-tickets-list');
     const readyTicketsList = document.getElementById('ready-tickets-list');
     const inputPreview = document.getElementById('input-preview');
+    const waitSummary = document.getElementById('wait-summary');
+    const WAIT_TIME_REFRESH_MS = 15000;
 
     let isSoundEnabled = false;
     let previousReadyCount = 0;
     let inputBuffer = '';
+    let waitByTicket = {}; // 整理券番号 -> 待ち秒数の見積もり
 
     unmuteButton.addEventListener('click', () => {
         unmuteButton.classList.add('active');
@@ -69,47 +72,77 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    db.collection('orders').where('status', '==', '調理中').orderBy('createdAt', 'asc')
-        .onSnapshot(querySnapshot => {
-            cookingTicketsList.innerHTML = '';
-            querySnapshot.forEach(doc => {
-                const order = doc.data();
-                const ticketDiv = document.createElement('div');
-                ticketDiv.className = 'ticket-number';
-                ticketDiv.textContent = order.ticketNumber;
-                cookingTicketsList.appendChild(ticketDiv);
-            });
+    function formatWait(seconds) {
+        const minutes = Math.ceil(seconds / 60);
+        return minutes > 0 ? `約${minutes}分` : 'まもなく';
+    }
+
+    // 調理中の番号の下に、できあがりの目安を表示する
+    function renderTicketWaits() {
+        cookingTicketsList.querySelectorAll('.ticket-number').forEach(ticketDiv => {
+            const seconds = waitByTicket[ticketDiv.dataset.ticket];
+            ticketDiv.querySelector('.ticket-wait').textContent = seconds === undefined ? '' : formatWait(seconds);
         });
+    }
 
-    db.collection('orders').where('status', '==', '提供可能').orderBy('createdAt', 'asc')
-        .onSnapshot(querySnapshot => {
-            const currentReadyCount = querySnapshot.size;
-            if (isSoundEnabled && currentReadyCount > previousReadyCount) {
-                notificationSound.play().catch(error => console.warn("音声再生失敗:", error));
-            }
-            previousReadyCount = currentReadyCount;
+    function updateWaitTime() {
+        fetch('/api/wait_time').then(res => res.ok ? res.json() : null).then(data => {
+            if (!data) return; // 準備中 (次の更新で取り直す)
+            waitByTicket = {};
+            (data.tickets || []).forEach(ticket => { waitByTicket[ticket.ticketNumber] = ticket.waitSeconds; });
+            waitSummary.textContent = `ただいまのご注文は ${formatWait(data.newOrderSeconds)} でお渡しできます`;
+            renderTicketWaits();
+        }).catch(error => console.warn('待ち時間を取得できませんでした:', error));
+    }
 
-            readyTicketsList.innerHTML = '';
-            querySnapshot.forEach(doc => {
-                const order = doc.data();
-                const orderId = doc.id;
-                const ticketDiv = document.createElement('div');
-                ticketDiv.className = 'ticket-number';
-                ticketDiv.textContent = order.ticketNumber;
-                ticketDiv.dataset.id = orderId;
+    updateWaitTime();
+    setInterval(updateWaitTime, WAIT_TIME_REFRESH_MS);
 
-                ticketDiv.addEventListener('click', () => {
-                    if (confirm(`注文番号 ${ticketDiv.textContent} を完了にしてよろしいですか？`)) {
-                        fetch('/api/update_order_status', {
-                            method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
-                            body: JSON.stringify({ docId: orderId, status: '完了' })
-                        }).then(res => res.json()).then(data => {
-                            if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
-                        });
-                    }
-                });
-                readyTicketsList.appendChild(ticketDiv);
+    subscribeOrders('調理中', querySnapshot => {
+        cookingTicketsList.innerHTML = '';
+        querySnapshot.forEach(doc => {
+            const order = doc.data();
+            const ticketDiv = document.createElement('div');
+            ticketDiv.className = 'ticket-number';
+            ticketDiv.dataset.ticket = order.ticketNumber;
+            const numberSpan = document.createElement('span');
+            numberSpan.textContent = order.ticketNumber;
+            const waitSpan = document.createElement('span');
+            waitSpan.className = 'ticket-wait';
+            ticketDiv.append(numberSpan, waitSpan);
+            cookingTicketsList.appendChild(ticketDiv);
+        });
+        renderTicketWaits();
+    });
+
+    subscribeOrders('提供可能', querySnapshot => {
+        const currentReadyCount = querySnapshot.size;
+        if (isSoundEnabled && currentReadyCount > previousReadyCount) {
+            notificationSound.play().catch(error => console.warn("音声再生失敗:", error));
+        }
+        previousReadyCount = currentReadyCount;
+
+        readyTicketsList.innerHTML = '';
+        querySnapshot.forEach(doc => {
+            const order = doc.data();
+            const orderId = doc.id;
+            const ticketDiv = document.createElement('div');
+            ticketDiv.className = 'ticket-number';
+            ticketDiv.textContent = order.ticketNumber;
+            ticketDiv.dataset.id = orderId;
+
+            ticketDiv.addEventListener('click', () => {
+                if (confirm(`注文番号 ${ticketDiv.textContent} を完了にしてよろしいですか？`)) {
+                    fetch('/api/update_order_status', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ docId: orderId, status: '完了' })
+                    }).then(res => res.json()).then(data => {
+                        if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
+                    });
+                }
             });
+            readyTicketsList.appendChild(ticketDiv);
         });
+    });
 });
\ No newline at end of file
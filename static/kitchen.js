@@ -6,10 +6,19 @@ document.addEventListener('DOMContentLoaded', () => {
     const unmuteButton = document.getElementById('unmute-button');
     const fullscreenBtn = document.getElementById('fullscreen-btn');
     const inputPreview = document.getElementById('input-preview');
+    const bulkBar = document.getElementById('bulk-bar');
+    const bulkCount = document.getElementById('bulk-count');
+    const bulkReadyBtn = document.getElementById('bulk-ready-btn');
+    const bulkClearBtn = document.getElementById('bulk-clear-btn');
+    const stationSelect = document.getElementById('station-select');
+    const prepPanel = document.getElementById('prep-panel');
+    const prepTitle = document.getElementById('prep-title');
+    const prepItems = document.getElementById('prep-items');
 
     let isSoundEnabled = false;
     let previousOrdersCount = 0;
     let inputBuffer = '';
+    const selectedIds = new Set(); // まとめて提供可能にするために選択中の注文ID
 
     unmuteButton.addEventListener('click', () => {
         unmuteButton.classList.add('active');
@@ -34,12 +43,19 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     document.addEventListener('keydown', (event) => {
+        if (stationSelect.value) return; // 持ち場の画面には注文カードが無い
         if (!isNaN(event.key) && event.key !== ' ') { inputBuffer += event.key; updatePreview(); }
         if (event.key === 'Enter' && inputBuffer.length > 0) {
             processOrder(inputBuffer);
             inputBuffer = '';
             updatePreview();
         }
+        // 番号を入力して + で、その注文を選択/選択解除する
+        if (event.key === '+' && inputBuffer.length > 0) {
+            toggleSelectionByTicket(inputBuffer);
+            inputBuffer = '';
+            updatePreview();
+        }
         if (event.key === '.') { inputBuffer = ''; updatePreview(); }
         if (event.key === 'Backspace') {
             inputBuffer = inputBuffer.slice(0, -1);
@@ -71,61 +87,185 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    db.collection('orders').where('status', '==', '調理中').orderBy('createdAt', 'asc')
-        .onSnapshot(querySnapshot => {
-            const currentOrdersCount = querySnapshot.size;
-            if (isSoundEnabled && currentOrdersCount > previousOrdersCount) {
-                notificationSound.play().catch(error => console.warn("音声再生失敗:", error));
-            }
-            previousOrdersCount = currentOrdersCount;
-            ordersContainer.innerHTML = '';
-            if (querySnapshot.empty) {
-                ordersContainer.innerHTML = '<p style="padding-left:20px;">新しい注文を待っています...</p>';
-                return;
+    function findCard(ticketNumber) {
+        return Array.from(document.querySelectorAll('.order-card')).find(card => {
+            const ticketNumberEl = card.querySelector('.ticket-number');
+            return ticketNumberEl && ticketNumberEl.textContent === ticketNumber;
+        });
+    }
+
+    function toggleSelectionByTicket(ticketNumber) {
+        const card = findCard(ticketNumber);
+        if (card) {
+            setSelected(card.dataset.id, !selectedIds.has(card.dataset.id));
+        } else {
+            alert(`注文番号 ${ticketNumber} は見つかりません。`);
+        }
+    }
+
+    function setSelected(orderId, selected) {
+        if (selected) selectedIds.add(orderId);
+        else selectedIds.delete(orderId);
+        const card = document.querySelector(`.order-card[data-id="${orderId}"]`);
+        if (card) {
+            card.classList.toggle('selected', selected);
+            card.querySelector('.select-checkbox').checked = selected;
+        }
+        updateBulkBar();
+    }
+
+    function updateBulkBar() {
+        bulkCount.textContent = `${selectedIds.size}件選択中`;
+        bulkBar.classList.toggle('visible', selectedIds.size > 0);
+    }
+
+    // 選択した注文を1回のリクエストでまとめて提供可能にする
+    bulkReadyBtn.addEventListener('click', () => {
+        if (selectedIds.size === 0) return;
+        bulkReadyBtn.disabled = true;
+        fetch('/api/bulk_update_order_status', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ docIds: Array.from(selectedIds), status: '提供可能' })
+        }).then(res => res.json()).then(data => {
+            if (data.success) {
+                selectedIds.clear();
+                updateBulkBar();
+            } else {
+                alert('ステータスの更新に失敗しました: ' + data.error);
             }
-            querySnapshot.forEach(doc => {
-                const order = doc.data();
-                const orderId = doc.id;
-                let itemsHtml = '<ul>';
-                order.items.forEach(item => {
-                    if (item.isSet && item.selectedItems) {
-                        itemsHtml += `<li><strong>${item.name} x ${item.quantity}</strong>`;
-                        itemsHtml += '<ul style="margin-left: 20px; list-style-type: circle;">';
-                        item.selectedItems.forEach(selected => {
-                            itemsHtml += `<li>${selected}</li>`;
-                        });
-                        itemsHtml += '</ul></li>';
-                    } else {
-                        itemsHtml += `<li>${item.name} <strong>x ${item.quantity}</strong></li>`;
-                    }
+        }).catch(error => {
+            console.error('まとめて更新できませんでした:', error);
+            alert('通信エラーが発生しました。');
+        }).finally(() => { bulkReadyBtn.disabled = false; });
+    });
+
+    bulkClearBtn.addEventListener('click', () => {
+        Array.from(selectedIds).forEach(orderId => setSelected(orderId, false));
+    });
+
+    // --- 持ち場ごとの合計個数 ---
+    // サーバーが集計した個数を受け取り、変わった商品の個数だけを書き換える
+    const prepCounts = new Map();
+    let prepOrders = 0;
+
+    function renderPrep() {
+        prepTitle.textContent = `${stationSelect.value} (${prepOrders}件)`;
+        prepItems.innerHTML = '';
+        Array.from(prepCounts.entries()).sort((a, b) => b[1] - a[1]).forEach(([itemId, count]) => {
+            const itemDiv = document.createElement('div');
+            itemDiv.className = 'prep-item';
+            itemDiv.textContent = itemName(itemId);
+            const countEl = document.createElement('strong');
+            countEl.textContent = `× ${count}`;
+            itemDiv.appendChild(countEl);
+            prepItems.appendChild(itemDiv);
+        });
+        if (prepCounts.size === 0) prepItems.textContent = '作る商品はありません';
+    }
+
+    stationSelect.addEventListener('change', () => {
+        const url = new URL(window.location.href);
+        if (stationSelect.value) url.searchParams.set('station', stationSelect.value);
+        else url.searchParams.delete('station');
+        window.location.href = url.toString();
+    });
+
+    // 持ち場を選んだ画面は合計個数だけを表示し、調理中の注文一覧は購読しない
+    // (注文カードの表示・提供可能への変更は、持ち場: 全体 の画面で行う)
+    if (stationSelect.value) {
+        prepPanel.classList.add('visible');
+        ordersContainer.hidden = true;
+        const menuReady = loadMenuMap();
+        openFeed(`/api/prep_feed?station=${encodeURIComponent(stationSelect.value)}`, {
+            reset: event => {
+                const data = JSON.parse(event.data);
+                prepCounts.clear();
+                Object.entries(data.items).forEach(([itemId, count]) => prepCounts.set(itemId, count));
+                prepOrders = data.orders;
+                menuReady.then(renderPrep);
+            },
+            changes: event => {
+                const data = JSON.parse(event.data);
+                Object.entries(data.items).forEach(([itemId, count]) => {
+                    if (count > 0) prepCounts.set(itemId, count);
+                    else prepCounts.delete(itemId);
                 });
-                itemsHtml += '</ul>';
-
-                const orderDiv = document.createElement('div');
-                orderDiv.className = 'order-card';
-                orderDiv.innerHTML = `
-                    <div class="order-card-header">
-                        <span class="ticket-number">${order.ticketNumber}</span>
-                        <span class="total-price">${order.totalPrice}円</span>
-                    </div>
-                    <div class="order-card-body">${itemsHtml}</div>
-                    <div class="order-card-footer">
-                        <button class="status-btn" data-id="${orderId}">提供可能にする</button>
-                    </div>
-                `;
-                ordersContainer.appendChild(orderDiv);
-            });
-            document.querySelectorAll('.status-btn').forEach(button => {
-                button.addEventListener('click', (event) => {
-                    const docId = event.target.dataset.id;
-                    fetch('/api/update_order_status', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ docId: docId, status: '提供可能' })
-                    }).then(res => res.json()).then(data => {
-                        if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
+                if (isSoundEnabled && data.orders > prepOrders) {
+                    notificationSound.play().catch(error => console.warn("音声再生失敗:", error));
+                }
+                prepOrders = data.orders;
+                menuReady.then(renderPrep);
+            },
+        }, '持ち場の集計');
+    } else {
+        subscribeOrders('調理中', renderOrders);
+    }
+
+    function renderOrders(querySnapshot) {
+        const currentOrdersCount = querySnapshot.size;
+        if (isSoundEnabled && currentOrdersCount > previousOrdersCount) {
+            notificationSound.play().catch(error => console.warn("音声再生失敗:", error));
+        }
+        previousOrdersCount = currentOrdersCount;
+        ordersContainer.innerHTML = '';
+        // 一覧から消えた(他の端末で提供可能になった)注文は選択から外す
+        const currentIds = new Set(querySnapshot.docs.map(doc => doc.id));
+        Array.from(selectedIds).forEach(orderId => { if (!currentIds.has(orderId)) selectedIds.delete(orderId); });
+        updateBulkBar();
+        if (querySnapshot.empty) {
+            ordersContainer.innerHTML = '<p style="padding-left:20px;">新しい注文を待っています...</p>';
+            return;
+        }
+        querySnapshot.forEach(doc => {
+            const order = doc.data();
+            const orderId = doc.id;
+            let itemsHtml = '<ul>';
+            order.items.forEach(item => {
+                if (item.isSet && item.selectedItems) {
+                    itemsHtml += `<li><strong>${item.name} x ${item.quantity}</strong>`;
+                    itemsHtml += '<ul style="margin-left: 20px; list-style-type: circle;">';
+                    item.selectedItems.forEach(selected => {
+                        itemsHtml += `<li>${selected}</li>`;
                     });
+                    itemsHtml += '</ul></li>';
+                } else {
+                    itemsHtml += `<li>${item.name} <strong>x ${item.quantity}</strong></li>`;
+                }
+            });
+            itemsHtml += '</ul>';
+
+            const orderDiv = document.createElement('div');
+            orderDiv.className = 'order-card';
+            orderDiv.dataset.id = orderId;
+            orderDiv.classList.toggle('selected', selectedIds.has(orderId));
+            orderDiv.innerHTML = `
+                <div class="order-card-header">
+                    <label class="select-label"><input type="checkbox" class="select-checkbox" ${selectedIds.has(orderId) ? 'checked' : ''}></label>
+                    <span class="ticket-number">${order.ticketNumber}</span>
+                    <span class="total-price">${order.totalPrice}円</span>
+                </div>
+                <div class="order-card-body">${itemsHtml}</div>
+                <div class="order-card-footer">
+                    <button class="status-btn" data-id="${orderId}">提供可能にする</button>
+                </div>
+            `;
+            orderDiv.querySelector('.select-checkbox').addEventListener('change', (event) => {
+                setSelected(orderId, event.target.checked);
+            });
+            ordersContainer.appendChild(orderDiv);
+        });
+        document.querySelectorAll('.status-btn').forEach(button => {
+            button.addEventListener('click', (event) => {
+                const docId = event.target.dataset.id;
+                fetch('/api/update_order_status', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ docId: docId, status: '提供可能' })
+                }).then(res => res.json()).then(data => {
+                    if (!data.success) { alert('ステータスの更新に失敗しました: ' + data.error); }
                 });
             });
         });
+    }
 });
\ No newline at end of file
@@ -40,6 +40,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const card = button.closest('.item-card');
         const itemId = card.dataset.itemId;
         const quantityEl = card.querySelector('.quantity');
+        const imageEl = card.querySelector('.item-image');
         
         button.addEventListener('click', () => {
             const quantity = parseInt(quantityEl.textContent);
@@ -54,7 +55,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     name: button.dataset.itemName,
                     price: parseInt(button.dataset.itemPrice),
                     quantity: quantity,
-                    imageUrl: card.querySelector('.item-image')?.src || ''
+                    imageUrl: imageEl?.currentSrc || imageEl?.src || ''
                 });
             }
             localStorage.setItem('cart', JSON.stringify(cart));
@@ -161,6 +162,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         let cart = JSON.parse(localStorage.getItem('cart')) || [];
+        const setImage = document.querySelector(`[data-item-id="${currentSetInfo.id}"] .item-image`);
         cart.push({
             id: currentSetInfo.id,
             name: currentSetInfo.name,
@@ -168,7 +170,7 @@ document.addEventListener('DOMContentLoaded', () => {
             quantity: 1,
             isSet: true,
             selectedItems: selectedChoices, // 選択した商品名の配列
-            imageUrl: document.querySelector(`[data-item-id="${currentSetInfo.id}"] .item-image`)?.src || ''
+            imageUrl: setImage?.currentSrc || setImage?.src || ''
         });
         localStorage.setItem('cart', JSON.stringify(cart));
         showToast(`${currentSetInfo.name}をカートに追加しました！`);
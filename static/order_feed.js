@@ -0,0 +1,117 @@
+// 注文ステータスの変更フィード (SSE) の購読
+// サーバーが共有しているFirestore監視の差分を受け取り、FirestoreのQuerySnapshotと同じ形(size / empty / forEach)で
+// コールバックに渡す。切断時はブラウザが Last-Event-ID を付けて自動で再接続する。
+// サーバーの配信数が上限に達していると 503 が返り、ブラウザは再接続しないため、その場合は少し待って自分で接続し直す。
+// 注文明細(lines)は商品IDだけで届くため、/api/menu_map の対応表で商品名を引き、従来の items の形にして渡す。
+
+// 知らない商品IDが届いたとき(メニューの更新後)に対応表を取り直す最短間隔
+const MENU_MAP_REFRESH_MS = 10 * 1000;
+let menuMap = {};
+let menuMapRequest = null;
+let menuMapLoadedAt = 0;
+
+function loadMenuMap() {
+    if (!menuMapRequest) {
+        menuMapRequest = fetch('/api/menu_map')
+            .then(res => res.json())
+            .then(data => { menuMap = data.items || {}; })
+            .catch(error => console.warn('商品の対応表を取得できませんでした:', error))
+            .finally(() => {
+                menuMapLoadedAt = Date.now();
+                menuMapRequest = null;
+            });
+    }
+    return menuMapRequest;
+}
+
+function itemName(itemId) {
+    return menuMap[itemId] ? menuMap[itemId].name : itemId;
+}
+
+function expandOrder(order) {
+    if (!order.lines) return order; // 以前の形式 (items に商品名を持つ) の注文
+    const items = order.lines.map(line => {
+        const item = { id: line.id, name: itemName(line.id), price: line.p, quantity: line.q };
+        if (line.sel) {
+            item.isSet = true;
+            item.selectedItems = line.sel.map(itemName);
+        }
+        return item;
+    });
+    return Object.assign({}, order, { items: items });
+}
+
+function hasUnknownItems(orders) {
+    for (const order of orders.values()) {
+        for (const line of order.lines || []) {
+            if (!menuMap[line.id] || (line.sel || []).some(itemId => !menuMap[itemId])) return true;
+        }
+    }
+    return false;
+}
+
+// 接続が閉じられた (503 などで拒否された) ときに接続し直すまでの時間 (サーバーの Retry-After と同じ)
+const FEED_RETRY_MS = 10 * 1000;
+
+// SSEに接続し、handlers ({イベント名: 関数}) を登録する。接続を閉じる関数を返す
+function openFeed(url, handlers, label) {
+    let source = null;
+    let retryTimer = null;
+    function connect() {
+        source = new EventSource(url);
+        Object.entries(handlers).forEach(([type, handler]) => source.addEventListener(type, handler));
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED) {
+                // 再接続し直した場合は最初に reset (全件) が届く
+                console.warn(`${label}に接続できませんでした。${FEED_RETRY_MS / 1000}秒後に接続し直します...`);
+                retryTimer = setTimeout(connect, FEED_RETRY_MS);
+            } else {
+                console.warn(`${label}の接続が切れました。再接続します...`);
+            }
+        });
+    }
+    connect();
+    return () => {
+        clearTimeout(retryTimer);
+        source.close();
+    };
+}
+
+function subscribeOrders(status, onSnapshot) {
+    const orders = new Map();
+    const ready = loadMenuMap();
+
+    function notify() {
+        ready.then(() => {
+            if (hasUnknownItems(orders) && Date.now() - menuMapLoadedAt > MENU_MAP_REFRESH_MS) {
+                loadMenuMap().then(render);
+            }
+            render();
+        });
+    }
+
+    function render() {
+        const docs = Array.from(orders.entries())
+            .sort((a, b) => (a[1].createdAtMs || 0) - (b[1].createdAtMs || 0))
+            .map(([id, order]) => {
+                const expanded = expandOrder(order);
+                return { id: id, data: () => expanded };
+            });
+        onSnapshot({ size: docs.length, empty: docs.length === 0, docs: docs, forEach: fn => docs.forEach(fn) });
+    }
+
+    return openFeed(`/api/order_feed?status=${encodeURIComponent(status)}`, {
+        reset: event => {
+            orders.clear();
+            JSON.parse(event.data).orders.forEach(entry => orders.set(entry.id, entry.order));
+            notify();
+        },
+        changes: event => {
+            JSON.parse(event.data).changes.forEach(change => {
+                if (change.type === 'removed') orders.delete(change.id);
+                else orders.set(change.id, change.order);
+            });
+            notify();
+        },
+    }, `注文フィード(${status})`);
+}
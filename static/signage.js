@@ -3,9 +3,11 @@
  * デジタルサイネージページ (signage.js) - 画像専用
  * ====================================================================
  * 機能：
- * 1. APIから画像リストと設定を取得
- * 2. 設定された秒数ごとに、画像をフェードイン/アウトで切り替える
- * 3. 全画面表示の切り替え機能
+ * 1. APIからマニフェスト(画像リスト・設定・バージョン)を取得
+ * 2. 表示前にすべての画像を取得して手元に保存し、以降はネットワークを使わずに表示する
+ * 3. 設定された秒数ごとに、画像をフェードイン/アウトで切り替える
+ * 4. バージョンだけを定期的に確認し、変わっていれば新しい画像を揃えてから切り替える
+ * 5. 全画面表示の切り替え機能
  */
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -13,60 +15,175 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- 1. HTML要素の取得と変数の初期化 ---
     const container = document.getElementById('signage-container');
     const fullscreenBtn = document.getElementById('fullscreen-btn');
-    
+
+    const MANIFEST_STORAGE_KEY = 'signageManifest'; // 最後に表示したマニフェスト (オフライン起動用)
+    const ASSET_CACHE_NAME = 'signage-assets';      // 縮小版画像を保存する Cache Storage
+    const VERSION_CHECK_INTERVAL = 30 * 1000;       // バージョン確認の間隔 (ミリ秒)
+
     let currentIndex = 0;
-    let signageData = null; // APIから取得した全データ (items と settings)
-    let slideInterval;      // スライド切り替えのためのタイマーID
+    let signageData = null;     // 表示中のマニフェスト (items と settings と version)
+    let slideUrls = [];         // 各スライドに表示する画像のURL (取得済みの blob: URL)
+    let pendingUpdate = null;   // 画像を揃え終わり、次の切り替えで反映するマニフェスト
+    let updating = false;
+    let slideInterval;          // スライド切り替えのためのタイマーID
+
 
-    
     // --- 2. メイン実行フロー ---
 
-    // APIからサイネージデータを取得
-    fetch('/api/get_signage_items')
-        .then(res => res.json())
-        .then(data => {
-            if (data.error || !data.items || data.items.length === 0) {
-                throw new Error(data.error || "表示するコンテンツがありません");
+    fetchManifest()
+        .catch(err => {
+            // サーバーに繋がらない場合は、前回表示したマニフェストで起動する
+            const saved = JSON.parse(localStorage.getItem(MANIFEST_STORAGE_KEY) || 'null');
+            if (!saved) throw err;
+            console.warn("マニフェストを取得できないため、前回の内容で表示します:", err);
+            return saved;
+        })
+        .then(manifest => {
+            if (!manifest.items || manifest.items.length === 0) {
+                throw new Error("表示するコンテンツがありません");
             }
-            signageData = data;
-
-            // 取得したデータを元に、スライドのDOM要素を作成
-            createSlideElements();
-            
-            // スライドショーを開始
-            startSlideShow();
+            return prepareAssets(manifest).then(urls => {
+                applyManifest(manifest, urls);
+                startSlideShow();
+            });
         })
         .catch(err => {
             console.error("初期化処理中にエラーが発生しました:", err);
             container.innerHTML = `<p style="color:white; text-align:center;">コンテンツの読み込みに失敗しました。</p>`;
-        });
+        })
+        .finally(() => setInterval(checkVersion, VERSION_CHECK_INTERVAL));
 
 
     // --- 3. 関数定義 ---
 
     /**
-     * APIデータを元に、スライドのDOM要素を作成する
+     * マニフェストを取得する
+     */
+    function fetchManifest() {
+        return fetch('/api/signage_manifest')
+            .then(res => res.json())
+            .then(data => {
+                if (data.error) throw new Error(data.error);
+                return data;
+            });
+    }
+
+    /**
+     * マニフェストの画像をすべて取得し、各スライドに表示するURLの配列を返す
+     */
+    function prepareAssets(manifest) {
+        const openCache = ('caches' in window)
+            ? caches.open(ASSET_CACHE_NAME).catch(() => null)
+            : Promise.resolve(null);
+        return openCache.then(cache => Promise.all(manifest.items.map(item => fetchAsset(cache, item)))
+            .then(urls => {
+                if (cache) pruneCache(cache, manifest);
+                return urls;
+            }));
+    }
+
+    /**
+     * 1枚の画像を取得して blob: URL を返す。
+     * 内容ハッシュ付きの縮小版 (/img/v/...) は内容が変わらないため Cache Storage に保存し、次回からはそこから読む。
+     * 取得できなければ元のURLをそのまま使う (以前と同じくブラウザが直接読み込む)
+     */
+    function fetchAsset(cache, item) {
+        const immutable = item.hash && item.src.startsWith('/img/v/');
+        const cached = (cache && immutable) ? cache.match(item.src) : Promise.resolve(undefined);
+        return cached
+            .then(response => response || fetch(item.src).then(res => {
+                if (!res.ok) throw new Error(`HTTP ${res.status}`);
+                if (cache && immutable) cache.put(item.src, res.clone());
+                return res;
+            }))
+            .then(res => res.blob())
+            .then(blob => URL.createObjectURL(blob))
+            .catch(err => {
+                console.warn(`画像を取得できませんでした (${item.src}):`, err);
+                return item.url;
+            });
+    }
+
+    /**
+     * マニフェストに含まれなくなった画像を Cache Storage から消す
+     */
+    function pruneCache(cache, manifest) {
+        const keep = new Set(manifest.items.map(item => new URL(item.src, location.href).href));
+        cache.keys().then(requests => requests.forEach(req => {
+            if (!keep.has(req.url)) cache.delete(req);
+        }));
+    }
+
+    /**
+     * 準備済みのマニフェストでスライドのDOM要素を作り直す
+     */
+    function applyManifest(manifest, urls) {
+        slideUrls.forEach(url => { if (url.startsWith('blob:')) URL.revokeObjectURL(url); });
+        signageData = manifest;
+        slideUrls = urls;
+        currentIndex = 0;
+        localStorage.setItem(MANIFEST_STORAGE_KEY, JSON.stringify(manifest));
+        createSlideElements();
+    }
+
+    /**
+     * マニフェストを元に、スライドのDOM要素を作成する
      */
     function createSlideElements() {
+        container.innerHTML = '';
         signageData.items.forEach((item, index) => {
             const slideDiv = document.createElement('div');
             slideDiv.id = `slide-${index}`;
             slideDiv.className = 'slide';
-            // 画像のURLを背景として設定
-            slideDiv.style.backgroundImage = `url(${item.url})`;
+            // 手元に保存した画像を背景として設定
+            slideDiv.style.backgroundImage = `url("${slideUrls[index]}")`;
             container.appendChild(slideDiv);
         });
     }
 
+    /**
+     * バージョンを確認し、変わっていれば新しいマニフェストの画像を揃えておく
+     * (揃え終わるまでは今の内容を表示し続ける。通信できない場合も何もしない)
+     */
+    function checkVersion() {
+        if (updating) return;
+        const currentVersion = pendingUpdate ? pendingUpdate.manifest.version : (signageData && signageData.version);
+        updating = true;
+        fetch('/api/signage_version')
+            .then(res => res.json())
+            .then(data => {
+                if (data.error || data.version === currentVersion) return;
+                return fetchManifest().then(manifest => {
+                    if (!manifest.items || manifest.items.length === 0) return;
+                    return prepareAssets(manifest).then(urls => {
+                        pendingUpdate = { manifest: manifest, urls: urls };
+                        // まだ何も表示できていなければすぐに始める
+                        if (!signageData) {
+                            applyPendingUpdate();
+                            startSlideShow();
+                        }
+                    });
+                });
+            })
+            .catch(err => console.warn("サイネージの更新確認に失敗しました:", err))
+            .finally(() => { updating = false; });
+    }
+
+    function applyPendingUpdate() {
+        const update = pendingUpdate;
+        pendingUpdate = null;
+        applyManifest(update.manifest, update.urls);
+    }
+
     /**
      * スライドショーを開始/進行する
      */
     function startSlideShow() {
         // 既存のタイマーがあればクリア
         clearTimeout(slideInterval);
-        
+
         showSlide(currentIndex);
-        
+
         const currentItem = signageData.items[currentIndex];
         if (currentItem) {
             // 表示秒数後に nextSlide を呼び出すタイマーを設定
@@ -80,8 +197,8 @@ document.addEventListener('DOMContentLoaded', () => {
     function showSlide(index) {
         document.querySelectorAll('.slide').forEach((slide, i) => {
             // フェードアニメーションの時間をDBの設定から取得（なければデフォルト1.5s）
-            const fadeDuration = (signageData.settings && signageData.settings.fadeDuration) 
-                ? signageData.settings.fadeDuration 
+            const fadeDuration = (signageData.settings && signageData.settings.fadeDuration)
+                ? signageData.settings.fadeDuration
                 : 1.5;
             slide.style.transition = `opacity ${fadeDuration}s ease-in-out`;
 
@@ -97,6 +214,12 @@ document.addEventListener('DOMContentLoaded', () => {
      * 次のスライドへ進む
      */
     function nextSlide() {
+        // 新しい内容が揃っていれば、ここで切り替えて最初のスライドから表示する
+        if (pendingUpdate) {
+            applyPendingUpdate();
+            startSlideShow();
+            return;
+        }
         // インデックスを次に進める（最後まで行ったら0に戻る）
         currentIndex = (currentIndex + 1) % signageData.items.length;
         startSlideShow();
@@ -119,4 +242,4 @@ document.addEventListener('DOMContentLoaded', () => {
         // fullscreenElementが存在するかどうかで、bodyにクラスを付け外しする
         document.body.classList.toggle('fullscreen', !!document.fullscreenElement);
     });
-});
\ No newline at end of file
+});
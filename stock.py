@@ -0,0 +1,84 @@
+"""
+商品の在庫数 (分散カウンタ)
+在庫数は stock/<ItemID>_<番号> の複数のドキュメント(シャード)に分けて持つ。
+注文はランダムに選んだシャードから在庫を減らすため、複数の注文端末から同時に注文が来ても
+1つのドキュメントへの書き込みが競合して待たされることがない。
+在庫を管理する商品は items/<ItemID> の trackStock が True になっている。
+"""
+
+import os
+import random
+
+STOCK_SHARDS = int(os.environ.get('STOCK_SHARDS', 4))
+
+def shard_ref(db, item_id, index):
+    return db.collection('stock').document(f"{item_id}_{index}")
+
+def split_stock(count, shards=STOCK_SHARDS):
+    """在庫数をシャードに均等に振り分ける"""
+    base, extra = divmod(count, shards)
+    return [base + (1 if index < extra else 0) for index in range(shards)]
+
+def stock_shards(db, item_id, count):
+    """在庫数をシャードに分けて書き込むための [(参照, データ)] を返す"""
+    return [(shard_ref(db, item_id, index), {'itemId': item_id, 'shard': index, 'count': shard_count})
+            for index, shard_count in enumerate(split_stock(count))]
+
+def read_stock_totals(db):
+    """全商品の残り在庫数 {ItemID: 在庫数} を返す"""
+    totals = {}
+    for doc in db.collection('stock').stream():
+        data = doc.to_dict()
+        if data.get('shard', 0) < STOCK_SHARDS:
+            totals[data['itemId']] = totals.get(data['itemId'], 0) + data.get('count', 0)
+    return totals
+
+def stock_demand(order_items, menu):
+    """注文で減らす在庫数 {ItemID: 数量} を返す。セットは選ばれた中身の商品も1個ずつ数える"""
+    demand = {}
+    def add(item, quantity):
+        if item and item.get('trackStock'):
+            demand[item['ItemID']] = demand.get(item['ItemID'], 0) + quantity
+    for line in order_items:
+        add(menu['items_by_id'].get(line['id']), line['quantity'])
+        for name in line.get('selectedItems', []):
+            add(menu['items_by_name'].get(name), 1)
+    return demand
+
+def reserve_stock(transaction, db, demand, menu):
+    """
+    トランザクション内で在庫を確保し、書き込む内容 [(参照, データ)] を返す (呼び出し側が merge=True で書き込む)。
+    Firestoreのトランザクションは読み取りを書き込みより前に済ませる必要があるため、ここでは読み取りだけを行う。
+    在庫が足りなければValueError。在庫が0になる商品は売り切れにする。
+    """
+    writes = []
+    for item_id, quantity in demand.items():
+        indexes = random.sample(range(STOCK_SHARDS), STOCK_SHARDS)
+        counts = {}
+        # 必要な数が揃うまで、ランダムな順にシャードを読む (ほとんどの注文は1つ目で足りる)
+        for index in indexes:
+            doc = shard_ref(db, item_id, index).get(transaction=transaction)
+            counts[index] = doc.to_dict().get('count', 0) if doc.exists else 0
+            if sum(counts.values()) >= quantity:
+                break
+        if sum(counts.values()) < quantity:
+            name = menu['items_by_id'].get(item_id, {}).get('name', item_id)
+            raise ValueError(f"「{name}」の在庫が足りません。")
+
+        remaining = quantity
+        for index in list(counts):
+            taken = min(remaining, counts[index])
+            if taken:
+                counts[index] -= taken
+                remaining -= taken
+                writes.append((shard_ref(db, item_id, index), {'itemId': item_id, 'shard': index, 'count': counts[index]}))
+
+        # 空になったシャードがある場合だけ残りのシャードも読み、全体が0なら売り切れにする
+        if 0 in counts.values():
+            for index in indexes:
+                if index not in counts:
+                    doc = shard_ref(db, item_id, index).get(transaction=transaction)
+                    counts[index] = doc.to_dict().get('count', 0) if doc.exists else 0
+            if sum(counts.values()) == 0:
+                writes.append((db.collection('items').document(item_id), {'isSoldOut': True}))
+    return writes
@@ -0,0 +1,115 @@
+"""
+ストレージの切り替え
+環境変数 STORAGE_BACKEND で、Firestoreへ直接読み書きするか ('firestore' / 既定)、
+ローカルのSQLiteに読み書きしてFirestoreへは後から同期するか ('local') を選ぶ。
+クライアントは最初に使われるときに作る (読み込んだだけでは認証情報を読まず、接続もしない)。
+"""
+
+import os
+import threading
+from functools import wraps
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from local_store import LocalClient, LocalStoreLocked, LocalTransaction, OutboxSyncer
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+LOCAL_DB_PATH = os.environ.get('LOCAL_DB_PATH', 'local_store.sqlite3')
+FIREBASE_KEY_PATH = os.environ.get('FIREBASE_KEY_PATH', 'firebase-key.json')
+# ローカルDBを別のプロセスが使用中のとき、ロックが空くのを待つ秒数 (既定では待たずに止める)
+LOCAL_DB_LOCK_TIMEOUT = float(os.environ.get('LOCAL_DB_LOCK_TIMEOUT', 0))
+
+# ローカルDBが空のときにFirestoreから取り込むコレクション
+HYDRATE_COLLECTIONS = ['orders', 'items', 'users', 'store_settings', 'permissions', 'signage_items',
+                       'tickets', 'counters', 'sales_summary', 'stock', 'order_archives', 'idempotency_keys']
+
+syncer = None
+_client = None
+_client_lock = threading.Lock()
+
+
+class StorageConfigError(RuntimeError):
+    """ストレージの設定(鍵ファイル・バックエンド名)が正しくない"""
+
+def init_firebase():
+    """firebase-key.json でFirebaseを初期化する。鍵が無ければFalse"""
+    try:
+        cred = credentials.Certificate(FIREBASE_KEY_PATH)
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(cred)
+        return True
+    except FileNotFoundError:
+        return False
+
+def create_client(backend=STORAGE_BACKEND, local_path=LOCAL_DB_PATH):
+    """設定されたバックエンドのクライアントを返す"""
+    global syncer
+    if backend == 'firestore':
+        if not init_firebase():
+            raise StorageConfigError(f"'{FIREBASE_KEY_PATH}' not found. "
+                                     "Please download the service account key from Firebase console.")
+        return firestore.client()
+
+    if backend != 'local':
+        raise StorageConfigError(f"Unknown STORAGE_BACKEND: {backend}")
+    client = LocalClient(local_path, lock_timeout=LOCAL_DB_LOCK_TIMEOUT)
+    if not init_firebase():
+        print(f"WARNING: '{FIREBASE_KEY_PATH}' not found. Running on local storage without Firestore sync.")
+        return client
+    remote = firestore.client()
+    if client.is_empty():
+        hydrate(client, remote)
+    syncer = OutboxSyncer(client, remote)
+    syncer.start()
+    return client
+
+def check_config(backend=STORAGE_BACKEND):
+    """クライアントを作らずに設定だけを確かめる (forkする前のプロセスで接続を作らないため)"""
+    if backend not in ('firestore', 'local'):
+        raise StorageConfigError(f"Unknown STORAGE_BACKEND: {backend}")
+    if backend == 'firestore' and not os.path.exists(FIREBASE_KEY_PATH):
+        raise StorageConfigError(f"'{FIREBASE_KEY_PATH}' not found. "
+                                 "Please download the service account key from Firebase console.")
+
+def get_client():
+    """ストレージのクライアントを返す。最初に呼ばれたときに作る"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+def set_client(client):
+    """使うクライアントを差し替える (テストで認証情報なしに動かす場合など)"""
+    global _client
+    with _client_lock:
+        _client = client
+
+def hydrate(local, remote, collections=HYDRATE_COLLECTIONS):
+    """Firestoreの内容をローカルDBに取り込む (初回起動時)"""
+    try:
+        # 日別の注文アーカイブ (order_archives に一覧がある) も合わせて取り込む
+        collections = list(collections) + [doc.to_dict()['collection'] for doc in remote.collection('order_archives').stream()
+                                            if doc.to_dict().get('collection')]
+        for name in collections:
+            local.import_documents(name, [(doc.id, doc.to_dict()) for doc in remote.collection(name).stream()])
+        print(f"Loaded {', '.join(collections)} from Firestore into local storage.")
+    except Exception as e:
+        print(f"WARNING: Could not load data from Firestore, starting with empty local storage: {e}")
+
+def sync_status():
+    if syncer is None:
+        return {'backend': STORAGE_BACKEND, 'syncEnabled': False}
+    return dict(syncer.status(), backend=STORAGE_BACKEND, syncEnabled=True)
+
+def transactional(fn):
+    """firestore.transactional のバックエンド共通版"""
+    firestore_transactional = firestore.transactional(fn)
+    @wraps(fn)
+    def wrapper(transaction, *args, **kwargs):
+        if isinstance(transaction, LocalTransaction):
+            return transaction.run(fn, *args, **kwargs)
+        return firestore_transactional(transaction, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,88 @@
+"""
+テスト共通の準備
+Firestoreの認証情報なしで動かすため、ローカルバックエンド (LocalClient) をテストごとに一時ファイルで作り、
+create_app(client=...) で差し替える。app はモジュールの読み込み時に設定を読むため、環境変数は先に設定する
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+_TMP = tempfile.mkdtemp(prefix='festival-tests-')
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+os.environ.setdefault('LOCAL_DB_PATH', os.path.join(_TMP, 'unused.sqlite3'))
+os.environ.setdefault('ANALYTICS_DIR', os.path.join(_TMP, 'analytics'))
+os.environ.setdefault('IMAGE_CACHE_DIR', os.path.join(_TMP, 'image_cache'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+from local_store import LocalClient
+
+
+@pytest.fixture
+def store(tmp_path):
+    client = LocalClient(str(tmp_path / 'db.sqlite3'))
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def appmod(store, monkeypatch):
+    """一時DBにつないだ app モジュール。プロセス内のキャッシュや監視はテストごとに作り直す"""
+    app_module.create_app(config={'TESTING': True}, client=store)
+    monkeypatch.setattr(app_module, 'doc_cache', app_module.DocumentCache(app_module.CACHE_TTL_SECONDS))
+    monkeypatch.setattr(app_module, 'wait_time_estimator', app_module.WaitTimeEstimator())
+    monkeypatch.setattr(app_module, '_wait_time_cache', None)
+    app_module.invalidate_menu_snapshot()
+    yield app_module
+    # 次のテストの監視は新しいDBで作り直させる
+    watches = [app_module._menu_watch] + [feed._watch for feed in app_module.order_feeds.values()]
+    for watch in watches:
+        if watch is not None:
+            watch.unsubscribe()
+    app_module.invalidate_menu_snapshot()
+
+
+def add_user(db, username, role, password='pw'):
+    db.collection('users').document(username).set(
+        {'username': username, 'passwordHash': generate_password_hash(password), 'role': role})
+
+
+@pytest.fixture
+def login(appmod):
+    """ユーザーを作り、ログイン済みのテストクライアントを返す"""
+    def _login(role='superadmin', username=None):
+        username = username or role
+        add_user(appmod.db, username, role)
+        client = appmod.app.test_client()
+        response = client.post('/login', data={'username': username, 'password': 'pw'})
+        assert response.status_code == 302
+        return client
+    return _login
+
+
+def add_item(db, item_id, **fields):
+    data = {'name': item_id, 'price': 100, 'category': 'フード', 'isSoldOut': False}
+    data.update(fields)
+    db.collection('items').document(item_id).set(data)
+
+
+def place_order(client, item_id, quantity=1, key=None):
+    """注文して (orderId, ticketNumber) を返す"""
+    headers = {'Idempotency-Key': key} if key else {}
+    response = client.post('/order', json=[{'id': item_id, 'quantity': quantity}], headers=headers)
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    return body['orderId'], body['ticketNumber']
+
+
+def wait_until(condition, timeout=5):
+    """監視のコールバックは別スレッドで届くため、条件を満たすまで待つ"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
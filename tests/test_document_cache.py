@@ -0,0 +1,51 @@
+from conftest import add_user
+
+
+def test_reads_are_cached_until_invalidated(appmod):
+    cache = appmod.DocumentCache(ttl=60)
+    appmod.db.collection('store_settings').document('main').set({'storeName': 'A'})
+    assert cache.get('store_settings', 'main') == {'storeName': 'A'}
+    appmod.db.collection('store_settings').document('main').set({'storeName': 'B'})
+    assert cache.get('store_settings', 'main') == {'storeName': 'A'}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.invalidate('store_settings', 'main')
+    assert cache.get('store_settings', 'main') == {'storeName': 'B'}
+
+
+def test_entries_are_bounded(appmod):
+    cache = appmod.DocumentCache(ttl=60, max_entries=2)
+    for name in ('a', 'b', 'c'):
+        cache.get('users', name)
+    assert cache.stats()['entries'] == 2
+    cache.get('users', 'a')  # 一番古い a は捨てられている
+    assert cache.misses == 4
+
+
+def test_missing_users_are_not_cached_on_login(appmod):
+    cache = appmod.DocumentCache(ttl=60)
+    assert cache.get('users', 'nobody', cache_missing=False) is None
+    assert cache.stats()['entries'] == 0
+    add_user(appmod.db, 'nobody', 'kitchen')
+    assert cache.get('users', 'nobody', cache_missing=False)['role'] == 'kitchen'
+
+
+def test_loads_racing_an_invalidation_are_not_cached(appmod, monkeypatch):
+    cache = appmod.DocumentCache(ttl=60)
+    ref = appmod.db.collection('permissions').document('role_access')
+    ref.set({'kitchen': ['kitchen']})
+    real_get = type(ref).get
+    def get_then_invalidate(self, *args, **kwargs):
+        snapshot = real_get(self, *args, **kwargs)
+        cache.invalidate('permissions', 'role_access')  # 読み込み中に更新された
+        return snapshot
+    monkeypatch.setattr(type(ref), 'get', get_then_invalidate)
+    cache.get('permissions', 'role_access')
+    assert cache.stats()['entries'] == 0
+
+
+def test_login_and_role_checks(appmod, login):
+    kitchen = login('kitchen')
+    assert kitchen.get('/api/get_items').status_code == 403
+    client = appmod.app.test_client()
+    response = client.post('/login', data={'username': 'kitchen', 'password': 'wrong'})
+    assert response.status_code == 200  # ログイン画面をもう一度表示する
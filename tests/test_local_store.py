@@ -0,0 +1,67 @@
+import pytest
+from google.cloud.firestore_v1 import transforms
+
+from local_store import LocalClient, LocalStoreLocked
+from conftest import wait_until
+
+
+def test_set_update_and_transforms(store):
+    ref = store.collection('counters').document('main')
+    ref.set({'count': 1, 'tags': ['a'], 'nested': {'x': 1}, 'old': True})
+    ref.update({'count': transforms.Increment(2), 'tags': transforms.ArrayUnion(['a', 'b']),
+                'nested.y': 2, 'old': transforms.DELETE_FIELD})
+    ref.set({'nested': {'x': transforms.Increment(10)}}, merge=True)
+    assert ref.get().to_dict() == {'count': 3, 'tags': ['a', 'b'], 'nested': {'x': 11, 'y': 2}}
+    assert not store.collection('counters').document('missing').get().exists
+
+
+def test_queries_filter_sort_and_page(store):
+    for index in range(5):
+        store.collection('orders').document(f'o{index}').set({'n': index, 'status': '調理中' if index % 2 else '完了'})
+    query = store.collection('orders').where('status', '==', '調理中').order_by('n')
+    assert [doc.id for doc in query.stream()] == ['o1', 'o3']
+    first = list(store.collection('orders').order_by('n').limit(2).stream())
+    rest = store.collection('orders').order_by('n').start_after(first[-1]).stream()
+    assert [doc.id for doc in rest] == ['o2', 'o3', 'o4']
+
+
+def test_transaction_and_batch_are_applied_together(store):
+    ref = store.collection('counters').document('tickets')
+    def bump(transaction):
+        doc = ref.get(transaction=transaction)
+        transaction.set(ref, {'next': (doc.to_dict()['next'] if doc.exists else 1) + 1})
+    store.transaction().run(bump)
+    store.transaction().run(bump)
+    assert ref.get().to_dict() == {'next': 3}
+    batch = store.batch()
+    batch.set(store.collection('items').document('a'), {'name': 'A'})
+    batch.delete(ref)
+    batch.commit()
+    assert not ref.get().exists
+    assert store.collection('items').document('a').get().exists
+
+
+def test_on_snapshot_delivers_changes(store):
+    received = []
+    watch = store.collection('orders').where('status', '==', '調理中').on_snapshot(
+        lambda docs, changes, read_time: received.append([(change.type.name, change.document.id) for change in changes]))
+    wait_until(lambda: received == [[]])
+    store.collection('orders').document('a').set({'status': '調理中'})
+    wait_until(lambda: received[-1] == [('ADDED', 'a')])
+    store.collection('orders').document('a').update({'status': '提供可能'})
+    wait_until(lambda: received[-1] == [('REMOVED', 'a')])
+    watch.unsubscribe()
+    store.collection('orders').document('b').set({'status': '調理中'})
+    assert len(received) == 3
+
+
+def test_data_persists_and_the_file_is_locked(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    client = LocalClient(path)
+    client.collection('items').document('a').set({'name': 'A'})
+    with pytest.raises(LocalStoreLocked):
+        LocalClient(path)
+    client.close()
+    reopened = LocalClient(path)
+    assert reopened.collection('items').document('a').get().to_dict() == {'name': 'A'}
+    reopened.close()
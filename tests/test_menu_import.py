@@ -0,0 +1,67 @@
+import pytest
+
+from menu_import import sync_menu_items
+from stock import STOCK_SHARDS, read_stock_totals
+
+
+def item(name, stock=None, **fields):
+    data = {'name': name, 'price': 100, 'category': 'フード', 'imageUrl': '', 'description': '', 'isSoldOut': False,
+            'allergens': [], 'isSet': False, 'setCount': 0, 'setItems': [], 'trackStock': stock is not None, 'stock': stock}
+    data.update(fields)
+    return data
+
+
+def sync(db, items, **kwargs):
+    return sync_menu_items(db, items, log=lambda message: None, **kwargs)
+
+
+def test_only_changed_stock_shards_are_written(store):
+    first = sync(store, {'a': item('A', stock=8), 'b': item('B', stock=4)})
+    assert first['stockShardsWritten'] == 2 * STOCK_SHARDS
+    assert read_stock_totals(store) == {'a': 8, 'b': 4}
+
+    again = sync(store, {'a': item('A', stock=8), 'b': item('B', stock=4)})
+    assert (again['added'], again['updated'], again['stockShardsWritten'], again['stockShardsDeleted']) == (0, 0, 0, 0)
+
+    # 4個を4シャードに分けると各1個なので、5個にすると1つのシャードだけが変わる
+    changed = sync(store, {'a': item('A', stock=8), 'b': item('B', stock=5)})
+    assert changed['stockShardsWritten'] == 1
+    assert read_stock_totals(store) == {'a': 8, 'b': 5}
+
+
+def test_pruned_and_untracked_items_lose_their_shards(store):
+    sync(store, {'a': item('A', stock=8), 'b': item('B', stock=4), 'c': item('C', stock=2)})
+    summary = sync(store, {'a': item('A', stock=8), 'b': item('B')})
+    assert summary['deleted'] == 1
+    assert summary['stockShardsDeleted'] == 2 * STOCK_SHARDS
+    assert {doc.to_dict()['itemId'] for doc in store.collection('stock').stream()} == {'a'}
+
+
+def test_items_missing_from_a_partial_import_keep_their_shards(store):
+    sync(store, {'a': item('A', stock=8), 'b': item('B', stock=4)})
+    summary = sync(store, {'a': item('A', stock=8)}, prune=False)
+    assert summary['stockShardsDeleted'] == 0
+    assert read_stock_totals(store) == {'a': 8, 'b': 4}
+
+
+def test_large_imports_write_shards_before_items(store, monkeypatch):
+    """バッチが分かれて途中で失敗しても、在庫を管理する商品にシャードが無い状態にはならない"""
+    import menu_import
+    monkeypatch.setattr(menu_import, 'FIRESTORE_BATCH_LIMIT', STOCK_SHARDS * 2)
+    commits = []
+    real_batch = store.batch
+    def failing_batch():
+        batch = real_batch()
+        real_commit = batch.commit
+        def commit():
+            if len(commits) == 1:
+                raise RuntimeError('batch failed')
+            commits.append(True)
+            return real_commit()
+        batch.commit = commit
+        return batch
+    monkeypatch.setattr(store, 'batch', failing_batch)
+    with pytest.raises(RuntimeError):
+        sync(store, {'a': item('A', stock=8), 'b': item('B', stock=4)})
+    assert read_stock_totals(store) == {'a': 8, 'b': 4}
+    assert not list(store.collection('items').stream())
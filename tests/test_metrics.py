@@ -0,0 +1,45 @@
+import pytest
+from flask import Flask
+
+import metrics as metrics_module
+
+
+@pytest.fixture
+def metrics_app(monkeypatch):
+    monkeypatch.setattr(metrics_module, 'metrics', metrics_module.Metrics())
+    app = Flask(__name__)
+    metrics_module.init_app(app)
+
+    @app.route('/ok')
+    def ok():
+        return 'ok'
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    return app
+
+
+def statuses(route):
+    return dict(metrics_module.metrics.routes[('GET', route)].statuses)
+
+
+def test_responses_are_counted_by_status(metrics_app):
+    client = metrics_app.test_client()
+    client.get('/ok')
+    client.get('/missing')
+    assert statuses('/ok') == {200: 1}
+    assert statuses('(unmatched)') == {404: 1}
+
+
+@pytest.mark.parametrize('propagate', [False, True])
+def test_unhandled_exceptions_are_counted_as_500(metrics_app, propagate):
+    metrics_app.config['PROPAGATE_EXCEPTIONS'] = propagate
+    client = metrics_app.test_client()
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get('/boom')
+    else:
+        assert client.get('/boom').status_code == 500
+    assert statuses('/boom') == {500: 1}
@@ -0,0 +1,80 @@
+import json
+
+from conftest import add_item, place_order, wait_until
+
+
+def read_event(stream):
+    """SSEの本文から、コメント・retry 以外のイベントを1つ読んで (種類, データ) を返す"""
+    while True:
+        chunk = next(stream)
+        if chunk.startswith('id:'):
+            lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+            return lines['event'], json.loads(lines['data'])
+
+
+def test_feed_streams_reset_then_changes(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    first_id, _ = place_order(client, 'yakisoba')
+    feed = appmod.order_feeds['調理中']
+    stream = feed.stream()
+    event, data = read_event(stream)
+    assert event == 'reset'
+    assert [entry['id'] for entry in data['orders']] == [first_id]
+
+    second_id, _ = place_order(client, 'yakisoba', quantity=2)
+    event, data = read_event(stream)
+    assert event == 'changes'
+    assert [(change['type'], change['id']) for change in data['changes']] == [('added', second_id)]
+
+
+def test_restarted_feed_resyncs_orders_prep_board_and_subscribers(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', category='鉄板')
+    kept_id, _ = place_order(client, 'yakisoba', quantity=2)
+    gone_id, _ = place_order(client, 'yakisoba', quantity=3)
+    feed = appmod.order_feeds['調理中']
+    stream = feed.stream()
+    assert read_event(stream)[0] == 'reset'
+    wait_until(lambda: appmod.prep_board.snapshot('鉄板')[0] == {'yakisoba': 5})
+
+    # 監視が止まっている間に1件が提供可能になる (この変更はフィードに届かない)
+    feed._watch.unsubscribe()
+    client.post('/api/update_order_status', json={'docId': gone_id, 'status': '提供可能'})
+    assert not feed.is_ready()
+
+    feed.ensure_started()
+    assert feed.is_ready()
+    assert set(feed.orders) == {kept_id}
+    assert appmod.prep_board.snapshot('鉄板')[:2] == ({'yakisoba': 2}, 1)
+    # 購読中の画面は続きを受け取れないため、全件を受け取り直す
+    event, data = read_event(stream)
+    assert event == 'reset'
+    assert [entry['id'] for entry in data['orders']] == [kept_id]
+
+
+def test_feed_streams_are_capped(appmod, login, monkeypatch):
+    client = login()
+    monkeypatch.setattr(appmod, '_feed_streams', appmod.threading.BoundedSemaphore(1))
+    first = client.get('/api/order_feed?status=調理中')
+    assert first.status_code == 200
+
+    rejected = client.get('/api/order_feed?status=提供可能')
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == str(appmod.FEED_RETRY_SECONDS)
+
+    # 画面が切断すると枠が空く
+    first.close()
+    second = client.get('/api/order_feed?status=提供可能')
+    assert second.status_code == 200
+    second.close()
+
+
+def test_prep_feed_rejects_unknown_stations(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', category='鉄板')
+    assert client.get('/api/prep_feed?station=存在しない').status_code == 400
+    assert client.get('/api/prep_feed').status_code == 400
+    response = client.get('/api/prep_feed?station=鉄板')
+    assert response.status_code == 200
+    response.close()
@@ -0,0 +1,57 @@
+from conftest import add_item, place_order
+
+
+def test_repeated_complete_after_archive_is_unchanged(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    order_id, _ = place_order(client, 'yakisoba')
+    assert client.post('/api/update_payment_status', json={'docId': order_id}).status_code == 200
+    first = client.post('/api/update_order_status', json={'docId': order_id, 'status': '完了'})
+    assert first.get_json() == {'success': True}
+    assert not appmod.db.collection('orders').document(order_id).get().exists
+
+    # 二重送信: 注文はアーカイブへ移っているが、既に完了しているので成功として扱う
+    again = client.post('/api/update_order_status', json={'docId': order_id, 'status': '完了'})
+    assert again.status_code == 200
+    assert again.get_json() == {'success': True, 'unchanged': True}
+    paid_again = client.post('/api/update_payment_status', json={'docId': order_id})
+    assert paid_again.get_json() == {'success': True, 'unchanged': True}
+
+
+def test_unknown_order_is_not_found(appmod, login):
+    client = login()
+    response = client.post('/api/update_order_status', json={'docId': 'missing', 'status': '完了'})
+    assert response.status_code == 404
+    assert client.post('/api/update_payment_status', json={'docId': 'missing'}).status_code == 404
+
+
+def test_bulk_transitions_and_repeat_after_archive(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    order_ids = [place_order(client, 'yakisoba')[0] for _ in range(3)]
+
+    response = client.post('/api/bulk_update_order_status', json={'docIds': order_ids, 'paymentStatus': '会計済'})
+    assert response.get_json() == {'success': True, 'updated': 3, 'unchanged': 0, 'archived': 0}
+    response = client.post('/api/bulk_update_order_status', json={'docIds': order_ids, 'status': '提供可能'})
+    assert response.get_json()['updated'] == 3
+    response = client.post('/api/bulk_update_order_status', json={'docIds': order_ids[:2], 'status': '完了'})
+    assert response.get_json() == {'success': True, 'updated': 2, 'unchanged': 0, 'archived': 2}
+
+    # 二重送信: アーカイブ済みの2件は変更済みとして数え、残りの1件だけを変更する
+    response = client.post('/api/bulk_update_order_status', json={'docIds': order_ids, 'status': '完了'})
+    assert response.get_json() == {'success': True, 'updated': 1, 'unchanged': 2, 'archived': 1}
+    released = [doc.to_dict().get('archive') for doc in appmod.db.collection('tickets').stream()]
+    assert all(released)
+
+
+def test_bulk_rejects_invalid_transition_without_writing(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    ready_id = place_order(client, 'yakisoba')[0]
+    cooking_id = place_order(client, 'yakisoba')[0]
+    client.post('/api/update_order_status', json={'docId': ready_id, 'status': '提供可能'})
+
+    response = client.post('/api/bulk_update_order_status', json={'docIds': [ready_id, cooking_id, 'missing'], 'status': '完了'})
+    assert response.status_code == 400
+    assert '見つかりません' in response.get_json()['error']
+    assert appmod.db.collection('orders').document(ready_id).get().to_dict()['status'] == '提供可能'
@@ -0,0 +1,79 @@
+from conftest import add_item, place_order
+
+
+def ticket_index(appmod, ticket_number):
+    doc = appmod.db.collection('tickets').document(ticket_number).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def test_tickets_are_allocated_in_order_and_indexed(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    orders = [place_order(client, 'yakisoba') for _ in range(3)]
+    assert [ticket for _, ticket in orders] == ['0001', '0002', '0003']
+    assert ticket_index(appmod, '0002')['orderId'] == orders[1][0]
+    body = client.get('/api/get_order_by_ticket?ticket=2').get_json()
+    assert body['docId'] == orders[1][0]
+
+
+def test_ticket_numbers_wrap_and_skip_unreleased_tickets(appmod, login, monkeypatch):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    monkeypatch.setattr(appmod, 'TICKET_MAX', 3)
+    first_id, _ = place_order(client, 'yakisoba')
+    place_order(client, 'yakisoba')
+    place_order(client, 'yakisoba')
+    # 0001 だけ受け渡しを完了して番号を解放する
+    client.post('/api/update_order_status', json={'docId': first_id, 'status': '完了'})
+    assert ticket_index(appmod, '0001')['released'] is True
+    assert place_order(client, 'yakisoba')[1] == '0001'
+    response = client.post('/order', json=[{'id': 'yakisoba', 'quantity': 1}])
+    assert response.status_code == 500
+    assert '空いている整理券番号がありません' in response.get_json()['error']
+
+
+def test_stock_is_reserved_and_items_sell_out(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', trackStock=True)
+    for ref, data in appmod.stock_shards(appmod.db, 'yakisoba', 3):
+        ref.set(data)
+    place_order(client, 'yakisoba', quantity=2)
+    assert appmod.read_stock_totals(appmod.db) == {'yakisoba': 1}
+
+    response = client.post('/order', json=[{'id': 'yakisoba', 'quantity': 2}])
+    assert response.status_code == 400
+    assert '在庫が足りません' in response.get_json()['error']
+    assert appmod.read_stock_totals(appmod.db) == {'yakisoba': 1}
+
+    place_order(client, 'yakisoba')
+    assert appmod.read_stock_totals(appmod.db) == {'yakisoba': 0}
+    assert appmod.db.collection('items').document('yakisoba').get().to_dict()['isSoldOut'] is True
+
+
+def test_prices_come_from_the_menu(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300)
+    response = client.post('/order', json=[{'id': 'yakisoba', 'quantity': 2, 'price': 1}])
+    order = appmod.db.collection('orders').document(response.get_json()['orderId']).get().to_dict()
+    assert order['totalPrice'] == 600
+    assert client.post('/order', json=[{'id': 'unknown', 'quantity': 1}]).status_code == 400
+    assert client.post('/order', json=[{'id': 'yakisoba', 'quantity': 0}]).status_code == 400
+
+
+def test_idempotent_retries_return_the_first_order(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300, trackStock=True)
+    for ref, data in appmod.stock_shards(appmod.db, 'yakisoba', 10):
+        ref.set(data)
+    key = 'retry-key-0123456789'
+    first = place_order(client, 'yakisoba', key=key)
+    response = client.post('/order', json=[{'id': 'yakisoba', 'quantity': 1}], headers={'Idempotency-Key': key})
+    body = response.get_json()
+    assert (body['orderId'], body['ticketNumber'], body['replayed']) == (first[0], first[1], True)
+    assert len(list(appmod.db.collection('orders').stream())) == 1
+    assert appmod.read_stock_totals(appmod.db) == {'yakisoba': 9}
+    assert appmod.read_sales_summary()['totalOrders'] == 1
+
+    conflict = client.post('/order', json=[{'id': 'yakisoba', 'quantity': 2}], headers={'Idempotency-Key': key})
+    assert conflict.status_code == 409
+    assert client.post('/order', json=[{'id': 'yakisoba', 'quantity': 1}], headers={'Idempotency-Key': 'short'}).status_code == 400
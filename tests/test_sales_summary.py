@@ -0,0 +1,82 @@
+from conftest import add_item, place_order
+
+
+def totals(appmod):
+    summary = appmod.read_sales_summary()
+    return summary['totalOrders'], summary['totalRevenue']
+
+
+def test_orders_are_counted_from_the_shards(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300)
+    place_order(client, 'yakisoba', quantity=2)
+    place_order(client, 'yakisoba')
+    summary = appmod.read_sales_summary()
+    assert (summary['totalOrders'], summary['totalRevenue']) == (2, 900)
+    assert summary['salesByItem'] == {'yakisoba': 3}
+    assert summary['rebuildRequired'] is False
+    assert client.get('/api/get_sales_data').get_json()['rebuild_required'] is False
+
+
+def test_rebuild_repairs_old_orders_and_ignores_late_increments(appmod, login, monkeypatch):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300)
+    now_bucket = appmod.sales_bucket()
+    real_sales_bucket = appmod.sales_bucket
+    monkeypatch.setattr(appmod, 'sales_bucket', lambda timestamp=None: now_bucket - 5 if timestamp is None else real_sales_bucket(timestamp))
+    lost_increments = []
+    monkeypatch.setattr(appmod, 'record_sales', lambda bucket, update: lost_increments.append((bucket, update)))
+    place_order(client, 'yakisoba')  # 加算に失敗した (少し前の) 注文
+    monkeypatch.undo()
+    place_order(client, 'yakisoba')
+    assert totals(appmod) == (1, 300)
+
+    summary = appmod.rebuild_sales_summary()
+    assert summary['cutoffBucket'] <= now_bucket
+    assert totals(appmod) == (2, 600)
+    # 再構築の後に遅れて届いた、読み直しで数えた注文の加算は無視される
+    appmod.record_sales(*lost_increments[0])
+    assert totals(appmod) == (2, 600)
+    place_order(client, 'yakisoba')
+    assert totals(appmod) == (3, 900)
+
+
+def test_orders_placed_during_a_rebuild_are_counted_once(appmod, login, monkeypatch):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300)
+    old_bucket = appmod.sales_bucket() - 5
+    real_sales_bucket = appmod.sales_bucket
+    monkeypatch.setattr(appmod, 'sales_bucket', lambda timestamp=None: old_bucket if timestamp is None else real_sales_bucket(timestamp))
+    place_order(client, 'yakisoba')  # 読み直しで数える注文
+    monkeypatch.setattr(appmod, 'sales_bucket', real_sales_bucket)
+    real_iter = appmod.iter_all_orders
+    def iter_with_new_order(db):
+        for index, doc in enumerate(real_iter(db)):
+            if index == 0:
+                place_order(client, 'yakisoba')  # 読み直しの途中に届いた注文
+            yield doc
+    monkeypatch.setattr(appmod, 'iter_all_orders', iter_with_new_order)
+    appmod.rebuild_sales_summary()
+    assert totals(appmod) == (2, 600)
+    assert appmod.db.collection('sales_summary').document('main').get().to_dict()['totalOrders'] == 1
+
+
+def test_legacy_summary_is_flagged_but_not_rebuilt_on_read(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba', price=300)
+    appmod.db.collection('orders').document('legacy').set(
+        {'ticketNumber': '0000', 'items': [{'name': 'yakisoba', 'price': 300, 'quantity': 1}], 'totalPrice': 300,
+         'status': '完了', 'paymentStatus': '会計済'})
+    summary_ref = appmod.db.collection('sales_summary')
+    summary_ref.document('main').set({'totalRevenue': 300, 'totalOrders': 1, 'salesByItem': {'yakisoba': 1}, 'salesByCategory': {}})
+    summary_ref.document('shard-0').set({'totalRevenue': 300, 'totalOrders': 1})
+
+    data = client.get('/api/get_sales_data').get_json()
+    assert data['rebuild_required'] is True
+    assert (data['total_orders'], data['total_revenue']) == (2, 600)
+    assert 'cutoffBucket' not in summary_ref.document('main').get().to_dict()
+
+    assert client.post('/api/rebuild_sales_summary').get_json()['success']
+    summary = appmod.read_sales_summary()
+    assert (summary['totalOrders'], summary['rebuildRequired']) == (1, False)
+    assert 'totalRevenue' not in summary_ref.document('shard-0').get().to_dict()
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1', '0001'), ('0042', '0042'), (' 9999 ', '9999'), (7, '0007'),
+    ('0', '0000'), ('0000', '0000'), (0, '0000'),
+    ('10000', None), ('-1', None), ('12a', None), ('', None), (None, None),
+])
+def test_normalize_ticket_number(appmod, value, expected):
+    assert appmod.normalize_ticket_number(value) == expected
+
+
+def test_legacy_ticket_0000_can_be_looked_up(appmod):
+    # 以前の発行方式では 0000 も出ていた (索引 tickets/0000 は無い)
+    appmod.db.collection('orders').document('legacy').set(
+        {'ticketNumber': '0000', 'items': [], 'totalPrice': 0, 'status': '調理中', 'paymentStatus': '未会計'})
+    response = appmod.app.test_client().get('/api/get_order_by_ticket?ticket=0')
+    assert response.status_code == 200
+    assert response.get_json()['docId'] == 'legacy'
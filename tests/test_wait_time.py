@@ -0,0 +1,44 @@
+from conftest import add_item, place_order, wait_until
+
+
+def start_feeds(appmod):
+    for feed in appmod.order_feeds.values():
+        feed.ensure_started()
+
+
+def test_wait_time_is_unavailable_until_feeds_start(appmod):
+    response = appmod.app.test_client().get('/api/wait_time')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_order_status_follows_the_feeds_not_the_cache(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    start_feeds(appmod)
+    # 見積もりを使い回す状態にしておく (この時点では注文が無い)
+    assert client.get('/api/wait_time').get_json()['queueLength'] == 0
+
+    order_id, _ = place_order(client, 'yakisoba')
+    wait_until(lambda: appmod.order_feeds['調理中'].get(order_id) is not None)
+    body = client.get(f'/api/wait_time?order_id={order_id}').get_json()
+    assert body['orderStatus'] == 'cooking'
+    assert body['order']['position'] == 1
+
+    client.post('/api/update_order_status', json={'docId': order_id, 'status': '提供可能'})
+    wait_until(lambda: appmod.order_feeds['提供可能'].get(order_id) is not None)
+    body = client.get(f'/api/wait_time?order_id={order_id}').get_json()
+    assert body['orderStatus'] == 'ready'
+    assert body['order'] is None
+
+
+def test_order_missing_from_feeds_uses_the_stored_status(appmod, login):
+    client = login()
+    add_item(appmod.db, 'yakisoba')
+    order_id, _ = place_order(client, 'yakisoba')
+    # フィードに届く前の注文 (見積もりにも提供可能の一覧にも無い) は、まだできあがっていない
+    assert appmod.order_wait_status(order_id, {'orders': {}}) == 'pending'
+    client.post('/api/update_payment_status', json={'docId': order_id})
+    client.post('/api/update_order_status', json={'docId': order_id, 'status': '完了'})
+    assert appmod.order_wait_status(order_id, {'orders': {}}) == 'ready'
+    assert appmod.order_wait_status('missing', {'orders': {}}) == 'unknown'
@@ -0,0 +1,125 @@
+"""
+待ち時間の見積もり
+注文が 提供可能 になった時刻 (readyAt) から直近の厨房の処理の速さを学習し、
+調理中の注文それぞれの提供予定時刻と、今から注文した場合の待ち時間を見積もる。
+
+- 前の注文が提供可能になってから(または注文されてから)この注文が提供可能になるまでを、その注文の調理時間とみなす。
+  まとめて作って一度に提供可能にした注文は調理時間がほぼ0になるため、並行して作る分も自然に反映される。
+- 調理時間を注文に含まれる商品の個数で割り振り、商品ごとの「1個あたりの調理時間」を指数移動平均(EWMA)で持つ。
+  セットは選ばれた中身の商品として数える。
+- 学習は注文ステータスの変更フィードの差分から行うため、Firestoreへの読み取りは増えない。
+"""
+
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from order_lines import item_units
+
+WINDOW_SECONDS = int(os.environ.get('WAIT_TIME_WINDOW_SECONDS', 30 * 60))
+EWMA_ALPHA = 0.3
+DEFAULT_UNIT_SECONDS = float(os.environ.get('WAIT_TIME_DEFAULT_UNIT_SECONDS', 60))
+# 厨房が暇だった時間などを調理時間として学習しないよう、1注文の調理時間の上限を決めておく
+MAX_SERVICE_SECONDS = 15 * 60
+SEEN_ORDERS_LIMIT = 5000
+
+
+class WaitTimeEstimator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.unit_seconds = {}             # ItemID -> 1個あたりの調理時間(秒)のEWMA
+        self.overall_unit_seconds = None   # 商品を問わない1個あたりの調理時間のEWMA
+        self.mean_units = None             # 1注文あたりの商品の個数のEWMA
+        self.ready_times = deque()         # 直近に提供可能になった時刻 (処理件数の計算用)
+        self.last_ready_at = None
+        self.samples = 0
+        self._seen = OrderedDict()
+
+    # --- 学習 ---
+    def observe_ready(self, orders):
+        """提供可能になった注文 [(注文ID, フィードの注文データ)] を学習する"""
+        entries = sorted(((order_id, order) for order_id, order in orders if order.get('readyAtMs')),
+                         key=lambda entry: entry[1]['readyAtMs'])
+        with self._lock:
+            for order_id, order in entries:
+                if order_id in self._seen:
+                    continue
+                self._seen[order_id] = True
+                if len(self._seen) > SEEN_ORDERS_LIMIT:
+                    self._seen.popitem(last=False)
+                self._observe(order)
+
+    def _observe(self, order):
+        ready_at = order['readyAtMs'] / 1000
+        created_at = order.get('createdAtMs', 0) / 1000 or ready_at
+        started = max(created_at, self.last_ready_at or created_at)
+        service = min(max(ready_at - started, 0.0), MAX_SERVICE_SECONDS)
+        self.last_ready_at = max(self.last_ready_at or 0, ready_at)
+        self.ready_times.append(ready_at)
+
+        units = item_units(order)
+        total_units = sum(units.values())
+        if not total_units:
+            return
+        self.samples += 1
+        self.mean_units = _ewma(self.mean_units, total_units)
+        self.overall_unit_seconds = _ewma(self.overall_unit_seconds, service / total_units)
+        # 調理時間を、今の見積もりの比率で商品ごとに割り振ってから平均に取り込む
+        expected = {item_id: self.unit_seconds.get(item_id, self.overall_unit_seconds) for item_id in units}
+        expected_total = sum(expected[item_id] * quantity for item_id, quantity in units.items())
+        scale = service / expected_total if expected_total else 0.0
+        for item_id in units:
+            self.unit_seconds[item_id] = _ewma(self.unit_seconds.get(item_id), expected[item_id] * scale)
+
+    # --- 見積もり ---
+    def throughput_per_minute(self, now):
+        with self._lock:
+            while self.ready_times and self.ready_times[0] < now - WINDOW_SECONDS:
+                self.ready_times.popleft()
+            return len(self.ready_times) * 60 / WINDOW_SECONDS
+
+    def order_seconds(self, order):
+        """1件の注文を作るのにかかる時間(秒)の見積もり"""
+        default = self.overall_unit_seconds or DEFAULT_UNIT_SECONDS
+        return sum(self.unit_seconds.get(item_id, default) * quantity for item_id, quantity in item_units(order).items())
+
+    def estimate(self, queue, now=None):
+        """
+        調理中の注文 [(注文ID, フィードの注文データ)] (注文順) の提供予定を見積もる。
+        {'orders': {注文ID: {...}}, 'queueSeconds': 全部できるまでの秒数, 'newOrderSeconds': 今注文した場合の待ち秒数, ...}
+        """
+        now = time.time() if now is None else now
+        throughput = self.throughput_per_minute(now)
+        with self._lock:
+            # まだ何も学習していなければ、直近の処理件数 (それも無ければ既定値) から1注文あたりの時間を決める
+            per_order = 60 / throughput if throughput and not self.samples else None
+            cursor = now
+            estimates = {}
+            for position, (order_id, order) in enumerate(queue):
+                seconds = per_order or self.order_seconds(order)
+                if position == 0:
+                    # 先頭の注文は、前の注文が提供可能になった時点から作り始めている
+                    started = max(order.get('createdAtMs', 0) / 1000, self.last_ready_at or 0)
+                    seconds = max(seconds - max(now - started, 0), 0)
+                cursor += seconds
+                estimates[order_id] = {'ticketNumber': order.get('ticketNumber', ''), 'position': position + 1,
+                                       'waitSeconds': round(cursor - now), 'estimatedReadyAt': _isoformat(cursor)}
+            new_order = per_order or (self.overall_unit_seconds or DEFAULT_UNIT_SECONDS) * (self.mean_units or 1)
+            return {
+                'generatedAt': _isoformat(now),
+                'queueLength': len(queue),
+                'queueSeconds': round(cursor - now),
+                'newOrderSeconds': round(cursor - now + new_order),
+                'throughputPerMinute': round(throughput, 2),
+                'samples': self.samples,
+                'orders': estimates,
+            }
+
+
+def _ewma(current, value):
+    return value if current is None else current + EWMA_ALPHA * (value - current)
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec='seconds')